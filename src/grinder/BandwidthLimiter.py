@@ -0,0 +1,223 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from grinder.GrinderExceptions import GrinderException
+
+LOG = logging.getLogger("grinder.BandwidthLimiter")
+
+# Layout of the bucket shared between processes: tokens available, time of the last refill
+BUCKET_FORMAT = "dd"
+BUCKET_SIZE = struct.calcsize(BUCKET_FORMAT)
+# Seconds of traffic which may be sent as a burst after the bucket was idle
+BURST_SECONDS = 1.0
+
+class LimitSchedule(object):
+    """
+    Bandwidth limits applying during windows of the day, (local time).
+
+    Parsed from a comma separated list of "HH:MM-HH:MM=KB" entries, a
+    limit of 0 lifts the limit during that window.  Windows may wrap past
+    midnight, i.e. "22:00-06:00=0".  The first matching window wins.
+    """
+    def __init__(self, spec):
+        """
+        @param spec: schedule, example: "08:00-18:00=500,18:00-23:00=2000"
+        @type spec: str
+        """
+        self.spec = spec
+        self.windows = []
+        for entry in spec.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            try:
+                window, limit = entry.split("=")
+                start, end = window.split("-")
+                self.windows.append((parseMinute(start), parseMinute(end), int(limit)))
+            except ValueError:
+                raise GrinderException("Invalid bandwidth schedule entry <%s>, expected HH:MM-HH:MM=KB" % (entry))
+
+    def limit(self, now=None):
+        """
+        @param now: seconds since the epoch, defaults to the current time
+        @type now: float
+
+        @return: limit in KB/sec of the window (now) falls in, None if it is in none of them
+        @rtype: int
+        """
+        if now is None:
+            now = time.time()
+        t = time.localtime(now)
+        minute = t[3] * 60 + t[4]
+        for start, end, limit in self.windows:
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+            if inside:
+                return limit
+        return None
+
+def parseMinute(value):
+    """
+    @return: minute of the day of a "HH:MM" string
+    @rtype: int
+    """
+    hours, minutes = value.strip().split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError(value)
+    return hours * 60 + minutes
+
+class BandwidthLimiter(object):
+    """
+    Token bucket limiting the aggregate rate of all transfers sharing it.
+
+    The bucket lives in a small memory mapped file guarded by flock, so the
+    ActiveObject children of every worker, (which receive a pickled copy of
+    this object), draw from the same bucket.  Transfers call consume() as
+    they receive data and sleep while the bucket is in deficit, so the limit
+    holds whatever the number of concurrent transfers.  Transfers driven from
+    a shared event loop, (grinder.MultiFetch), call draw() instead and pause
+    themselves for the delay it returns.
+    """
+    def __init__(self, max_speed=None, schedule=None, path=None):
+        """
+        @param max_speed: limit in KB/sec, None or 0 for no limit outside of (schedule)
+        @type max_speed: int
+
+        @param schedule: limits replacing (max_speed) during windows of the day
+        @type schedule: L{LimitSchedule} or str
+
+        @param path: file holding the bucket, a temporary file is created if None
+        @type path: str
+        """
+        self.max_speed = max_speed
+        if isinstance(schedule, basestring):
+            schedule = LimitSchedule(schedule)
+        self.schedule = schedule
+        self.owner = False
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="grinder-bandwidth-")
+            os.write(fd, struct.pack(BUCKET_FORMAT, 0.0, 0.0))
+            os.close(fd)
+            self.owner = True
+        self.path = path
+        self._init_local()
+
+    def _init_local(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_lock", "_pid", "_fd", "_map"):
+            del state[key]
+        # only the process which created the bucket removes it
+        state["owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def limit(self, now=None):
+        """
+        @return: limit in KB/sec in effect at (now), None if unlimited
+        @rtype: int
+        """
+        limit = None
+        if self.schedule is not None:
+            limit = self.schedule.limit(now)
+        if limit is None:
+            limit = self.max_speed
+        if not limit:
+            return None
+        return int(limit)
+
+    def _open(self):
+        if self._map is not None and self._pid == os.getpid():
+            return
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, BUCKET_SIZE)
+        self._pid = os.getpid()
+
+    def consume(self, nbytes):
+        """
+        Draws (nbytes) from the bucket, sleeping until they are covered by the limit
+
+        @return: seconds slept
+        @rtype: float
+        """
+        delay = self.draw(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def draw(self, nbytes):
+        """
+        Draws (nbytes) from the bucket without waiting for them to be covered by the limit
+
+        @return: seconds the caller should wait before receiving more data
+        @rtype: float
+        """
+        limit = self.limit()
+        if not limit:
+            return 0
+        rate = limit * 1024.0
+        burst = rate * BURST_SECONDS
+        self._lock.acquire()
+        try:
+            try:
+                self._open()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except (OSError, IOError, mmap.error), e:
+                LOG.warning("Unable to use bandwidth limiter %s: %s" % (self.path, e))
+                return 0
+            try:
+                tokens, last = struct.unpack(BUCKET_FORMAT, self._map[:BUCKET_SIZE])
+                now = time.time()
+                if last == 0:
+                    tokens = burst
+                else:
+                    tokens = min(burst, tokens + (now - last) * rate)
+                tokens -= nbytes
+                self._map[:BUCKET_SIZE] = struct.pack(BUCKET_FORMAT, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+        if tokens >= 0:
+            return 0
+        # the deficit is owed by this caller, later callers queue up behind it
+        return -tokens / rate
+
+    def close(self):
+        """
+        Releases the bucket, removing its file if created by this object
+        """
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._init_local()
+        if self.owner and os.path.exists(self.path):
+            os.unlink(self.path)
@@ -11,22 +11,82 @@
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
 import os
+import sys
 import time
 import pycurl
 import logging
+import threading
 import traceback
 import hashlib
 import types
 import unicodedata
 import urlparse
 from grinder.GrinderExceptions import GrinderException
-from grinder.ProgressTracker import ProgressTracker
+from grinder.ProgressTracker import ProgressTracker, ProgressThrottle, PROGRESS_INTERVAL
 from grinder import GrinderUtils
 from WriteFunction import WriteFunction
 from grinder.GrinderLock import GrinderLock
+from grinder.Retry import RetryPolicy, parseRetryAfter, SUCCESS_CODES
 
 LOG = logging.getLogger("grinder.BaseFetch")
 
+# Files of at least this many bytes are fetched in segments when segments > 1
+DEFAULT_SEGMENT_THRESHOLD = 100*1024*1024
+
+
+class Transfer(object):
+    """
+    State of a single in-flight download.
+    Created by BaseFetch.prepareTransfer() and consumed by setupCurl(),
+    completeTransfer() and failTransfer(), this allows a transfer to be
+    driven either by a blocking curl.perform() or by a pycurl.CurlMulti loop.
+    """
+    def __init__(self):
+        self.fileName = None
+        self.fetchURL = None
+        self.savePath = None
+        self.itemSize = None
+        self.hashtype = None
+        self.checksum = None
+        self.headers = None
+        self.retryTimes = 0
+        self.packages_location = None
+        self.verify_options = None
+        self.probing = None
+        self.force = False
+        self.filePath = None
+        self.repofilepath = None
+        self.store = None
+        # why the transfer is being retried, one of the grinder.Retry RETRY_ reasons
+        self.retry_reason = None
+        # seconds the server asked to wait before a retry, from a Retry-After header
+        self.retry_after = None
+        self.tmp_write_file = None
+        self.lock = None
+        self.wf = None
+        # response headers, collected only for conditional fetches of metadata
+        self.response_headers = None
+        # validators sent with a conditional fetch
+        self.validators = None
+
+
+class Segment(object):
+    """
+    A byte range, (inclusive), of a transfer fetched by BaseFetch.performSegmented()
+    """
+    def __init__(self, index, start, end, path):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.path = path
+        self.wf = None
+        self.status = None
+        self.retry_after = None
+        self.downloaded = 0
+
+    def length(self):
+        return self.end - self.start + 1
+
 
 class BaseFetch(object):
     STATUS_NOOP = 'noop'
@@ -37,6 +97,8 @@ class BaseFetch(object):
     STATUS_UNAUTHORIZED = "unauthorized"
     STATUS_SKIP_VALIDATE = "skip_validate"
     STATUS_REQUEUE = "requeue"
+    # the fetch failed and is to be retried later, the message is the number of retries left
+    STATUS_RETRY = "retry"
 
 
     SUCCESS = (STATUS_NOOP, STATUS_DOWNLOADED, STATUS_SKIP_VALIDATE)
@@ -49,7 +111,9 @@ class BaseFetch(object):
     def __init__(self, cacert=None, clicert=None, clikey=None,
             proxy_url=None, proxy_port=None, proxy_user=None,
             proxy_pass=None, sslverify=1, max_speed = None,
-            verify_options = None, tracker = None, num_retries=None):
+            verify_options = None, tracker = None, num_retries=None, verify_cache=None,
+            metadata_cache=None, segments=None, segment_threshold=None, limiter=None,
+            progress_interval=None, retry_policy=None):
         self.sslcacert = cacert
         self.sslclientcert = clicert
         self.sslclientkey = clikey
@@ -60,14 +124,43 @@ class BaseFetch(object):
         self.sslverify  = sslverify
         self.max_speed = max_speed
         self.verify_options = verify_options
+        self.verify_cache = verify_cache
+        self.metadata_cache = metadata_cache
+        # bandwidth budget shared with other fetchers, applies on top of max_speed
+        self.limiter = limiter
+        # seconds between progress reports of a transfer, each is a round trip
+        # to the parent when fetched in an ActiveObject child
+        self.progress_interval = PROGRESS_INTERVAL
+        if progress_interval is not None:
+            self.progress_interval = progress_interval
+        # grinder.ProgressSlots the progress of transfers is recorded in, when set
+        # by the ParallelFetch running this fetcher, rather than reported to the tracker
+        self.progress_slots = None
+        # when True, fetch() returns STATUS_RETRY rather than retrying a failed transfer
+        # itself, (set while fetching an item handed out by a ParallelFetch)
+        self.defer_retries = False
+        # grinder.ContentStore.ContentStore items with a known checksum are stored in,
+        # when set, in place of savePath and packages_location
+        self.content_store = None
+        # number of concurrent range requests used to fetch a large file
+        self.segments = 1
+        if segments:
+            self.segments = int(segments)
+        self.segment_threshold = DEFAULT_SEGMENT_THRESHOLD
+        if segment_threshold:
+            self.segment_threshold = int(segment_threshold)
         if not tracker:
             tracker = ProgressTracker()
         self.tracker = tracker
         self.num_retries = 2
         if num_retries is not None:
             self.num_retries=num_retries
+        # decides which failures are retried and how long to wait before each retry
+        if retry_policy is None:
+            retry_policy = RetryPolicy(self.num_retries)
+        self.retry_policy = retry_policy
 
-    def validateDownload(self, filePath, size, hashtype, checksum):
+    def validateDownload(self, filePath, size, hashtype, checksum, calchecksum=None):
         """
         @param filePath path to file
         @type filePath str
@@ -80,9 +173,13 @@ class BaseFetch(object):
 
         @param checksum value of file
         @type checksum
+
+        @param calchecksum checksum computed while the file was written, if None it is read from disk
+        @type calchecksum str
         """
         fileName = os.path.basename(filePath)
-        calchecksum = getFileChecksum(hashtype, filename=filePath)
+        if calchecksum is None:
+            calchecksum = getFileChecksum(hashtype, filename=filePath)
         # validate fetched data
         statinfo = os.stat(filePath)
         if statinfo.st_size != int(size) and int(size) > 0:
@@ -136,6 +233,31 @@ class BaseFetch(object):
             #LOG.debug("self=<%s>, fetchURL = %s, download_total = %s, downloaded = %s" % (self, fetchURL, download_total, downloaded))
             self.tracker.update_progress_download(fetchURL, download_total, downloaded)
 
+    def progressReporter(self):
+        """
+        @return: function called with (fetchURL, download_total, downloaded) as a transfer
+                 progresses, recording it in progress_slots when available, otherwise
+                 reporting it through update_bytes_transferred()
+        @rtype: callable
+        """
+        throttle = ProgressThrottle(self.update_bytes_transferred, self.progress_interval)
+        slots = self.progress_slots
+        if slots is None:
+            return throttle
+        def report(fetchURL, download_total, downloaded):
+            if not slots.write(fetchURL, download_total, downloaded):
+                throttle(fetchURL, download_total, downloaded)
+        return report
+
+    def resetProgress(self, fetchURL):
+        """
+        Discards the progress of a transfer which will be restarted
+        """
+        if self.progress_slots is not None:
+            # the parent must not sample the previous attempt's counters after the reset
+            self.progress_slots.clear()
+        self.reset_bytes_transferred(fetchURL)
+
     def fetch(self, fileName, fetchURL, savePath, itemSize=None, hashtype=None, checksum=None,
              headers=None, retryTimes=None, packages_location=None, verify_options=None, probing=None, force=False):
         """
@@ -178,11 +300,94 @@ class BaseFetch(object):
         @return true/false if item was fetched successfully
         @rtype bool
 
+        """
+        if retryTimes is None:
+            retryTimes = self.num_retries
+        attempt = 0
+        while True:
+            transfer = self.prepareTransfer(fileName, fetchURL, savePath, itemSize, hashtype, checksum,
+                                            headers, retryTimes, packages_location, verify_options, probing, force)
+            if not isinstance(transfer, Transfer):
+                return transfer
+            result = self.performTransfer(transfer)
+            if result is not None:
+                return result
+            attempt += 1
+            retryTimes = transfer.retryTimes
+            if self.defer_retries:
+                # the worker is free for other items until the retry is due,
+                # which may then be made by another process
+                transfer.lock.release()
+                return (BaseFetch.STATUS_RETRY, {"retries_left": retryTimes, "reason": transfer.retry_reason,
+                                                 "retry_after": transfer.retry_after})
+            delay = self.retryDelay(transfer, attempt)
+            LOG.info("Retrying fetch of %s in %.1f seconds, (%s)" % (fileName, delay, transfer.retry_reason))
+            time.sleep(delay)
+
+    def performTransfer(self, transfer):
+        """
+        Fetches the bits of a transfer returned by prepareTransfer()
+
+        @return (status, msg) tuple, or None if the transfer should be retried
+                with transfer.retryTimes attempts left
+        @rtype tuple
+        """
+        try:
+            status = None
+            if self.useSegments(transfer):
+                status = self.performSegmented(transfer)
+            if status is None:
+                curl = getCurlHandle()
+                try:
+                    self.setupCurl(curl, transfer)
+                    curl.perform()
+                    status = curl.getinfo(curl.HTTP_CODE)
+                finally:
+                    releaseCurlHandle(curl)
+            return self.completeTransfer(transfer, status)
+        except Exception, e:
+            return self.failTransfer(transfer, e)
+
+    def retryDelay(self, transfer, attempt):
+        """
+        @param attempt number of the retry about to be made, starting at 1
+        @type attempt int
+
+        @return seconds to wait before retrying (transfer)
+        @rtype float
+        """
+        return self.retry_policy.delay(attempt, transfer.retry_reason, transfer.retry_after)
+
+    def prepareTransfer(self, fileName, fetchURL, savePath, itemSize=None, hashtype=None, checksum=None,
+                        headers=None, retryTimes=None, packages_location=None, verify_options=None,
+                        probing=None, force=False):
+        """
+        Resolves the on disk location of an item, checks for an existing valid copy and
+        acquires the write lock.  Accepts the same parameters as fetch().
+
+        @return a (status, msg) tuple if no transfer is needed, otherwise a Transfer
+                ready to be handed to setupCurl()
+        @rtype tuple or L{Transfer}
         """
         if retryTimes is None:
             retryTimes = self.num_retries
 
-        if packages_location is not None:
+        store = None
+        if self.content_store is not None and hashtype and checksum and not force:
+            store = self.content_store
+        if store is not None:
+            # content is stored once, whichever repositories it belongs to,
+            # and linked into each repository directory
+            repofilepath = os.path.join(savePath, fileName)
+            filePath = store.lookup(hashtype, checksum)
+            if filePath is None:
+                filePath = store.path(hashtype, checksum, fileName)
+                if os.path.isfile(repofilepath) and not os.path.islink(repofilepath) and \
+                    verifyExisting(repofilepath, itemSize, hashtype, checksum, verify_options, self.verify_cache):
+                    store.adopt(repofilepath, filePath)
+                if os.path.exists(filePath):
+                    store.record(hashtype, checksum, filePath)
+        elif packages_location is not None:
             # this option is to store packages in a central location
             # and symlink pkgs to individual repo directories
             filePath = os.path.join(packages_location, fileName)
@@ -199,9 +404,11 @@ class BaseFetch(object):
             self.makeDirSafe(tempDirPath)
 
         if os.path.exists(filePath) and \
-            verifyExisting(filePath, itemSize, hashtype, checksum, verify_options) and not force:
+            verifyExisting(filePath, itemSize, hashtype, checksum, verify_options, self.verify_cache) and not force:
             LOG.debug("%s exists with expected information, no need to fetch." % (filePath))
-            if repofilepath is not None and not os.path.exists(repofilepath):
+            if store is not None:
+                store.materialize(filePath, repofilepath)
+            elif repofilepath is not None and not os.path.exists(repofilepath):
                 relFilePath = GrinderUtils.get_relative_path(filePath, repofilepath)
                 LOG.info("Symlink missing in repo directory. Creating link %s to %s" % (repofilepath, relFilePath))
                 if not os.path.islink(repofilepath):
@@ -231,138 +438,543 @@ class BaseFetch(object):
             # This means, either we still dont have a lock and hence not safe to proceed or
             # the acquired lock doesnt match current pid, return and let the next process handle it
             return (BaseFetch.STATUS_NOOP,None)
+
+        transfer = Transfer()
+        transfer.fileName = fileName
+        transfer.fetchURL = fetchURL
+        transfer.savePath = savePath
+        transfer.hashtype = hashtype
+        transfer.checksum = checksum
+        transfer.headers = headers
+        transfer.retryTimes = retryTimes
+        transfer.packages_location = packages_location
+        transfer.verify_options = verify_options
+        transfer.probing = probing
+        transfer.force = force
+        transfer.filePath = filePath
+        transfer.repofilepath = repofilepath
+        transfer.store = store
+        transfer.lock = grinder_write_locker
+        if force and self.metadata_cache is not None and not fetchURL.startswith("file:"):
+            # metadata is refetched on each sync, use a conditional request if possible
+            transfer.response_headers = {}
+        # callback logic to save and resume bits
+        transfer.tmp_write_file = get_temp_file_name(filePath)
+        if itemSize is not None:
+            itemSize = int(itemSize)
+        transfer.itemSize = itemSize
+        return transfer
+
+    def setupCurl(self, curl, transfer, block=True):
+        """
+        Configures a curl handle to perform the given transfer.
+
+        @param curl handle to configure, will not be performed here
+        @type curl pycurl.Curl
+
+        @param transfer as returned from prepareTransfer()
+        @type transfer L{Transfer}
+
+        @param block if False the bandwidth limiter is not waited on while data is received,
+                     the handle pauses itself instead, to be unpaused by the caller
+                     once transfer.wf.resume_at has passed
+        @type block bool
+        """
+        self.configureCurl(curl, transfer)
+        wf = WriteFunction(transfer.tmp_write_file, transfer.itemSize, transfer.hashtype,
+                           limiter=self.limiter, block=block)
+        transfer.wf = wf
+        if wf.offset > 0:
+            # setup file resume
+            LOG.info("A partial download file already exists; prepare to resume download.")
+            curl.setopt(pycurl.RESUME_FROM, wf.offset)
+        curl.setopt(curl.WRITEFUNCTION, wf.callback)
+        curl.setopt(curl.FOLLOWLOCATION, 1)
+        if not transfer.probing:
+            LOG.info("Fetching %s bytes: %s from %s" % (transfer.itemSize or "Unknown", transfer.fileName, transfer.fetchURL))
+
+    def useSegments(self, transfer):
+        """
+        @return True if the transfer should be fetched with concurrent range requests
+        @rtype bool
+        """
+        if self.segments < 2 or not transfer.itemSize or transfer.itemSize < self.segment_threshold:
+            return False
+        if transfer.response_headers is not None:
+            # conditional fetch of metadata
+            return False
+        if os.path.exists(transfer.tmp_write_file):
+            # resume the previous single stream download
+            return False
+        scheme = urlparse.urlparse(transfer.fetchURL)[0]
+        return scheme in ("http", "https")
+
+    def performSegmented(self, transfer):
+        """
+        Fetches a transfer with concurrent range requests, each segment is written
+        to its own .part.N file, allowing it to be resumed and retried individually.
+        Segments are joined into the transfer's .part file once all are complete.
+        Retries of segments are taken from the transfer's, (transfer.retryTimes),
+        a segment refused for good, (such as a 404), ends the transfer.
+
+        @param transfer as returned from prepareTransfer()
+        @type transfer L{Transfer}
+
+        @return HTTP status to complete the transfer with, 206 once fetched or the status a
+                segment failed with, None if the server does not honor range requests
+                and the transfer should be fetched as a single stream
+        @rtype int
+        """
+        trackerURL = transfer.fetchURL
+        size = transfer.itemSize
+        segment_size = (size + self.segments - 1) / self.segments
+        segments = []
+        for index in range(self.segments):
+            start = index * segment_size
+            if start >= size:
+                break
+            end = min(size, start + segment_size) - 1
+            segments.append(Segment(index, start, end, "%s.%s" % (transfer.tmp_write_file, index)))
+        report = self.progressReporter()
+        def progress():
+            downloaded = 0
+            for segment in segments:
+                downloaded += segment.downloaded
+            report(trackerURL, size, downloaded)
+        if not transfer.probing:
+            LOG.info("Fetching %s bytes: %s from %s in %s segments" % (size, transfer.fileName, trackerURL, len(segments)))
+        multi = pycurl.CurlMulti()
+        active = {}
         try:
-            #f = open(filePath, "wb")
-            curl = pycurl.Curl()
-            def item_progress_callback(download_total, downloaded, upload_total, uploaded):
-                #LOG.debug("%s status %s/%s bytes" % (fileName, downloaded, download_total))
-                self.update_bytes_transferred(fetchURL, download_total, downloaded)
-            curl.setopt(curl.NOPROGRESS, False)
-            curl.setopt(curl.PROGRESSFUNCTION, item_progress_callback)
-            if self.max_speed:
-                #Convert KB/sec to Bytes/sec for MAC_RECV_SPEED_LARGE
-                limit = self.max_speed*1024
-                curl.setopt(curl.MAX_RECV_SPEED_LARGE, limit)
-            curl.setopt(curl.VERBOSE,0)
-            # We have seen rare and intermittent problems with grinder syncing against a remote server
-            #  the remote server leaves a socket open but does not send back data.  Grinder has been stuck
-            #  for several days looping over a poll of the socket with no data being sent.
-            #   Slower than 1000 byes over 5 minutes will mark the connection as too slow and abort
-            curl.setopt(curl.LOW_SPEED_LIMIT,1000)
-            curl.setopt(curl.LOW_SPEED_TIME,60*5)
-            # When using multiple threads you should set the CURLOPT_NOSIGNAL option to 1 for all handles
-            # May impact DNS timeouts
-            curl.setopt(curl.NOSIGNAL, 1)
-
-            if type(fetchURL) == types.UnicodeType:
-                #pycurl does not accept unicode strings for a URL, so we need to convert
-                fetchURL = unicodedata.normalize('NFKD', fetchURL).encode('ascii','ignore')
-            #clean url path from double slashes
-            fetchURL = urlparse.urljoin(fetchURL, urlparse.urlparse(fetchURL).path.replace('//','/'))
-            curl.setopt(curl.URL, fetchURL)
-            if self.sslcacert:
-                curl.setopt(curl.CAINFO, self.sslcacert)
-            if self.sslclientcert:
-                curl.setopt(curl.SSLCERT, self.sslclientcert)
-            if self.sslclientkey:
-                curl.setopt(curl.SSLKEY, self.sslclientkey)
-            if not self.sslverify:
-                curl.setopt(curl.SSL_VERIFYPEER, 0)
-            if headers:
-                curl.setopt(pycurl.HTTPHEADER, curlifyHeaders(headers))
-            if self.proxy_url:
-                if not self.proxy_port:
-                    raise GrinderException("Proxy url defined, but no port specified")
-                curl.setopt(pycurl.PROXY, self.proxy_url)
-                curl.setopt(pycurl.PROXYPORT, int(self.proxy_port))
-                curl.setopt(pycurl.PROXYTYPE, pycurl.PROXYTYPE_HTTP)
-                if self.proxy_user:
-                    if not self.proxy_pass:
-                        raise GrinderException("Proxy username is defined, but no password was specified")
-                    curl.setopt(pycurl.PROXYAUTH, pycurl.HTTPAUTH_BASIC)
-                    curl.setopt(pycurl.PROXYUSERPWD, "%s:%s" % (self.proxy_user, self.proxy_pass))
-            # callback logic to save and resume bits
-            tmp_write_file = get_temp_file_name(filePath)
-            if itemSize is not None:
-                itemSize = int(itemSize)
-            wf = WriteFunction(tmp_write_file, itemSize)
-            if wf.offset > 0:
-                # setup file resume
-                LOG.info("A partial download file already exists; prepare to resume download.")
-                curl.setopt(pycurl.RESUME_FROM, wf.offset)
-            curl.setopt(curl.WRITEFUNCTION, wf.callback)
-            curl.setopt(curl.FOLLOWLOCATION, 1)
-            if not probing:
-                LOG.info("Fetching %s bytes: %s from %s" % (itemSize or "Unknown", fileName, fetchURL))
-            curl.perform()
-            status = curl.getinfo(curl.HTTP_CODE)
-            curl.close()
-            wf.cleanup()
-            # this tmp file could be closed by other concurrent processes
-            if os.path.exists(tmp_write_file):
-                # download complete rename the .part file
-                os.rename(tmp_write_file, filePath)
-            # validate the fetched bits
-            if itemSize is not None and hashtype is not None and checksum is not None:
-                vstatus = self.validateDownload(filePath, int(itemSize), hashtype, checksum)
-            else:
-                vstatus = BaseFetch.STATUS_SKIP_VALIDATE
-            if status == 401:
-                LOG.error("Unauthorized request from: %s" % (fetchURL))
-                grinder_write_locker.release()
-                cleanup(filePath)
-                return (BaseFetch.STATUS_UNAUTHORIZED, "HTTP status code of %s received for %s" % (status, fetchURL))
-            if status not in (0, 200, 206, 226):
-                # 0 - for local syncs
-                # 200 - is typical http return code, yet 206 and 226 have also been seen to be returned and valid
-                if retryTimes > 0 and not fetchURL.startswith("file:"):
-                    retryTimes -= 1
-                    LOG.warn("Retrying fetch of: %s with %s retry attempts left. HTTP status was %s" % (fileName, retryTimes, status))
-                    cleanup(filePath)
-                    self.reset_bytes_transferred(fetchURL)
-                    return self.fetch(fileName, fetchURL, savePath, itemSize, hashtype,
-                                      checksum , headers, retryTimes, packages_location)
-                grinder_write_locker.release()
-                cleanup(filePath)
-                LOG.warn("ERROR: Response = %s fetching %s." % (status, fetchURL))
-                return (BaseFetch.STATUS_ERROR, "HTTP status code of %s received for %s" % (status, fetchURL))
-            if vstatus in [BaseFetch.STATUS_ERROR, BaseFetch.STATUS_SIZE_MISSMATCH,
-                BaseFetch.STATUS_MD5_MISSMATCH] and retryTimes > 0:
+            for segment in segments:
+                self.startSegment(multi, active, transfer, segment, progress)
+            while active:
+                while True:
+                    ret, num_handles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    num_q, ok_list, err_list = multi.info_read()
+                    finished = [(curl, None) for curl in ok_list]
+                    finished.extend([(curl, pycurl.error(errno, errmsg)) for curl, errno, errmsg in err_list])
+                    for curl, error in finished:
+                        segment = active.pop(curl)
+                        multi.remove_handle(curl)
+                        releaseCurlHandle(curl)
+                        segment.wf.cleanup()
+                        if segment.status == 200:
+                            # Range was ignored, discard the segments
+                            LOG.info("%s does not support range requests, fetching as a single stream" % (trackerURL))
+                            self.abortSegments(multi, active)
+                            for other in segments:
+                                cleanup(other.path)
+                            self.resetProgress(trackerURL)
+                            return None
+                        if segment.status is not None and segment.status != 206:
+                            # the response, not the write aborted for it, is what failed
+                            reason = self.retry_policy.classify(status=segment.status, retry_after=segment.retry_after)
+                            error = "HTTP status code of %s" % (segment.status)
+                        elif error is not None:
+                            reason = self.retry_policy.classify(error=error)
+                        elif os.path.getsize(segment.path) != segment.length():
+                            reason = self.retry_policy.classify(mismatch=True)
+                            error = "received %s of %s bytes" % (os.path.getsize(segment.path), segment.length())
+                        else:
+                            continue
+                        if reason is None or transfer.retryTimes <= 0:
+                            LOG.warn("Segment %s of %s failed: %s" % (segment.index, trackerURL, error))
+                            if segment.status is not None and segment.status != 206:
+                                transfer.retry_after = segment.retry_after
+                                return segment.status
+                            if isinstance(error, pycurl.error):
+                                # left to failTransfer() to classify as it would a single stream
+                                raise error
+                            raise GrinderException("Segment %s of %s failed: %s" % (segment.index, trackerURL, error))
+                        transfer.retryTimes -= 1
+                        transfer.retry_reason = reason
+                        LOG.warn("Retrying segment %s of %s with %s retry attempts left: %s" % \
+                                 (segment.index, trackerURL, transfer.retryTimes, error))
+                        if os.path.exists(segment.path) and os.path.getsize(segment.path) > segment.length():
+                            cleanup(segment.path)
+                        self.startSegment(multi, active, transfer, segment, progress)
+                    if num_q == 0:
+                        break
+                if active:
+                    multi.select(1.0)
+        finally:
+            self.abortSegments(multi, active)
+            multi.close()
+        # Join the segments, the checksum is computed as they are copied
+        wf = WriteFunction(transfer.tmp_write_file, size, transfer.hashtype)
+        transfer.wf = wf
+        for segment in segments:
+            f = open(segment.path, "rb")
+            try:
+                while 1:
+                    buffer = f.read(65536)
+                    if not buffer:
+                        break
+                    wf.callback(buffer)
+            finally:
+                f.close()
+        for segment in segments:
+            cleanup(segment.path)
+        return 206
+
+    def cleanupSegments(self, transfer):
+        """
+        Removes the .part.N files of a segmented transfer which will not be resumed
+        """
+        dirname, basename = os.path.split(transfer.tmp_write_file)
+        if not os.path.isdir(dirname or "."):
+            return
+        prefix = basename + "."
+        for name in os.listdir(dirname or "."):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                cleanup(os.path.join(dirname, name))
+
+    def startSegment(self, multi, active, transfer, segment, progress):
+        curl = getCurlHandle()
+        transfer_header = self.configureCurl(curl, transfer)
+        if self.max_speed:
+            # max_speed applies to the transfer as a whole
+            curl.setopt(pycurl.MAX_RECV_SPEED_LARGE, self.max_speed*1024/self.segments)
+        segment.wf = WriteFunction(segment.path, segment.length(), limiter=self.limiter)
+        segment.status = None
+        segment.downloaded = segment.wf.offset
+        if segment.wf.offset >= segment.length():
+            # complete from an earlier attempt
+            segment.wf.cleanup()
+            releaseCurlHandle(curl)
+            return
+        def header_callback(line):
+            # the transfer still sees Retry-After and the other response headers
+            transfer_header(line)
+            if line.startswith("HTTP/"):
+                segment.retry_after = None
+                try:
+                    segment.status = int(line.split()[1])
+                except (IndexError, ValueError):
+                    segment.status = None
+            elif line.lower().startswith("retry-after:"):
+                segment.retry_after = parseRetryAfter(line.split(":", 1)[1])
+        def write_callback(chunk):
+            if segment.status != 206:
+                # anything other than partial content must not be written to a segment,
+                # returning a short count aborts the transfer
+                return 0
+            segment.wf.callback(chunk)
+        def progress_callback(download_total, downloaded, upload_total, uploaded):
+            segment.downloaded = segment.wf.offset + downloaded
+            progress()
+        curl.setopt(pycurl.PROGRESSFUNCTION, progress_callback)
+        curl.setopt(pycurl.HEADERFUNCTION, header_callback)
+        curl.setopt(pycurl.WRITEFUNCTION, write_callback)
+        curl.setopt(pycurl.RANGE, "%s-%s" % (segment.start + segment.wf.offset, segment.end))
+        curl.setopt(pycurl.FOLLOWLOCATION, 1)
+        active[curl] = segment
+        multi.add_handle(curl)
+
+    def abortSegments(self, multi, active):
+        """
+        Tear down in-flight segments, their .part.N files are kept to be resumed
+        """
+        for curl, segment in active.items():
+            multi.remove_handle(curl)
+            releaseCurlHandle(curl)
+            segment.wf.cleanup()
+        active.clear()
+
+    def configureCurl(self, curl, transfer):
+        """
+        Sets the progress, connection, SSL, header and proxy options of a curl
+        handle for the given transfer, where the bits are written is left to the caller.
+
+        @return the function installed as HEADERFUNCTION, to be called by one replacing it
+        @rtype function
+        """
+        fetchURL = transfer.fetchURL
+        report = self.progressReporter()
+        def item_progress_callback(download_total, downloaded, upload_total, uploaded):
+            #LOG.debug("%s status %s/%s bytes" % (fileName, downloaded, download_total))
+            report(fetchURL, download_total, downloaded)
+        curl.setopt(curl.NOPROGRESS, False)
+        curl.setopt(curl.PROGRESSFUNCTION, item_progress_callback)
+        if self.max_speed:
+            #Convert KB/sec to Bytes/sec for MAC_RECV_SPEED_LARGE
+            limit = self.max_speed*1024
+            curl.setopt(curl.MAX_RECV_SPEED_LARGE, limit)
+        curl.setopt(curl.VERBOSE,0)
+        # We have seen rare and intermittent problems with grinder syncing against a remote server
+        #  the remote server leaves a socket open but does not send back data.  Grinder has been stuck
+        #  for several days looping over a poll of the socket with no data being sent.
+        #   Slower than 1000 byes over 5 minutes will mark the connection as too slow and abort
+        curl.setopt(curl.LOW_SPEED_LIMIT,1000)
+        curl.setopt(curl.LOW_SPEED_TIME,60*5)
+        # When using multiple threads you should set the CURLOPT_NOSIGNAL option to 1 for all handles
+        # May impact DNS timeouts
+        curl.setopt(curl.NOSIGNAL, 1)
+
+        if type(fetchURL) == types.UnicodeType:
+            #pycurl does not accept unicode strings for a URL, so we need to convert
+            fetchURL = unicodedata.normalize('NFKD', fetchURL).encode('ascii','ignore')
+        #clean url path from double slashes
+        fetchURL = urlparse.urljoin(fetchURL, urlparse.urlparse(fetchURL).path.replace('//','/'))
+        transfer.fetchURL = fetchURL
+        curl.setopt(curl.URL, fetchURL)
+        if self.sslcacert:
+            curl.setopt(curl.CAINFO, self.sslcacert)
+        if self.sslclientcert:
+            curl.setopt(curl.SSLCERT, self.sslclientcert)
+        if self.sslclientkey:
+            curl.setopt(curl.SSLKEY, self.sslclientkey)
+        if not self.sslverify:
+            curl.setopt(curl.SSL_VERIFYPEER, 0)
+        headers = transfer.headers
+        if transfer.response_headers is not None:
+            transfer.validators = self.metadata_cache.lookup(fetchURL, transfer.filePath)
+            if transfer.validators:
+                headers = conditionalHeaders(headers, transfer.validators)
+        def header_callback(line):
+            if line.startswith("HTTP/"):
+                # a new response, (i.e. after a redirect)
+                transfer.retry_after = None
+                if transfer.response_headers is not None:
+                    transfer.response_headers.clear()
+            elif ":" in line:
+                key, value = line.split(":", 1)
+                key = key.strip().lower()
+                if key == "retry-after":
+                    transfer.retry_after = parseRetryAfter(value)
+                if transfer.response_headers is not None:
+                    transfer.response_headers[key] = value.strip()
+        curl.setopt(pycurl.HEADERFUNCTION, header_callback)
+        if headers:
+            curl.setopt(pycurl.HTTPHEADER, curlifyHeaders(headers))
+        if self.proxy_url:
+            if not self.proxy_port:
+                raise GrinderException("Proxy url defined, but no port specified")
+            curl.setopt(pycurl.PROXY, self.proxy_url)
+            curl.setopt(pycurl.PROXYPORT, int(self.proxy_port))
+            curl.setopt(pycurl.PROXYTYPE, pycurl.PROXYTYPE_HTTP)
+            if self.proxy_user:
+                if not self.proxy_pass:
+                    raise GrinderException("Proxy username is defined, but no password was specified")
+                curl.setopt(pycurl.PROXYAUTH, pycurl.HTTPAUTH_BASIC)
+                curl.setopt(pycurl.PROXYUSERPWD, "%s:%s" % (self.proxy_user, self.proxy_pass))
+        return header_callback
+
+    def completeTransfer(self, transfer, status):
+        """
+        Finishes a performed transfer; validates the bits, links them into the
+        repo directory and releases the write lock.
+
+        @param transfer as returned from prepareTransfer() and configured by setupCurl()
+        @type transfer L{Transfer}
+
+        @param status HTTP status code of the performed transfer
+        @type status int
+
+        @return (status, msg) tuple, or None if the transfer should be retried
+                with transfer.retryTimes attempts left
+        @rtype tuple
+        """
+        fileName = transfer.fileName
+        fetchURL = transfer.fetchURL
+        filePath = transfer.filePath
+        itemSize = transfer.itemSize
+        hashtype = transfer.hashtype
+        checksum = transfer.checksum
+        grinder_write_locker = transfer.lock
+        calchecksum = None
+        if transfer.wf is not None:
+            calchecksum = transfer.wf.hexdigest()
+            transfer.wf.cleanup()
+        if status == 304 and transfer.validators:
+            LOG.info("%s is unchanged since it was last fetched" % (fetchURL))
+            cleanup(transfer.tmp_write_file)
+            grinder_write_locker.release()
+            return (BaseFetch.STATUS_NOOP, None)
+        # an existing file is only replaced by bits which were received successfully and are valid,
+        # a failed refetch of metadata, (force), leaves the copy fetched last time in place
+        if transfer.force:
+            stale = None
+        else:
+            stale = filePath
+        if status == 401:
+            LOG.error("Unauthorized request from: %s" % (fetchURL))
+            grinder_write_locker.release()
+            cleanup(transfer.tmp_write_file)
+            self.cleanupSegments(transfer)
+            return (BaseFetch.STATUS_UNAUTHORIZED, "HTTP status code of %s received for %s" % (status, fetchURL))
+        if status not in SUCCESS_CODES:
+            # 0 - for local syncs
+            # 200 - is typical http return code, yet 206 and 226 have also been seen to be returned and valid
+            reason = self.retry_policy.classify(status=status, retry_after=transfer.retry_after)
+            cleanup(transfer.tmp_write_file)
+            if reason is not None and transfer.retryTimes > 0 and not fetchURL.startswith("file:"):
+                transfer.retryTimes -= 1
+                transfer.retry_reason = reason
+                LOG.warn("Retrying fetch of: %s with %s retry attempts left. HTTP status was %s" % (fileName, transfer.retryTimes, status))
+                self.resetProgress(fetchURL)
+                return None
+            grinder_write_locker.release()
+            self.cleanupSegments(transfer)
+            if stale is None and transfer.probing and reason is None:
+                # a probe refused for good, (such as a 404), finds the file gone from the repository
+                stale = filePath
+            if stale is not None:
+                cleanup(stale)
+            LOG.warn("ERROR: Response = %s fetching %s." % (status, fetchURL))
+            return (BaseFetch.STATUS_ERROR, "HTTP status code of %s received for %s" % (status, fetchURL))
+        # this tmp file could be closed by other concurrent processes
+        if os.path.exists(transfer.tmp_write_file):
+            downloadPath = transfer.tmp_write_file
+        else:
+            # bits were not written by us, the inline checksum does not apply
+            downloadPath = filePath
+            calchecksum = None
+        # validate the fetched bits
+        if itemSize is not None and hashtype is not None and checksum is not None:
+            vstatus = self.validateDownload(downloadPath, int(itemSize), hashtype, checksum, calchecksum)
+        else:
+            vstatus = BaseFetch.STATUS_SKIP_VALIDATE
+        if vstatus in [BaseFetch.STATUS_ERROR, BaseFetch.STATUS_SIZE_MISSMATCH,
+            BaseFetch.STATUS_MD5_MISSMATCH]:
+            cleanup(downloadPath)
+            if transfer.retryTimes > 0:
                 #
                 # Incase of a network glitch or issue with RHN, retry the rpm fetch
                 #
-                retryTimes -= 1
-                LOG.error("Retrying fetch of: %s with %s retry attempts left.  VerifyStatus was %s" % (fileName, retryTimes, vstatus))
-                cleanup(filePath)
-                self.reset_bytes_transferred(fetchURL)
-                return self.fetch(fileName, fetchURL, savePath, itemSize, hashtype,
-                                  checksum, headers, retryTimes, packages_location)
-            if packages_location and os.path.exists(filePath):
-                relFilePath = GrinderUtils.get_relative_path(filePath, repofilepath)
-                LOG.info("Create a link in repo directory for the package at %s to %s" % (repofilepath, relFilePath))
-                self.makeSafeSymlink(relFilePath, repofilepath)
+                transfer.retryTimes -= 1
+                transfer.retry_reason = self.retry_policy.classify(mismatch=True)
+                LOG.error("Retrying fetch of: %s with %s retry attempts left.  VerifyStatus was %s" % (fileName, transfer.retryTimes, vstatus))
+                self.resetProgress(fetchURL)
+                return None
             grinder_write_locker.release()
-            LOG.debug("Successfully Fetched Package - [%s]" % filePath)
+            if stale is not None:
+                cleanup(stale)
             return (vstatus, None)
-        except Exception, e:
-            cleanup(tmp_write_file)
-            cleanup(filePath)
-            if probing:
-                LOG.info("Probed for %s and determined it is missing." % (fetchURL))
-                grinder_write_locker.release()
-                return BaseFetch.STATUS_ERROR, None
-            tb_info = traceback.format_exc()
-            LOG.error("Caught exception<%s> in fetch(%s, %s)" % (e, fileName, fetchURL))
-            LOG.error("%s" % (tb_info))
-            if retryTimes > 0 and not fetchURL.startswith("file:"):
-                retryTimes -= 1
-                #grinder_write_locker.release()
-                LOG.error("Retrying fetch of: %s with %s retry attempts left." % (fileName, retryTimes))
-                self.reset_bytes_transferred(fetchURL)
-                return self.fetch(fileName, fetchURL, savePath, itemSize, hashtype,
-                                  checksum, headers, retryTimes, packages_location)
-            grinder_write_locker.release()
-            raise
+        if downloadPath != filePath:
+            # download complete rename the .part file
+            os.rename(downloadPath, filePath)
+        if vstatus == BaseFetch.STATUS_DOWNLOADED and self.verify_cache is not None:
+            self.verify_cache.record(filePath, hashtype, checksum)
+        if transfer.response_headers is not None and os.path.exists(filePath):
+            self.metadata_cache.record(fetchURL, filePath, transfer.response_headers.get("etag"),
+                                       transfer.response_headers.get("last-modified"))
+        if transfer.store is not None and os.path.exists(filePath):
+            if vstatus == BaseFetch.STATUS_DOWNLOADED:
+                transfer.store.record(hashtype, checksum, filePath)
+            transfer.store.materialize(filePath, transfer.repofilepath)
+        elif transfer.packages_location and os.path.exists(filePath):
+            relFilePath = GrinderUtils.get_relative_path(filePath, transfer.repofilepath)
+            LOG.info("Create a link in repo directory for the package at %s to %s" % (transfer.repofilepath, relFilePath))
+            self.makeSafeSymlink(relFilePath, transfer.repofilepath)
+        grinder_write_locker.release()
+        LOG.debug("Successfully Fetched Package - [%s]" % filePath)
+        return (vstatus, None)
+
+    def failTransfer(self, transfer, e):
+        """
+        Handles an exception raised while performing or completing a transfer.
+
+        @param transfer the transfer which failed
+        @type transfer L{Transfer}
+
+        @param e the exception caught
+        @type e Exception
+
+        @return (status, msg) tuple, or None if the transfer should be retried
+                with transfer.retryTimes attempts left.  Re-raises (e) when no
+                retries are left.
+        @rtype tuple
+        """
+        if transfer.wf is not None:
+            transfer.wf.cleanup()
+        reason = self.retry_policy.classify(error=e)
+        resume = self.retry_policy.resumable(reason) and transfer.retryTimes > 0 and \
+            not transfer.probing and not transfer.fetchURL.startswith("file:")
+        if not resume:
+            cleanup(transfer.tmp_write_file)
+            self.cleanupSegments(transfer)
+        if not transfer.force or (transfer.probing and transfer.fetchURL.startswith("file:")):
+            # a local file which can not be read when probed is gone from the repository
+            cleanup(transfer.filePath)
+        if transfer.probing:
+            LOG.info("Probed for %s and determined it is missing." % (transfer.fetchURL))
+            transfer.lock.release()
+            return BaseFetch.STATUS_ERROR, None
+        tb_info = traceback.format_exc()
+        LOG.error("Caught exception<%s> in fetch(%s, %s)" % (e, transfer.fileName, transfer.fetchURL))
+        LOG.error("%s" % (tb_info))
+        if reason is not None and transfer.retryTimes > 0 and not transfer.fetchURL.startswith("file:"):
+            transfer.retryTimes -= 1
+            transfer.retry_reason = reason
+            if resume:
+                LOG.error("Retrying fetch of: %s with %s retry attempts left, resuming from the partial download." % (transfer.fileName, transfer.retryTimes))
+            else:
+                LOG.error("Retrying fetch of: %s with %s retry attempts left." % (transfer.fileName, transfer.retryTimes))
+            self.resetProgress(transfer.fetchURL)
+            return None
+        transfer.lock.release()
+        raise e
+
+    def itemPath(self, info):
+        """
+        @return: path the content of the item described by (info) is kept at once fetched
+        @rtype: str
+        """
+        args = self.fetchArgs(info)
+        hashtype = args.get("hashtype")
+        checksum = args.get("checksum")
+        if self.content_store is not None and hashtype and checksum:
+            path = self.content_store.lookup(hashtype, checksum)
+            if path is None:
+                path = self.content_store.path(hashtype, checksum, args["fileName"])
+            return path
+        if args.get("packages_location"):
+            return os.path.join(args["packages_location"], args["fileName"])
+        return os.path.join(args["savePath"], args["fileName"])
+
+    def fetchQueuedItem(self, info):
+        """
+        Fetches an item handed out by a ParallelFetch.  A failed transfer is not
+        retried here, STATUS_RETRY is returned instead so the item is retried once
+        its backoff expired, without holding a worker meanwhile.  Its retries left
+        are carried in the item's "retries_left".
+
+        @return (status, msg) tuple, as returned by fetchItem()
+        @rtype tuple
+        """
+        num_retries = self.num_retries
+        if info.get("retries_left") is not None:
+            self.num_retries = info["retries_left"]
+        self.defer_retries = True
+        try:
+            return self.fetchItem(info)
+        finally:
+            self.defer_retries = False
+            self.num_retries = num_retries
+
+    def fetchItems(self, items):
+        """
+        Fetches (items) one after another with fetchQueuedItem(), intended to be
+        streamed from an ActiveObject child so a worker is handed a batch of
+        items per round trip and learns of each result as soon as it is known.
+
+        @param items: itemInfo of each item to fetch
+        @type items: list
+
+        @return: generator of (index of the item in (items), (status, msg))
+        """
+        for index in range(len(items)):
+            try:
+                result = self.fetchQueuedItem(items[index])
+            except Exception, e:
+                LOG.error("%s" % (traceback.format_exc()))
+                result = (BaseFetch.STATUS_ERROR, getErrorInfo(e))
+            yield (index, result)
 
     def __getstate__(self):
         """
@@ -373,6 +985,75 @@ class BaseFetch(object):
         state.pop('tracker', None)
         return state
 
+def getErrorInfo(e):
+    """
+    Builds the error details reported through markStatus() for an exception
+    Intended to be called from within the 'except' block which caught (e)
+    """
+    errorInfo = {}
+    exctype, value = sys.exc_info()[:2]
+    errorInfo["error_type"] = str(exctype)
+    errorInfo["value"] = str(value)
+    # Keeping "error" for backward compatibility with Pulp v1
+    errorInfo["error"] = str(value)
+    errorInfo["traceback"] = traceback.format_exc().splitlines()
+    errorInfo["exception"] = e
+    return errorInfo
+
+# Curl handles are reused so consecutive fetches from the same host keep their
+# connection alive.  Handles are cached per thread, (an ActiveObject child runs
+# a single thread), and all handles in a process share DNS, SSL session and,
+# where libcurl supports it, connection caches.
+_curl_share = None
+_curl_share_lock = threading.Lock()
+_curl_handles = threading.local()
+
+def getCurlShare():
+    global _curl_share
+    _curl_share_lock.acquire()
+    try:
+        if _curl_share is None:
+            share = pycurl.CurlShare()
+            share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+            share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+            if hasattr(pycurl, "LOCK_DATA_CONNECT"):
+                try:
+                    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+                except pycurl.error, e:
+                    LOG.debug("Connection cache sharing unavailable: %s" % (e))
+            _curl_share = share
+        return _curl_share
+    finally:
+        _curl_share_lock.release()
+
+def getCurlHandle():
+    """
+    @return a curl handle with default options for use by the calling thread
+    @rtype pycurl.Curl
+    """
+    handles = getattr(_curl_handles, "free", None)
+    if handles:
+        return handles.pop()
+    curl = pycurl.Curl()
+    curl.setopt(pycurl.SHARE, getCurlShare())
+    return curl
+
+def releaseCurlHandle(curl):
+    """
+    Return a handle obtained from getCurlHandle() so it may be reused.
+    All options are reset, the connection cache of the handle is kept.
+    """
+    try:
+        curl.reset()
+        curl.setopt(pycurl.SHARE, getCurlShare())
+    except pycurl.error, e:
+        LOG.debug("Discarding curl handle: %s" % (e))
+        curl.close()
+        return
+    if not hasattr(_curl_handles, "free"):
+        _curl_handles.free = []
+    _curl_handles.free.append(curl)
+
 def get_temp_file_name(file_name):
     return "%s.%s" % (file_name, "part")
 
@@ -414,7 +1095,7 @@ def getFileChecksum(hashtype, filename=None, fd=None, file=None, buffer_size=Non
         f.close()
     return m.hexdigest()
 
-def verifyExisting(filePath, expectedSize, hashtype, checksum, options=None):
+def verifyExisting(filePath, expectedSize, hashtype, checksum, options=None, cache=None):
     """
     @param filePath file path of an existing file
     @type filePath str
@@ -425,16 +1106,23 @@ def verifyExisting(filePath, expectedSize, hashtype, checksum, options=None):
     @param checksum value
     @type checksum str
 
-    @param options Optional dictionary of validation steps, expects boolean for values: size, checksum
+    @param options Optional dictionary of validation steps, expects boolean for values: size, checksum, reverify
+                   "reverify" forces the checksum to be computed even if recorded in cache
     @type options dict{str, str}
+
+    @param cache Optional record of checksums previously computed for existing files
+    @type cache grinder.VerifyCache.VerifyCache
     """
     size_check = True
     checksum_check = True
+    reverify = False
     if options and isinstance(options, dict):
         if options.has_key("size"):
             size_check = options["size"]
         if options.has_key("checksum"):
             checksum_check = options["checksum"]
+        if options.has_key("reverify"):
+            reverify = options["reverify"]
 
     if size_check and expectedSize:
         statinfo = os.stat(filePath)
@@ -442,11 +1130,30 @@ def verifyExisting(filePath, expectedSize, hashtype, checksum, options=None):
             return False
 
     if checksum_check and hashtype and checksum:
-        if getFileChecksum(hashtype, filename=filePath) != checksum:
+        calchecksum = None
+        if cache is not None and not reverify:
+            calchecksum = cache.lookup(filePath, hashtype)
+        if calchecksum is None:
+            calchecksum = getFileChecksum(hashtype, filename=filePath)
+            if cache is not None:
+                cache.record(filePath, hashtype, calchecksum)
+        if calchecksum != checksum:
             return False
 
     return True
 
+def conditionalHeaders(headers, validators):
+    """
+    @return copy of (headers) requesting the resource only if it no longer matches (validators)
+    @rtype dict{str, str}
+    """
+    headers = dict(headers or {})
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
 def curlifyHeaders(headers):
     # pycurl drops empty header. Combining headers
     cheaders = ""
@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import logging
+
+LOG = logging.getLogger("grinder.ConcurrencyControl")
+
+# Seconds between adjustments of the number of concurrent transfers
+CONTROL_INTERVAL = 5
+# Relative drop of throughput after an increase which is taken as congestion
+THROUGHPUT_LOSS = 0.10
+# Growth of the time per MB of completed transfers over the best seen which is taken as congestion
+LATENCY_FACTOR = 3.0
+
+class AIMDController(object):
+    """
+    Chooses the number of concurrent transfers with additive increase,
+    multiplicative decrease.
+
+    Concurrency grows by one each interval until a sign of congestion is
+    seen: errors or retries, transfers becoming much slower than the best
+    seen, or aggregate throughput dropping after the last increase.  Errors,
+    retries and slow transfers halve concurrency, a throughput drop undoes
+    the last increase.
+    """
+    def __init__(self, maximum, minimum=1, initial=None):
+        """
+        @param maximum: upper bound on concurrency, (i.e. the number of workers)
+        @type maximum: int
+
+        @param minimum: lower bound on concurrency
+        @type minimum: int
+
+        @param initial: starting concurrency, defaults to a quarter of (maximum)
+        @type initial: int
+        """
+        self.maximum = max(int(maximum), 1)
+        self.minimum = max(min(int(minimum), self.maximum), 1)
+        if initial is None:
+            initial = self.maximum / 4
+        self.concurrency = self.clamp(initial)
+        self.last_throughput = None
+        self.last_change = 0
+        self.best_latency = None
+
+    def clamp(self, value):
+        return max(self.minimum, min(self.maximum, int(value)))
+
+    def update(self, throughput, errors=0, latency=None, retries=0):
+        """
+        @param throughput: bytes/sec received by all transfers during the last interval
+        @type throughput: float
+
+        @param errors: number of transfers which failed during the last interval
+        @type errors: int
+
+        @param latency: mean seconds per MB of transfers completed during the last interval,
+                        None if none completed
+        @type latency: float
+
+        @param retries: number of transfers which were retried during the last interval,
+                        (such as those the server throttled), before any of them failed
+        @type retries: int
+
+        @return: concurrency to use for the next interval
+        @rtype: int
+        """
+        previous = self.concurrency
+        if errors or retries:
+            reason = "%s errors, %s retries" % (errors, retries)
+            self.concurrency = self.clamp(self.concurrency / 2)
+        elif latency is not None and self.best_latency is not None and \
+                latency > self.best_latency * LATENCY_FACTOR:
+            reason = "transfers slowed to %.2f sec/MB from %.2f sec/MB" % (latency, self.best_latency)
+            self.concurrency = self.clamp(self.concurrency / 2)
+        elif throughput <= 0:
+            # nothing was received, (i.e. only existing files were verified), nothing to learn from
+            reason = None
+        elif self.last_change > 0 and self.last_throughput and \
+                throughput < self.last_throughput * (1 - THROUGHPUT_LOSS):
+            reason = "throughput dropped to %d bytes/sec from %d bytes/sec" % (throughput, self.last_throughput)
+            self.concurrency = self.clamp(self.concurrency - self.last_change)
+        else:
+            reason = "throughput %d bytes/sec" % (throughput)
+            self.concurrency = self.clamp(self.concurrency + 1)
+        if latency is not None and (self.best_latency is None or latency < self.best_latency):
+            self.best_latency = latency
+        if throughput > 0:
+            self.last_throughput = throughput
+        self.last_change = self.concurrency - previous
+        if self.last_change:
+            LOG.info("Concurrency changed from %s to %s, %s" % (previous, self.concurrency, reason))
+        return self.concurrency
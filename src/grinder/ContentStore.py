@@ -0,0 +1,257 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from grinder import GrinderUtils
+from grinder.GrinderExceptions import GrinderException
+
+LOG = logging.getLogger("grinder.ContentStore")
+
+# Name of the index created in the root of a store
+STORE_INDEX_NAME = ".grinder_store.db"
+# Ways a stored file is made to appear in a repository
+LINK_SYMLINK = "symlink"
+LINK_HARDLINK = "hardlink"
+LINK_REFLINK = "reflink"
+LINK_COPY = "copy"
+LINK_TYPES = (LINK_SYMLINK, LINK_HARDLINK, LINK_REFLINK, LINK_COPY)
+# ioctl(2) request cloning a file's extents on Linux, (btrfs, xfs), FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+class ContentStore(object):
+    """
+    Store of fetched content shared by rpm, file and distribution repositories,
+    keyed by checksum so identical content is downloaded and stored once.
+
+    A file with checksum 'abcd...' is stored as root/<hashtype>/ab/abcd.../<fileName>,
+    an index in the root records where each checksum is stored, so content already
+    stored under another file name is found as well.  Repositories refer to stored
+    files through symlinks, hardlinks, reflinks or copies, as chosen by (link).
+
+    Errors from the index are logged and treated as a miss, content is then
+    looked for at the checksum's own location.  Instances may be pickled, (as is done when
+    passed to an ActiveObject), each process and thread opens its own connection.
+    """
+    def __init__(self, root, link=LINK_SYMLINK):
+        """
+        @param root: directory holding the stored files, created if missing
+        @type root: str
+
+        @param link: how stored files appear in repositories, one of LINK_TYPES
+        @type link: str
+        """
+        if link not in LINK_TYPES:
+            raise GrinderException("Unknown link type <%s>, expected one of %s" % (link, LINK_TYPES))
+        self.root = os.path.abspath(root)
+        self.link = link
+        self.index_path = os.path.join(self.root, STORE_INDEX_NAME)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if not os.path.isdir(self.root):
+            makedirs(self.root)
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS content ("
+                     "hashtype TEXT, checksum TEXT, path TEXT, size INTEGER, stored REAL, "
+                     "PRIMARY KEY (hashtype, checksum))")
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def path(self, hashtype, checksum, fileName):
+        """
+        @return: path content with (checksum) is to be stored at
+        @rtype: str
+        """
+        checksum = checksum.lower()
+        return os.path.join(self.root, hashtype, checksum[:2], checksum, fileName)
+
+    def lookup(self, hashtype, checksum):
+        """
+        @return: path of the stored copy of content with (checksum), None if none is stored
+        @rtype: str
+        """
+        try:
+            row = self._connect().execute("SELECT path FROM content WHERE hashtype=? AND checksum=?",
+                                          (hashtype, checksum.lower())).fetchone()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Content store lookup of %s:%s failed: %s" % (hashtype, checksum, e))
+            return None
+        if row is None:
+            return None
+        path = os.path.join(self.root, row[0])
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def record(self, hashtype, checksum, path):
+        """
+        Adds a stored file to the index
+
+        @param path: path of the stored file, (as returned by path())
+        @type path: str
+        """
+        if not self.contains(path):
+            LOG.debug("Not recording %s, it lies outside of the content store %s" % (path, self.root))
+            return
+        try:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?)",
+                         (hashtype, checksum.lower(), os.path.abspath(path)[len(self.root) + 1:],
+                          os.path.getsize(path), time.time()))
+            conn.commit()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Unable to record %s in content store: %s" % (path, e))
+
+    def contains(self, path):
+        """
+        @return: True if (path) lies within the store
+        @rtype: bool
+        """
+        return os.path.abspath(path).startswith(self.root + os.sep)
+
+    def isMaterialized(self, path, repoPath):
+        """
+        @return: True if (repoPath) already refers to the stored file (path) as (link) requires
+        @rtype: bool
+        """
+        if not os.path.exists(repoPath):
+            return False
+        if self.link == LINK_SYMLINK:
+            return os.path.islink(repoPath) and os.path.realpath(repoPath) == os.path.realpath(path)
+        if os.path.islink(repoPath):
+            return False
+        if self.link == LINK_HARDLINK:
+            try:
+                return os.path.samefile(path, repoPath)
+            except OSError:
+                return False
+        return os.path.getsize(repoPath) == os.path.getsize(path)
+
+    def materialize(self, path, repoPath):
+        """
+        Makes the stored file (path) appear at (repoPath), replacing what is there.
+        Hardlinks fall back to copies across filesystems, reflinks where the
+        filesystem does not support them.
+
+        @param path: path of the stored file
+        @type path: str
+
+        @param repoPath: path of the file in the repository
+        @type repoPath: str
+        """
+        if self.isMaterialized(path, repoPath):
+            return
+        place(path, repoPath, self.link)
+        LOG.debug("Materialized %s as %s of %s" % (repoPath, self.link, path))
+
+    def adopt(self, repoPath, path):
+        """
+        Moves an existing copy of content, (such as a package fetched before the
+        store was used), into the store rather than fetching it again.  The copy in
+        the repository is left in place, shared with the store where possible.
+
+        @param repoPath: path of the existing file in the repository
+        @type repoPath: str
+
+        @param path: path the content is to be stored at, (as returned by path())
+        @type path: str
+        """
+        link = LINK_HARDLINK
+        if self.link in (LINK_REFLINK, LINK_COPY):
+            link = self.link
+        place(repoPath, path, link)
+        LOG.info("Adopted %s into the content store as %s" % (repoPath, path))
+
+def place(src, dst, link):
+    """
+    Makes (src) appear at (dst) as a (link), replacing what is there.
+    Hardlinks fall back to copies across filesystems, reflinks where the
+    filesystem does not support them.
+    """
+    basedir = os.path.dirname(dst)
+    if basedir and not os.path.isdir(basedir):
+        makedirs(basedir)
+    # built beside the destination and renamed over it, readers never see a partial file
+    tmpPath = "%s.%s.link" % (dst, os.getpid())
+    if os.path.lexists(tmpPath):
+        os.unlink(tmpPath)
+    try:
+        if link == LINK_SYMLINK:
+            os.symlink(GrinderUtils.get_relative_path(os.path.abspath(src), os.path.abspath(dst)), tmpPath)
+        elif link == LINK_HARDLINK:
+            try:
+                os.link(src, tmpPath)
+            except OSError, e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                LOG.debug("Unable to hardlink %s, copying it: %s" % (src, e))
+                shutil.copy2(src, tmpPath)
+        elif link == LINK_REFLINK:
+            reflink(src, tmpPath)
+        else:
+            shutil.copy2(src, tmpPath)
+        os.rename(tmpPath, dst)
+    except:
+        if os.path.lexists(tmpPath):
+            os.unlink(tmpPath)
+        raise
+
+def reflink(src, dst):
+    """
+    Copies (src) to (dst) sharing its extents where the filesystem supports it,
+    otherwise as a regular copy
+    """
+    fsrc = open(src, "rb")
+    try:
+        fdst = open(dst, "wb")
+        try:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                return
+            except (IOError, OSError), e:
+                LOG.debug("Unable to reflink %s, copying it: %s" % (src, e))
+            shutil.copyfileobj(fsrc, fdst)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+    shutil.copystat(src, dst)
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        # Another process may have created the dir since we checked
+        if e.errno != errno.EEXIST:
+            raise
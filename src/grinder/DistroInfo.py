@@ -19,7 +19,7 @@ import tempfile
 import threading
 import traceback
 import ConfigParser
-from grinder.activeobject import ActiveObject
+from grinder.activeobject import ActiveObject, getProcessPool
 from grinder.BaseFetch import BaseFetch
 
 LOG = logging.getLogger("grinder.DistroInfo")
@@ -32,7 +32,7 @@ class DistroInfo(object):
         self.distropath = distropath
 
     def prepareTrees(self, fetcher):
-        fetcherAO = ActiveObject(fetcher)
+        fetcherAO = ActiveObject(fetcher, pool=getProcessPool())
         try:
             LOG.info("Checking if distribution info exists in repository: %s" % (self.repo_url))
             tree_manifest = self.get_tree_manifest(fetcherAO)
@@ -41,12 +41,12 @@ class DistroInfo(object):
                 return []
             return self.__prepareTrees(tree_manifest)
         finally:
-            #Note: We want to explicitly kill the child activeobject
-            # so will use abort() on activeobject's Method class
-            fetcherAO.dummy_method.abort()
+            #Note: We want to explicitly hand the child activeobject back
+            # to the pool so will use release() on activeobject's Method class
+            fetcherAO.dummy_method.release()
             # We were seeing the invocation of __del__() on activeobject
             # being delayed, hence child processes weren't dying when they should.
-            # therefore we added the explicit abort()
+            # therefore we added the explicit release()
             del fetcherAO
             fetchAO = None
 
@@ -0,0 +1,292 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+#
+# Queues deciding the order ParallelFetch hands items to its workers.
+# Each is a Queue.Queue overriding the underlying container, so locking and
+# the get/put/qsize/empty interface used by ParallelFetch are unchanged.
+#
+import heapq
+import logging
+import time
+import Queue
+import urlparse
+from collections import deque
+from threading import Lock
+from grinder.GrinderExceptions import GrinderException
+from grinder.Retry import backoff
+
+LOG = logging.getLogger("grinder.FetchQueue")
+
+# Seconds an item another process is already fetching is first held back
+REQUEUE_DELAY = 2
+# Key HostLimitedQueue queues items fetched from mirrors under, their host is chosen as they are handed out
+MIRRORED = "<mirrored>"
+
+def itemSize(item):
+    """
+    @return size in bytes of an item dict, 0 if unknown
+    @rtype int
+    """
+    try:
+        return int(item.get("size") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def itemHost(item):
+    """
+    @return host an item dict is fetched from, None if unknown
+    @rtype str
+    """
+    url = item.get("downloadurl")
+    if not url:
+        return None
+    return urlparse.urlparse(str(url))[1] or None
+
+class HostsBusy(Exception):
+    """
+    Raised by HostLimitedQueue when items are queued, yet every host
+    they are fetched from already has its limit of items in flight
+    """
+    pass
+
+class SizeOrderedQueue(Queue.Queue):
+    """
+    Hands out the smallest items first, ties in the order they were added
+    """
+    def _init(self, maxsize):
+        self.queue = []
+        self.counter = 0
+
+    def _qsize(self, len=len):
+        return len(self.queue)
+
+    def _key(self, item):
+        return itemSize(item)
+
+    def _put(self, item):
+        self.counter += 1
+        heapq.heappush(self.queue, (self._key(item), self.counter, item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+class LargestFirstQueue(SizeOrderedQueue):
+    """
+    Hands out the largest items first, so no large item is left to be
+    fetched alone by a single worker at the end of a sync
+    """
+    def _key(self, item):
+        return -itemSize(item)
+
+class InterleavedQueue(Queue.Queue):
+    """
+    Hands out items round robin between item types, (rpm, delta_rpm, tree_file...),
+    each type in the order its items were added
+    """
+    def _init(self, maxsize):
+        self.queues = {}
+        self.types = []
+        self.next = 0
+        self.size = 0
+
+    def _qsize(self, len=len):
+        return self.size
+
+    def _put(self, item):
+        item_type = item.get("item_type")
+        if not self.queues.has_key(item_type):
+            self.queues[item_type] = deque()
+            self.types.append(item_type)
+        self.queues[item_type].append(item)
+        self.size += 1
+
+    def _get(self):
+        while True:
+            item_type = self.types[self.next % len(self.types)]
+            self.next += 1
+            if self.queues[item_type]:
+                self.size -= 1
+                return self.queues[item_type].popleft()
+
+class HostLimitedQueue(Queue.Queue):
+    """
+    Limits the number of items in flight per host.
+    Items are queued per host, each ordered by (schedule), and handed out
+    round robin between hosts with a free slot, keeping every host busy.
+    Each item returned by get() must be given back to release() once done,
+    its slot is freed on the host it was handed out for even if its URL changed since.
+
+    Items fetched from mirrors, (as told by the router), are queued together and
+    routed as they are handed out, to a mirror whose host has a free slot.
+    """
+    def __init__(self, schedule=None, host_limit=None, router=None):
+        """
+        @param router: routes items to mirrors, implementing routable(item) and
+                       routeItem(item, busy) which returns the host the item is then
+                       fetched from, None if every mirror is on one of the (busy) hosts;
+                       see grinder.ParallelFetch.ParallelFetch.routeItem()
+        @type router: object
+        """
+        self.schedule = schedule
+        self.host_limit = host_limit
+        self.router = router
+        Queue.Queue.__init__(self)
+
+    def _init(self, maxsize):
+        self.hosts = {}
+        self.order = []
+        self.active = {}
+        # item id -> host the item holds a slot of
+        self.taken = {}
+        # host -> item taken from its queue, yet not handed out as no mirror was free
+        self.held = {}
+        self.next = 0
+        self.size = 0
+
+    def _qsize(self, len=len):
+        return self.size
+
+    def _put(self, item):
+        if self.router is not None and self.router.routable(item):
+            host = MIRRORED
+        else:
+            host = itemHost(item)
+        if not self.hosts.has_key(host):
+            self.hosts[host] = getFetchQueue(self.schedule)
+            self.order.append(host)
+        self.hosts[host].put(item)
+        self.size += 1
+
+    def _get(self):
+        for i in range(len(self.order)):
+            key = self.order[(self.next + i) % len(self.order)]
+            if self.hosts[key].empty() and not self.held.has_key(key):
+                continue
+            if key == MIRRORED:
+                busy = [h for h in self.active.keys() if self.active[h] >= self.host_limit]
+                item = self.held.pop(key, None)
+                if item is None:
+                    item = self.hosts[key].get_nowait()
+                host = self.router.routeItem(item, busy)
+                if host is None:
+                    # every mirror is at its limit, the item is handed out first once one is not
+                    self.held[key] = item
+                    continue
+            else:
+                host = key
+                if self.active.get(host, 0) >= self.host_limit:
+                    continue
+                item = self.hosts[host].get_nowait()
+            self.next = (self.next + i + 1) % len(self.order)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.size -= 1
+            self.taken[id(item)] = host
+            return item
+        raise HostsBusy()
+
+    def release(self, item):
+        """
+        Frees the slot held by an item returned from get()
+        """
+        self.mutex.acquire()
+        try:
+            host = self.taken.pop(id(item), itemHost(item))
+            if self.active.get(host, 0) > 0:
+                self.active[host] -= 1
+        finally:
+            self.mutex.release()
+
+class DelayedQueue(object):
+    """
+    Holds items back until a point in time, ordered by when they become ready.
+    Items which must be tried again are put here rather than having a worker
+    sleep, workers take the ready ones between other items.
+    Safe to be used from several threads.
+    """
+    def __init__(self):
+        # heap of (ready time, sequence, item)
+        self.heap = []
+        self.counter = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def put(self, item, delay):
+        """
+        @param delay seconds from now until (item) is ready
+        @type delay float
+        """
+        self.lock.acquire()
+        try:
+            self.counter += 1
+            heapq.heappush(self.heap, (time.time() + delay, self.counter, item))
+        finally:
+            self.lock.release()
+
+    def ready(self, now=None):
+        """
+        @return items whose delay expired, in the order they became ready
+        @rtype list
+        """
+        if now is None:
+            now = time.time()
+        items = []
+        self.lock.acquire()
+        try:
+            while self.heap and self.heap[0][0] <= now:
+                items.append(heapq.heappop(self.heap)[2])
+        finally:
+            self.lock.release()
+        return items
+
+    def timeout(self, now=None):
+        """
+        @return seconds until the next item is ready, None if no items are held
+        @rtype float
+        """
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            if not self.heap:
+                return None
+            return max(self.heap[0][0] - now, 0)
+        finally:
+            self.lock.release()
+
+SCHEDULES = {
+    "fifo": Queue.Queue,
+    "largest_first": LargestFirstQueue,
+    "shortest_first": SizeOrderedQueue,
+    "interleave": InterleavedQueue,
+}
+
+def getFetchQueue(schedule=None, host_limit=None):
+    """
+    @param schedule name of the order items are fetched in, one of SCHEDULES; defaults to "fifo"
+    @type schedule str
+
+    @param host_limit maximum number of items in flight per host, None for no limit
+    @type host_limit int
+
+    @return an empty queue
+    @rtype Queue.Queue
+    """
+    if schedule and not SCHEDULES.has_key(schedule):
+        raise GrinderException("Unknown schedule <%s>, expected one of %s" % (schedule, SCHEDULES.keys()))
+    if host_limit:
+        return HostLimitedQueue(schedule, int(host_limit))
+    if not schedule:
+        return Queue.Queue()
+    return SCHEDULES[schedule]()
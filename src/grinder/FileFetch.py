@@ -15,10 +15,13 @@
 import os
 import time
 import logging
+from grinder.BandwidthLimiter import BandwidthLimiter
 from grinder.BaseFetch import BaseFetch
 from grinder.GrinderCallback import ProgressReport
-from grinder.GrinderUtils import parseManifest
-from grinder.ParallelFetch import ParallelFetch
+from grinder.GrinderUtils import parseManifest, get_cache_dir
+from grinder.MultiFetch import getFetchEngine
+from grinder.VerifyCache import VerifyCache, VERIFY_CACHE_NAME
+from grinder.MetadataCache import MetadataCache, METADATA_CACHE_NAME
 
 LOG = logging.getLogger("grinder.FileFetch")
 
@@ -26,24 +29,33 @@ class FileFetch(BaseFetch):
     def __init__(self, repo_label, url, cacert=None, clicert=None, clikey=None,
                  download_dir='./', proxy_url=None,
                  proxy_port=None, proxy_user=None, proxy_pass=None, sslverify=1,
-                 max_speed=None):
+                 max_speed=None, verify_options=None, verify_cache=None, segments=None, limiter=None):
         BaseFetch.__init__(self, cacert=cacert, clicert=clicert, clikey=clikey,
                 proxy_url=proxy_url, proxy_port=proxy_port,
                 proxy_user=proxy_user, proxy_pass=proxy_pass, sslverify=sslverify,
-                max_speed=max_speed)
+                max_speed=max_speed, verify_options=verify_options, verify_cache=verify_cache,
+                segments=segments, limiter=limiter)
         self.repo_label = repo_label
         self.url = url.encode('ascii', 'ignore')
         self.local_dir = download_dir
         self.repo_dir = os.path.join(self.local_dir, self.repo_label)
 
-    def fetchItem(self, info):
-        return self.fetch(info['fileName'],
-                          str(info['downloadurl']),
-                          info['savepath'],
-                          itemSize=info['size'],
-                          hashtype=info['checksumtype'],
-                          checksum=info['checksum'],
-                          packages_location=info['pkgpath'] or None)
+    def fetchArgs(self, info):
+        """
+        @return keyword arguments to fetch() for the item described by (info)
+        @rtype dict
+        """
+        return dict(fileName=info['fileName'],
+                    fetchURL=str(info['downloadurl']),
+                    savePath=info['savepath'],
+                    itemSize=info['size'],
+                    hashtype=info['checksumtype'],
+                    checksum=info['checksum'],
+                    packages_location=info['pkgpath'] or None,
+                    verify_options=self.verify_options)
+
+    def fetchItem(self, info, force=False):
+        return self.fetch(force=force, **self.fetchArgs(info))
 
 
 class FileGrinder(object):
@@ -52,7 +64,10 @@ class FileGrinder(object):
     """
     def __init__(self, repo_label, url, parallel=50, cacert=None, clicert=None, clikey=None, \
                        proxy_url=None, proxy_port=None, proxy_user=None, \
-                       proxy_pass=None, sslverify=1, files_location=None, max_speed=None ):
+                       proxy_pass=None, sslverify=1, files_location=None, max_speed=None,
+                       fetch_engine=None, segments=None, schedule=None, host_limit=None,
+                       limit_schedule=None, adaptive=False, batch=None, metrics=None,
+                       content_store=None, metadata_cache=True, cache_dir=None, verify_cache=False):
         self.repo_label = repo_label
         self.repo_url = url
         self.numThreads = int(parallel)
@@ -67,7 +82,25 @@ class FileGrinder(object):
         # set this if you want all packages to be stored in a central location
         self.filepath = files_location
         self.sslverify  = sslverify
+        # total bandwidth in KB/sec of all threads
         self.max_speed = max_speed
+        self.limit_schedule = limit_schedule
+        self.fetch_engine = fetch_engine
+        self.segments = segments
+        self.schedule = schedule
+        self.host_limit = host_limit
+        self.adaptive = adaptive
+        self.batch = batch
+        # grinder.GrinderMetrics.MetricsExporter the fetch is exposed through
+        self.metrics = metrics
+        # grinder.ContentStore.ContentStore files are stored in, in place of files_location
+        self.content_store = content_store
+        # refetch PULP_MANIFEST with a conditional request
+        self.metadata_cache = metadata_cache
+        # remember checksums of existing files so re-syncs need not re-read them
+        self.verify_cache = verify_cache
+        # directory the caches are kept in, see grinder.GrinderUtils.get_cache_dir()
+        self.cache_dir = cache_dir
         self.fileFetch = None
 
     def prepareFiles(self):
@@ -84,7 +117,8 @@ class FileGrinder(object):
                 'size'          : None,
                 'pkgpath'       : None,
                 }
-        self.fileFetch.fetchItem(info)
+        # refetched on each sync, conditionally if the server provides validators
+        self.fileFetch.fetchItem(info, force=True)
         file_info = {}
         file_manifest_path = os.path.join(file_path, file_manifest)
         if os.path.exists(file_manifest_path):
@@ -108,22 +142,50 @@ class FileGrinder(object):
             self.downloadinfo.append(info)
         LOG.info("%s files have been marked to be fetched" % len(file_info))
     
-    def fetch(self,basepath="./", callback=None):
+    def fetch(self,basepath="./", callback=None, verify_options=None):
+        """
+        @param verify_options: controls verification checks on "size" and "checksum",
+                               "reverify" ignores checksums remembered from prior syncs.
+        @type verify_options: dict{"size":bool,"checksum":bool,"reverify":bool}
+        """
         LOG.info("fetch basepath = %s" % (basepath))
         startTime = time.time()
+        limiter = None
+        if self.max_speed or self.limit_schedule:
+            limiter = BandwidthLimiter(self.max_speed, self.limit_schedule)
         self.fileFetch = FileFetch(self.repo_label, self.repo_url, cacert=self.sslcacert, \
                                    clicert=self.sslclientcert, clikey=self.sslclientkey, \
                                    download_dir=basepath, proxy_url=self.proxy_url, \
                                    proxy_port=self.proxy_port, proxy_user=self.proxy_user, \
-                                   proxy_pass=self.proxy_pass, sslverify=self.sslverify, max_speed=self.max_speed)
-        self.parallel_fetch_files = ParallelFetch(self.fileFetch, self.numThreads, callback=callback)
+                                   proxy_pass=self.proxy_pass, sslverify=self.sslverify, \
+                                   verify_options=verify_options, segments=self.segments, limiter=limiter)
+        cache_dir = get_cache_dir(basepath, self.repo_label, self.cache_dir)
+        if self.verify_cache:
+            self.fileFetch.verify_cache = VerifyCache(os.path.join(cache_dir, VERIFY_CACHE_NAME))
+        if self.metadata_cache:
+            self.fileFetch.metadata_cache = MetadataCache(os.path.join(cache_dir, METADATA_CACHE_NAME))
+        self.fileFetch.content_store = self.content_store
+        fetchEngine = getFetchEngine(self.fetch_engine)
+        self.parallel_fetch_files = fetchEngine(self.fileFetch, self.numThreads, callback=callback,
+                                                schedule=self.schedule, host_limit=self.host_limit,
+                                                adaptive=self.adaptive, batch=self.batch)
         LOG.info("Determining downloadable Content bits...")
         self.parallel_fetch_files.processCallback(ProgressReport.DownloadMetadata)
         self.prepareFiles()
         # prepare for download
         self.parallel_fetch_files.addItemList(self.downloadinfo)
         self.parallel_fetch_files.start()
-        report = self.parallel_fetch_files.waitForFinish()
+        if self.metrics is not None:
+            self.metrics.add(self.repo_label, self.parallel_fetch_files)
+        try:
+            report = self.parallel_fetch_files.waitForFinish()
+        finally:
+            if self.metrics is not None:
+                self.metrics.remove(self.repo_label)
+            if limiter is not None:
+                limiter.close()
+        if self.fileFetch.verify_cache is not None:
+            self.fileFetch.verify_cache.prune()
         endTime = time.time()
         LOG.info("Processed <%s> items in [%d] seconds" % (len(self.downloadinfo), \
                   (endTime - startTime)))
@@ -23,6 +23,8 @@ from grinder.RHNSync import RHNSync
 from grinder.GrinderExceptions import *
 from grinder.FileFetch import FileGrinder
 from grinder.Filter import Filter
+from grinder.GrinderMetrics import MetricsExporter
+from grinder.ContentStore import ContentStore, LINK_TYPES, LINK_SYMLINK
 
 LOG = logging.getLogger("grinder.GrinderCLI")
 
@@ -47,6 +49,44 @@ class CliDriver(object):
         """ implement this in sub classes"""
         pass
 
+    def _add_metrics_options(self):
+        self.parser.add_option("--metrics_port", dest="metrics_port", type="int", default=None,
+                          help="Serve metrics of the sync in the Prometheus text format on this local port")
+        self.parser.add_option("--metrics_file", dest="metrics_file", default=None,
+                          help="Rewrite this file every 10 seconds with metrics of the sync in the Prometheus text format")
+
+    def _start_metrics(self):
+        """
+        @return: a started MetricsExporter, None if no metrics were requested
+        """
+        if self.options.metrics_port is None and not self.options.metrics_file:
+            return None
+        metrics = MetricsExporter(port=self.options.metrics_port, path=self.options.metrics_file)
+        metrics.start()
+        return metrics
+
+    def _add_store_options(self):
+        self.parser.add_option("--content_store", dest="content_store", default=None,
+                          help="Directory storing content once by checksum, shared by all repositories synced into it")
+        self.parser.add_option("--link", dest="link", default=LINK_SYMLINK, choices=LINK_TYPES,
+                          help="How content in --content_store appears in repositories, 'symlink' (default), 'hardlink', 'reflink' or 'copy'")
+
+    def _add_cache_options(self):
+        self.parser.add_option("--cache_dir", dest="cache_dir", default=None,
+                          help="Directory the caches of the repository are kept in, defaults to <basepath>/.grinder/<label>")
+        self.parser.add_option("--no_metadata_cache", action="store_true", dest="no_metadata_cache",
+                          help="refetch metadata in full rather than with conditional requests")
+        self.parser.add_option("--verify_cache", action="store_true", dest="verify_cache",
+                          help="remember checksums of existing files so re-syncs need not re-read them")
+
+    def _content_store(self):
+        """
+        @return: the ContentStore requested, None if content is stored in each repository
+        """
+        if not self.options.content_store:
+            return None
+        return ContentStore(self.options.content_store, link=self.options.link)
+
     def stop(self):
         pass
 
@@ -92,6 +132,8 @@ class RHNDriver(CliDriver):
         self.parser.add_option('-U', '--url', action='store', help='Red Hat Server URL')
         self.parser.add_option("--limit", dest="limit",
                           help="Limit bandwidth in KB/sec", default=None)
+        self.parser.add_option("--fetch_engine", dest="fetch_engine",
+                          help="Engine used to fetch items, 'parallel' (default) or 'multi'", default=None)
 
     def _validate_options(self):
         if self.options.all and self.options.removeold:
@@ -118,6 +160,8 @@ class RHNDriver(CliDriver):
             self.rhnSync.setSystemId(sysid)
         if self.options.parallel:
             self.rhnSync.setParallel(self.options.parallel)
+        if self.options.fetch_engine:
+            self.rhnSync.setFetchEngine(self.options.fetch_engine)
         if self.options.debug:
             self.rhnSync.setVerbose(self.options.debug)
         if self.options.removeold:
@@ -207,7 +251,9 @@ class RepoDriver(CliDriver):
         self.parser.add_option("--label", dest="label",
                           help="Label for the content fetched from repository URL")
         self.parser.add_option("--limit", dest="limit",
-                          help="Limit bandwidth in KB/sec per thread", default=None)
+                          help="Limit total bandwidth of all threads in KB/sec", default=None)
+        self.parser.add_option("--limit_schedule", dest="limit_schedule", default=None,
+                          help="Bandwidth limits in KB/sec replacing --limit during windows of the day, example '08:00-18:00=500,22:00-06:00=0'")
         self.parser.add_option('-U', "--url", dest="url",
                           help="URL to the repository whose content to fetch")
         self.parser.add_option("--cacert", dest="cacert", default=None,
@@ -220,6 +266,21 @@ class RepoDriver(CliDriver):
                           help="disable ssl verify of server cert")
         self.parser.add_option('-P', "--parallel", dest="parallel",
                           help="Thread count to fetch the bits in parallel. Defaults to 5")
+        self.parser.add_option("--adaptive", action="store_true", dest="adaptive",
+                          help="Adjust the number of concurrent fetches, up to --parallel, to the measured throughput and errors")
+        self.parser.add_option("--batch", dest="batch", type="int", default=None,
+                          help="Number of items each thread hands its child process at once, defaults to 1")
+        self._add_metrics_options()
+        self._add_store_options()
+        self._add_cache_options()
+        self.parser.add_option("--fetch_engine", dest="fetch_engine", default=None,
+                          help="Engine used to fetch the bits, 'parallel' (default) or 'multi'")
+        self.parser.add_option("--segments", dest="segments", type="int", default=None,
+                          help="Fetch files of 100MB or more with this many concurrent range requests")
+        self.parser.add_option("--schedule", dest="schedule", default=None,
+                          help="Order to fetch the bits in, 'fifo' (default), 'largest_first', 'shortest_first' or 'interleave'")
+        self.parser.add_option("--host_limit", dest="host_limit", type="int", default=None,
+                          help="Maximum number of concurrent connections to a single host, defaults to the thread count")
         self.parser.add_option('-b', '--basepath', dest="basepath",
                           help="Directory path to store the fetched content.Defaults to current working directory")
         self.parser.add_option('--proxy_url', dest="proxy_url",
@@ -234,12 +295,18 @@ class RepoDriver(CliDriver):
                           help="skip verify size of existing packages")
         self.parser.add_option('--skip_verify_checksum', action="store_true",
                           help="skip verify checksum of existing packages")
+        self.parser.add_option('--reverify', action="store_true",
+                          help="recompute checksums of existing packages, ignoring those remembered from prior syncs")
         self.parser.add_option('--filter', action="store",
                           help="add a filter, either whitelist or blacklist")
         self.parser.add_option('--filter_regex', action="append",
                           help="add a filter regex; may be use multiple times")
         self.parser.add_option("--newest", action="store_true", dest="newest",
                           help="only sync newest packages in a repo, will ignore older versions")
+        self.parser.add_option("--streaming_metadata", action="store_true", dest="streaming_metadata",
+                          help="read packages while parsing primary.xml instead of loading them through yum, reduces memory use on large repos")
+        self.parser.add_option("--incremental", action="store_true", dest="incremental",
+                          help="skip the sync if repomd.xml is unchanged since the last successful sync, otherwise only fetch new packages")
 
     def _validate_options(self):
         if not self.options.label:
@@ -282,6 +349,8 @@ class RepoDriver(CliDriver):
             verify_options["size"] = False
         if self.options.skip_verify_checksum:
             verify_options["checksum"] = False
+        if self.options.reverify:
+            verify_options["reverify"] = True
         if self.options.filter:
             self.options.filter = Filter(self.options.filter, 
                                          regex_list=self.options.filter_regex)
@@ -296,11 +365,29 @@ class RepoDriver(CliDriver):
             proxy_pass=self.options.proxy_pass,
             sslverify=sslverify, max_speed=limit,
             filter=self.options.filter,
-            newest=self.options.newest)
-        if self.options.basepath:
-            self.yfetch.fetchYumRepo(self.options.basepath, verify_options=verify_options)
-        else:
-            self.yfetch.fetchYumRepo(verify_options=verify_options)
+            newest=self.options.newest,
+            fetch_engine=self.options.fetch_engine,
+            segments=self.options.segments,
+            schedule=self.options.schedule,
+            host_limit=self.options.host_limit,
+            limit_schedule=self.options.limit_schedule,
+            adaptive=self.options.adaptive,
+            batch=self.options.batch,
+            content_store=self._content_store(),
+            metadata_cache=not self.options.no_metadata_cache,
+            cache_dir=self.options.cache_dir,
+            verify_cache=self.options.verify_cache,
+            streaming_metadata=self.options.streaming_metadata,
+            incremental=self.options.incremental)
+        self.yfetch.metrics = self._start_metrics()
+        try:
+            if self.options.basepath:
+                self.yfetch.fetchYumRepo(self.options.basepath, verify_options=verify_options)
+            else:
+                self.yfetch.fetchYumRepo(verify_options=verify_options)
+        finally:
+            if self.yfetch.metrics is not None:
+                self.yfetch.metrics.stop()
 
     def stop(self):
         self.yfetch.stop()
@@ -317,7 +404,9 @@ class FileDriver(CliDriver):
         self.parser.add_option("--label", dest="label",
                           help="Label for the content fetched from repository URL")
         self.parser.add_option("--limit", dest="limit",
-                          help="Limit bandwidth in KB/sec per thread", default=None)
+                          help="Limit total bandwidth of all threads in KB/sec", default=None)
+        self.parser.add_option("--limit_schedule", dest="limit_schedule", default=None,
+                          help="Bandwidth limits in KB/sec replacing --limit during windows of the day, example '08:00-18:00=500,22:00-06:00=0'")
         self.parser.add_option('-U', "--url", dest="url",
                           help="URL to the repository whose content to fetch")
         self.parser.add_option("--cacert", dest="cacert", default=None,
@@ -330,6 +419,21 @@ class FileDriver(CliDriver):
                           help="disable ssl verify of server cert")
         self.parser.add_option('-P', "--parallel", dest="parallel",
                           help="Thread count to fetch the bits in parallel. Defaults to 5")
+        self.parser.add_option("--adaptive", action="store_true", dest="adaptive",
+                          help="Adjust the number of concurrent fetches, up to --parallel, to the measured throughput and errors")
+        self.parser.add_option("--batch", dest="batch", type="int", default=None,
+                          help="Number of items each thread hands its child process at once, defaults to 1")
+        self._add_metrics_options()
+        self._add_store_options()
+        self._add_cache_options()
+        self.parser.add_option("--fetch_engine", dest="fetch_engine", default=None,
+                          help="Engine used to fetch the bits, 'parallel' (default) or 'multi'")
+        self.parser.add_option("--segments", dest="segments", type="int", default=None,
+                          help="Fetch files of 100MB or more with this many concurrent range requests")
+        self.parser.add_option("--schedule", dest="schedule", default=None,
+                          help="Order to fetch the bits in, 'fifo' (default), 'largest_first', 'shortest_first' or 'interleave'")
+        self.parser.add_option("--host_limit", dest="host_limit", type="int", default=None,
+                          help="Maximum number of concurrent connections to a single host, defaults to the thread count")
         self.parser.add_option('-b', '--basepath', dest="basepath",
                           help="Directory path to store the fetched content.Defaults to current working directory")
         self.parser.add_option('--proxy_url', dest="proxy_url",
@@ -344,6 +448,8 @@ class FileDriver(CliDriver):
                           help="skip verify size of existing packages")
         self.parser.add_option('--skip_verify_checksum', action="store_true",
                           help="skip verify checksum of existing packages")
+        self.parser.add_option('--reverify', action="store_true",
+                          help="recompute checksums of existing files, ignoring those remembered from prior syncs")
 
     def _validate_options(self):
         if not self.options.label:
@@ -374,6 +480,8 @@ class FileDriver(CliDriver):
             verify_options["size"] = False
         if self.options.skip_verify_checksum:
             verify_options["checksum"] = False
+        if self.options.reverify:
+            verify_options["reverify"] = True
         self.file_fetch = FileGrinder(self.options.label, self.options.url, \
                                 self.parallel, cacert=self.options.cacert, \
                                 clicert=self.options.clicert, clikey=self.options.clikey, \
@@ -381,11 +489,27 @@ class FileDriver(CliDriver):
                                 proxy_port=self.options.proxy_port, \
                                 proxy_user=self.options.proxy_user, \
                                 proxy_pass=self.options.proxy_pass,
-                                sslverify=sslverify, max_speed=limit)
-        if self.options.basepath:
-            self.file_fetch.fetch(self.options.basepath)
-        else:
-            self.file_fetch.fetch()
+                                sslverify=sslverify, max_speed=limit,
+                                fetch_engine=self.options.fetch_engine,
+                                segments=self.options.segments,
+                                schedule=self.options.schedule,
+                                host_limit=self.options.host_limit,
+                                limit_schedule=self.options.limit_schedule,
+                                adaptive=self.options.adaptive,
+                                batch=self.options.batch,
+                                content_store=self._content_store(),
+                                metadata_cache=not self.options.no_metadata_cache,
+                                cache_dir=self.options.cache_dir,
+                                verify_cache=self.options.verify_cache)
+        self.file_fetch.metrics = self._start_metrics()
+        try:
+            if self.options.basepath:
+                self.file_fetch.fetch(self.options.basepath, verify_options=verify_options)
+            else:
+                self.file_fetch.fetch(verify_options=verify_options)
+        finally:
+            if self.file_fetch.metrics is not None:
+                self.file_fetch.metrics.stop()
 
     def stop(self):
         self.file_fetch.stop()
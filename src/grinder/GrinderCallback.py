@@ -38,6 +38,9 @@ class ProgressReport(object):
         self.details = {}               # Details about specific file types
         self.error_details = []         # Details about specific errors that were observed
                                         # List of tuples. Tuple format [0] = item info, [1] = exception details
+        self.throughput = None          # Bytes/sec over the last few seconds
+        self.average_throughput = None  # Bytes/sec averaged over the last minute
+        self.eta = None                 # Seconds until the remaining bytes are transferred
         self.step = None
 
     def __str__(self):
@@ -48,6 +51,8 @@ class ProgressReport(object):
                 self.items_total, self.size_left, self.size_total)
         s += "%s num_error, %s num_success, %s num_download, " % (self.num_error, 
                 self.num_success, self.num_download)
+        s += "%s throughput, %s average_throughput, %s eta, " % (self.throughput,
+                self.average_throughput, self.eta)
         s += "details = %s, " % (self.details)
         s += "error_details = %s, " % (self.error_details)
         return s
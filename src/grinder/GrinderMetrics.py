@@ -0,0 +1,275 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import logging
+import os
+import threading
+import traceback
+import BaseHTTPServer
+from threading import Thread, Lock
+
+LOG = logging.getLogger("grinder.GrinderMetrics")
+
+# Upper bounds in seconds of the buckets of item fetch times
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Seconds between rewrites of the metrics file
+DEFAULT_INTERVAL = 10
+
+class LatencyHistogram(object):
+    """
+    Cumulative histogram of the seconds taken to fetch items
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, seconds):
+        self.lock.acquire()
+        try:
+            for i in range(len(self.buckets)):
+                if seconds <= self.buckets[i]:
+                    self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        """
+        @return: (buckets, cumulative count of each bucket, sum of seconds, count)
+        @rtype: tuple
+        """
+        self.lock.acquire()
+        try:
+            return self.buckets, list(self.counts), self.sum, self.count
+        finally:
+            self.lock.release()
+
+
+class MetricsExporter(object):
+    """
+    Exposes the progress of running syncs in the Prometheus text format,
+    served over HTTP on a local port and/or periodically written to a file.
+
+    Syncs register the ParallelFetch fetching their items with add() and
+    remove it once finished, the exporter itself outlives them.
+    """
+    def __init__(self, port=None, path=None, interval=DEFAULT_INTERVAL, address="127.0.0.1"):
+        """
+        @param port: port to serve metrics on, None to not serve them
+        @type port: int
+
+        @param path: file rewritten every (interval) seconds with the metrics, None to not write them
+        @type path: str
+
+        @param interval: seconds between rewrites of (path)
+        @type interval: int
+
+        @param address: address to serve metrics on, defaults to the loopback interface
+        @type address: str
+        """
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.address = address
+        self.lock = Lock()
+        # repo_label -> ParallelFetch
+        self.sources = {}
+        self.server = None
+        self.threads = []
+        self._stop = threading.Event()
+
+    def add(self, repo_label, pFetch):
+        """
+        @param repo_label: label of the repository (pFetch) fetches items of
+        @type repo_label: str
+
+        @param pFetch: fetches the items of the repository
+        @type pFetch: grinder.ParallelFetch.ParallelFetch
+        """
+        self.lock.acquire()
+        try:
+            self.sources[repo_label] = pFetch
+        finally:
+            self.lock.release()
+
+    def remove(self, repo_label):
+        self.lock.acquire()
+        try:
+            self.sources.pop(repo_label, None)
+        finally:
+            self.lock.release()
+
+    def render(self):
+        """
+        @return: metrics of all registered syncs in the Prometheus text format
+        @rtype: str
+        """
+        self.lock.acquire()
+        try:
+            sources = self.sources.items()
+        finally:
+            self.lock.release()
+        sources.sort()
+        metrics = {}
+        def add(name, labels, value):
+            if value is None:
+                return
+            metrics.setdefault(name, []).append((labels, value))
+        for repo_label, pFetch in sources:
+            repo = (("repo", repo_label),)
+            progress = pFetch.tracker.get_progress()
+            status = pFetch.getStatusSnapshot()
+            add("grinder_transferred_bytes_total", repo, progress["transferred_bytes"])
+            add("grinder_remaining_bytes", repo, progress["remaining_bytes"])
+            add("grinder_throughput_bytes", repo, progress.get("throughput"))
+            add("grinder_average_throughput_bytes", repo, progress.get("average_throughput"))
+            add("grinder_eta_seconds", repo, progress.get("eta"))
+            add("grinder_items", repo, progress["total_num_items"])
+            add("grinder_items_remaining", repo, progress["remaining_num_items"])
+            for name in sorted(status["items"].keys()):
+                add("grinder_items_finished_total", repo + (("status", name),), status["items"][name])
+            add("grinder_items_in_flight", repo, status["in_flight"])
+            add("grinder_active_workers", repo, status["active_workers"])
+            add("grinder_retries_total", repo, pFetch.tracker.retries)
+            for host in sorted(status["latency"].keys()):
+                buckets, counts, total, count = status["latency"][host]
+                labels = repo + (("host", host),)
+                for i in range(len(buckets)):
+                    add("grinder_item_seconds_bucket", labels + (("le", "%g" % buckets[i]),), counts[i])
+                add("grinder_item_seconds_bucket", labels + (("le", "+Inf"),), count)
+                add("grinder_item_seconds_sum", labels, total)
+                add("grinder_item_seconds_count", labels, count)
+        lines = []
+        for name, help, kind in METRICS:
+            families = [name]
+            if kind == "histogram":
+                families = [name + "_bucket", name + "_sum", name + "_count"]
+            if not [f for f in families if metrics.has_key(f)]:
+                continue
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for family in families:
+                for labels, value in metrics.get(family, []):
+                    lines.append("%s{%s} %s" % (family, formatLabels(labels), formatValue(value)))
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        """
+        Starts serving and/or writing the metrics in daemon threads
+        """
+        self._stop.clear()
+        if self.port is not None:
+            self.server = BaseHTTPServer.HTTPServer((self.address, int(self.port)), MetricsHandler)
+            self.server.exporter = self
+            self.server.timeout = 1.0
+            self.threads.append(self._daemon(self._serve))
+            LOG.info("Serving metrics on http://%s:%s/metrics" % (self.address, self.server.server_address[1]))
+        if self.path:
+            self.threads.append(self._daemon(self._write))
+
+    def _daemon(self, target):
+        t = Thread(target=target)
+        t.setDaemon(True)
+        t.start()
+        return t
+
+    def _serve(self):
+        while not self._stop.isSet():
+            self.server.handle_request()
+
+    def _write(self):
+        while True:
+            self.write()
+            self._stop.wait(self.interval)
+            if self._stop.isSet():
+                break
+        # leave the final state of the syncs behind
+        self.write()
+
+    def write(self):
+        """
+        Rewrites the metrics file, readers never see a partial file
+        """
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        try:
+            f = open(tmp_path, "w")
+            try:
+                f.write(self.render())
+            finally:
+                f.close()
+            os.rename(tmp_path, self.path)
+        except Exception, e:
+            LOG.error("Unable to write metrics to %s: %s" % (self.path, e))
+            LOG.debug("%s" % (traceback.format_exc()))
+
+    def stop(self):
+        self._stop.set()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        try:
+            body = self.server.exporter.render()
+        except Exception, e:
+            LOG.error("%s" % (traceback.format_exc()))
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug(format % args)
+
+
+# (name, help, type) of each metric, in the order they are rendered
+METRICS = (
+    ("grinder_transferred_bytes_total", "Bytes received, including those of transfers which were restarted", "counter"),
+    ("grinder_remaining_bytes", "Bytes left to fetch", "gauge"),
+    ("grinder_throughput_bytes", "Bytes/sec received over the last few seconds", "gauge"),
+    ("grinder_average_throughput_bytes", "Bytes/sec received over the last minute", "gauge"),
+    ("grinder_eta_seconds", "Seconds until the remaining bytes are fetched at the average throughput", "gauge"),
+    ("grinder_items", "Items to fetch", "gauge"),
+    ("grinder_items_remaining", "Items left to fetch", "gauge"),
+    ("grinder_items_finished_total", "Items finished, by status", "counter"),
+    ("grinder_items_in_flight", "Items being fetched", "gauge"),
+    ("grinder_active_workers", "Worker threads running", "gauge"),
+    ("grinder_retries_total", "Transfers restarted after a failure", "counter"),
+    ("grinder_item_seconds", "Seconds taken to fetch an item, by host", "histogram"),
+)
+
+def formatLabels(labels):
+    return ",".join(['%s="%s"' % (key, escapeLabel(value)) for key, value in labels])
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def formatValue(value):
+    if isinstance(value, float):
+        return "%.6g" % (value)
+    return str(value)
@@ -22,6 +22,19 @@ import rpmUtils.miscutils
 
 LOG = logging.getLogger("grinder.GrinderUtils")
 
+# Directory of the base path grinder keeps the databases of each repository in
+CACHE_DIR_NAME = ".grinder"
+
+def get_cache_dir(basepath, repo_label, cache_dir=None):
+    """
+    @return directory the databases of a repository are kept in, (cache_dir) if set,
+            otherwise one next to the repository so it is not published along with it
+    @rtype str
+    """
+    if cache_dir:
+        return cache_dir
+    return os.path.join(basepath, CACHE_DIR_NAME, repo_label)
+
 def get_relative_path(source_path, dest_path):
     rel_path = ""
     # Need to account for spare '/' which result in "" being in the array
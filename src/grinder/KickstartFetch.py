@@ -31,22 +31,22 @@ class KickstartFetch(BaseFetch):
     def getFetchURL(self, channelLabel, ksLabel, ksFilePath):
         return self.baseURL + "/SAT/$RHN/" + channelLabel + "/getKickstartFile/" + ksLabel + "/" + ksFilePath;
 
-    def fetchItem(self, itemInfo):
-        authMap = self.login()
-
+    def fetchArgs(self, itemInfo, refresh=False):
+        """
+        @return keyword arguments to fetch() for the kickstart file described by (itemInfo)
+        @rtype dict
+        """
         fileName = itemInfo['fileName']
-        itemSize = itemInfo['size']
-        md5sum = itemInfo['md5sum']
-        hashType = itemInfo['hashtype']
-        ksLabel = itemInfo['ksLabel']
-        channelLabel = itemInfo['channelLabel']
-        savePath = itemInfo['savePath']
-        fetchURL = self.getFetchURL(channelLabel, ksLabel, fileName)
-        status = self.fetch(fileName, fetchURL, savePath, itemSize, hashType, md5sum, headers=authMap)
+        fetchURL = self.getFetchURL(itemInfo['channelLabel'], itemInfo['ksLabel'], fileName)
+        return dict(fileName=fileName, fetchURL=fetchURL, savePath=itemInfo['savePath'],
+                    itemSize=itemInfo['size'], hashtype=itemInfo['hashtype'],
+                    checksum=itemInfo['md5sum'], headers=self.login(refresh))
+
+    def fetchItem(self, itemInfo):
+        status = self.fetch(**self.fetchArgs(itemInfo))
         if status == BaseFetch.STATUS_UNAUTHORIZED:
             LOG.warn("Unauthorized request from fetch().  Will attempt to update authentication credentials and retry")
-            authMap = self.login(refresh=True)
-            return self.fetch(fileName, fetchURL, savePath, itemSize, hashType, md5sum, headers=authMap)
+            return self.fetch(**self.fetchArgs(itemInfo, refresh=True))
         return status
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+LOG = logging.getLogger("grinder.MetadataCache")
+
+# Name of the database, created in the cache directory of a repository, see GrinderUtils.get_cache_dir()
+METADATA_CACHE_NAME = ".grinder_metadata.db"
+
+class MetadataCache(object):
+    """
+    Records the HTTP validators, (ETag and Last-Modified), returned with
+    metadata files so they may be refetched with a conditional request.
+
+    Validators are only used while the local copy of the file still has the
+    size and mtime it had when they were recorded.
+    The database is only created once validators are recorded.
+    Errors from the underlying sqlite database are logged and treated as a
+    cache miss.  Instances may be pickled, each process and thread opens
+    its own connection.
+    """
+    def __init__(self, path):
+        """
+        @param path: path of the sqlite database, created if missing
+        @type path: str
+        """
+        self.path = path
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS validators ("
+                     "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                     "size INTEGER, mtime REAL, fetched REAL)")
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, url, filePath):
+        """
+        @param url: url the file was fetched from
+        @type url: str
+
+        @param filePath: path of the local copy of the file
+        @type filePath: str
+
+        @return: {"etag":str, "last_modified":str}, None if nothing usable is recorded
+        @rtype: dict
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            statinfo = os.stat(filePath)
+            conn = self._connect()
+            row = conn.execute("SELECT etag, last_modified, size, mtime FROM validators "
+                               "WHERE url=?", (url,)).fetchone()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Metadata cache lookup of %s failed: %s" % (url, e))
+            return None
+        if row is None:
+            return None
+        etag, last_modified, size, mtime = row
+        if size != statinfo.st_size or mtime != statinfo.st_mtime:
+            return None
+        return {"etag": etag, "last_modified": last_modified}
+
+    def record(self, url, filePath, etag=None, last_modified=None):
+        """
+        Remember the validators returned when (url) was fetched to (filePath).
+        Any previous record is removed if the response carried no validators.
+        """
+        if not etag and not last_modified and not os.path.exists(self.path):
+            return
+        try:
+            conn = self._connect()
+            if not etag and not last_modified:
+                conn.execute("DELETE FROM validators WHERE url=?", (url,))
+            else:
+                statinfo = os.stat(filePath)
+                conn.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)",
+                             (url, etag, last_modified, statinfo.st_size, statinfo.st_mtime, time.time()))
+            conn.commit()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Unable to record validators of %s: %s" % (url, e))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,290 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import logging
+import time
+import urlparse
+from threading import Lock
+
+LOG = logging.getLogger("grinder.MirrorSet")
+
+# Weight of the latest item in a mirror's throughput and error rate
+SMOOTHING = 0.3
+# Number of the fastest healthy mirrors items are spread over
+SPREAD = 3
+# Consecutive failures after which a mirror is left alone for a while
+MAX_FAILURES = 3
+# Seconds a failing mirror is first left alone, doubling while it keeps failing
+COOLDOWN = 30
+# Upper bound in seconds a failing mirror is left alone
+MAX_COOLDOWN = 600
+
+class MirrorStats(object):
+    """
+    Measured performance of a single mirror
+    """
+    def __init__(self, url, rank):
+        self.url = url
+        self.host = urlparse.urlparse(url)[1] or None
+        # position in the mirror list, (mirrorlists are ordered by preference)
+        self.rank = rank
+        # bytes/sec of recent items, None until an item was fetched from it
+        self.throughput = None
+        # fraction of recent items which failed
+        self.error_rate = 0.0
+        self.failures = 0
+        self.successes = 0
+        self.errors = 0
+        self.in_flight = 0
+        # time until which the mirror is left alone, after failing repeatedly
+        self.disabled_until = 0
+
+    def healthy(self, now):
+        return self.disabled_until <= now
+
+
+class MirrorSet(object):
+    """
+    Ordered mirrors of a repository, items are routed to the fastest healthy ones.
+
+    Throughput and error rate of each mirror are measured from the items fetched
+    from it.  Each item goes to whichever of the SPREAD fastest healthy mirrors
+    would serve it soonest given the items it already has in flight, so load
+    follows throughput.  Mirrors not yet measured are assumed as fast as the
+    fastest one and so are raced against it with the first items.  A mirror
+    failing MAX_FAILURES items in a row is left alone for a cooldown, items
+    which fail on a mirror are failed over to one they have not tried yet.
+
+    Intended to be used from the parent process, (by grinder.ParallelFetch),
+    where the outcome of every item is known.  Safe to be used from several threads.
+    """
+    def __init__(self, urls, spread=SPREAD, max_failures=MAX_FAILURES, cooldown=COOLDOWN):
+        """
+        @param urls: base URLs of the mirrors, in order of preference
+        @type urls: list of str
+
+        @param spread: number of the fastest healthy mirrors items are spread over
+        @type spread: int
+
+        @param max_failures: consecutive failures after which a mirror is left alone for a while
+        @type max_failures: int
+
+        @param cooldown: seconds a failing mirror is first left alone
+        @type cooldown: float
+        """
+        self.mirrors = []
+        self.stats = {}
+        for url in urls:
+            url = str(url).rstrip("/")
+            if self.stats.has_key(url):
+                continue
+            self.stats[url] = MirrorStats(url, len(self.mirrors))
+            self.mirrors.append(url)
+        self.spread = spread
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def relativePath(self, url):
+        """
+        @return: path of (url) relative to the mirror it is on, None if it is on none of them
+        @rtype: str
+        """
+        for mirror in self.mirrors:
+            if url.startswith(mirror + "/"):
+                return url[len(mirror) + 1:]
+        return None
+
+    def routable(self, item):
+        """
+        @return: True if the item dict is fetched from one of the mirrors
+        @rtype: bool
+        """
+        if item.get("mirror_path") is not None:
+            return True
+        url = item.get("downloadurl")
+        return bool(url) and self.relativePath(str(url)) is not None
+
+    def choose(self, exclude=(), now=None, busy=()):
+        """
+        @param exclude: mirrors to choose from only if no other is healthy
+        @type exclude: list of str
+
+        @param busy: hosts not to choose a mirror on at all, (such as those at their limit of items in flight)
+        @type busy: list of str
+
+        @return: base URL of the mirror the next item should be fetched from,
+                 None if every mirror is on a (busy) host
+        @rtype: str
+        """
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            return self._choose(exclude, now, busy)
+        finally:
+            self.lock.release()
+
+    def _choose(self, exclude, now, busy=()):
+        stats = [self.stats[m] for m in self.mirrors if self.stats[m].host not in busy]
+        if not stats:
+            return None
+        candidates = [s for s in stats if s.healthy(now) and s.url not in exclude]
+        if not candidates:
+            candidates = [s for s in stats if s.healthy(now)]
+        if not candidates:
+            # every mirror is failing, try the one which is due back first
+            candidates = [min(stats, key=lambda s: (s.disabled_until, s.rank))]
+        measured = [s.throughput for s in candidates if s.throughput is not None]
+        best = max(measured or [1.0])
+        def estimate(s):
+            if s.throughput is None:
+                return best
+            return s.throughput
+        candidates.sort(key=lambda s: (-estimate(s), s.rank))
+        candidates = candidates[:max(self.spread, 1)]
+        def score(s):
+            return estimate(s) * (1.0 - s.error_rate) / (s.in_flight + 1)
+        chosen = candidates[0]
+        for s in candidates[1:]:
+            if score(s) > score(chosen):
+                chosen = s
+        return chosen.url
+
+    def route(self, item, now=None, busy=()):
+        """
+        Chooses the mirror an item dict should be fetched from.
+        Items whose URL is on none of the mirrors are not routed.
+
+        @param busy: hosts not to route the item to, see choose()
+        @type busy: list of str
+
+        @return: the URL the item is to be fetched from, None if it was not routed
+        @rtype: str
+        """
+        url = item.get("downloadurl")
+        if not url:
+            return None
+        relativePath = item.get("mirror_path")
+        if relativePath is None:
+            relativePath = self.relativePath(str(url))
+            if relativePath is None:
+                return None
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            mirror = self._choose(item.get("mirrors_tried", []), now, busy)
+            if mirror is None:
+                return None
+            self.stats[mirror].in_flight += 1
+        finally:
+            self.lock.release()
+        item["mirror"] = mirror
+        item["mirror_path"] = relativePath
+        return "%s/%s" % (mirror, relativePath)
+
+    def success(self, item, size=None, seconds=None):
+        """
+        Records an item fetched from the mirror it was routed to
+
+        @param size: bytes transferred, None if nothing was, (the item was already present)
+        @type size: int
+
+        @param seconds: seconds the transfer took
+        @type seconds: float
+        """
+        mirror = item.get("mirror")
+        self.lock.acquire()
+        try:
+            s = self.stats.get(mirror)
+            if s is None:
+                return
+            s.in_flight = max(s.in_flight - 1, 0)
+            s.successes += 1
+            s.failures = 0
+            s.error_rate *= (1 - SMOOTHING)
+            if size and seconds:
+                throughput = size / max(seconds, 0.001)
+                if s.throughput is None:
+                    s.throughput = throughput
+                else:
+                    s.throughput = SMOOTHING * throughput + (1 - SMOOTHING) * s.throughput
+        finally:
+            self.lock.release()
+
+    def failure(self, item, now=None):
+        """
+        Records an item which failed on the mirror it was routed to
+
+        @return: True if the item should be failed over to another mirror
+        @rtype: bool
+        """
+        mirror = item.get("mirror")
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            s = self.stats.get(mirror)
+            if s is None:
+                return False
+            s.in_flight = max(s.in_flight - 1, 0)
+            s.errors += 1
+            s.failures += 1
+            s.error_rate = SMOOTHING + (1 - SMOOTHING) * s.error_rate
+            if s.failures >= self.max_failures:
+                cooldown = min(self.cooldown * (2 ** (s.failures - self.max_failures)), MAX_COOLDOWN)
+                s.disabled_until = now + cooldown
+                LOG.warning("Mirror %s failed %s items in a row, leaving it alone for %s seconds" %
+                            (mirror, s.failures, cooldown))
+            tried = item.setdefault("mirrors_tried", [])
+            if mirror not in tried:
+                tried.append(mirror)
+            return len(tried) < len(self.mirrors)
+        finally:
+            self.lock.release()
+
+    def release(self, item):
+        """
+        Frees the slot of an item which neither succeeded nor failed on its mirror,
+        (such as one another process is already fetching)
+        """
+        self.lock.acquire()
+        try:
+            s = self.stats.get(item.get("mirror"))
+            if s is not None:
+                s.in_flight = max(s.in_flight - 1, 0)
+        finally:
+            self.lock.release()
+
+    def forget(self, item):
+        """
+        Removes the routing state of an item once it is finished
+        """
+        for key in ("mirror", "mirror_path", "mirrors_tried"):
+            item.pop(key, None)
+
+    def snapshot(self):
+        """
+        @return: (url, throughput, error rate, successes, errors, healthy) of each mirror, in order
+        @rtype: list of tuple
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            return [(s.url, s.throughput, s.error_rate, s.successes, s.errors, s.healthy(now))
+                    for s in [self.stats[m] for m in self.mirrors]]
+        finally:
+            self.lock.release()
@@ -0,0 +1,287 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import inspect
+import logging
+import threading
+import time
+import traceback
+import Queue
+import pycurl
+from threading import Thread
+from grinder.BaseFetch import BaseFetch, Transfer, getCurlHandle, releaseCurlHandle
+from grinder.FetchQueue import DelayedQueue, REQUEUE_DELAY
+from grinder.GrinderExceptions import GrinderException
+from grinder.ParallelFetch import ParallelFetch, getErrorInfo
+from grinder.Retry import backoff
+
+LOG = logging.getLogger("grinder.MultiFetch")
+
+class MultiFetch(ParallelFetch):
+    """
+    Event driven alternative to ParallelFetch.
+
+    A single thread drives up to 'numThreads' concurrent transfers through a
+    pycurl.CurlMulti handle, rather than running one WorkerThread and one
+    ActiveObject child process per concurrent transfer.
+
+    The fetcher must implement fetchArgs(itemInfo), returning the keyword
+    arguments its fetchItem() would pass to BaseFetch.fetch().  A fetcher whose
+    fetchArgs() also takes 'refresh', (such as PackageFetch), has an item which
+    was unauthorized started once more with fetchArgs(itemInfo, refresh=True),
+    as its fetchItem() would.
+
+    A bandwidth limiter of the fetcher is never waited on while data is
+    received, as that would stall every transfer; a transfer which received
+    more than the limiter allows is paused until it has caught up.
+    """
+
+    def createWorkers(self):
+        return [MultiFetchThread(self, self.fetcher, self.numThreads)]
+
+
+class MultiFetchThread(Thread):
+
+    def __init__(self, pFetch, fetcher, maxTransfers):
+        """
+        pFetch - reference to MultiFetch instance
+        fetcher - reference to a class instantiating BaseFetch
+        maxTransfers - number of transfers to run concurrently
+        """
+        Thread.__init__(self)
+        self.pFetch = pFetch
+        self.fetcher = fetcher
+        self.maxTransfers = max(int(maxTransfers), 1)
+        self.multi = None
+        # curl handle -> (itemInfo, Transfer)
+        self.transfers = {}
+        # (itemInfo, retries left) of items locked by another process or to be retried
+        self.deferred = DelayedQueue()
+        # itemInfo id -> number of times the item was deferred
+        self.attempts = {}
+        # itemInfo id -> True for items restarted with refreshed credentials
+        self.refreshed = {}
+        self.refreshable = "refresh" in inspect.getargspec(fetcher.fetchArgs)[0]
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+        LOG.info("stop() invoked")
+
+    def run(self):
+        LOG.debug("Run has started")
+        self.multi = pycurl.CurlMulti()
+        try:
+            while not self._stop.isSet():
+                self.fill()
+                timeout = self.deferred.timeout()
+                if not self.transfers:
+                    if timeout is None:
+                        LOG.debug("Queue is empty, thread will end")
+                        break
+                    # nothing to drive until the next deferred item is ready
+                    time.sleep(min(timeout, 1.0))
+                    continue
+                self.perform()
+                resume = self.throttle()
+                if timeout is None:
+                    timeout = 1.0
+                if resume is not None:
+                    timeout = min(timeout, resume)
+                if self.transfers and not [t for i, t in self.transfers.values() if not t.wf.paused]:
+                    # no socket to wait on
+                    time.sleep(min(timeout, 1.0))
+                    continue
+                self.multi.select(min(timeout, 1.0))
+        finally:
+            self.abortTransfers()
+            self.multi.close()
+            self.multi = None
+        LOG.info("Thread ending")
+
+    def fill(self):
+        """
+        Start new transfers until maxTransfers are running or no work is left
+        """
+        for itemInfo, retryTimes in self.deferred.ready():
+            self.startItem(itemInfo, retryTimes)
+        while len(self.transfers) < self.maxTransfers and not self._stop.isSet():
+            try:
+                # never block here, slots are freed by transfers this thread drives
+                itemInfo = self.pFetch.getWorkItem(wait=False)
+            except Queue.Empty:
+                break
+            if itemInfo is None:
+                break
+            self.startItem(itemInfo)
+
+    def perform(self):
+        while True:
+            ret, num_handles = self.multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        while True:
+            num_q, ok_list, err_list = self.multi.info_read()
+            for curl in ok_list:
+                self.transferDone(curl, None)
+            for curl, errno, errmsg in err_list:
+                self.transferDone(curl, pycurl.error(errno, errmsg))
+            if num_q == 0:
+                break
+
+    def throttle(self):
+        """
+        Resume transfers paused by their WriteFunction, (having received more than
+        the fetcher's bandwidth limiter allows), once the limiter has caught up with them
+
+        @return seconds until the next paused transfer is resumed, None if none is paused
+        @rtype float
+        """
+        now = time.time()
+        timeout = None
+        for curl, (itemInfo, transfer) in self.transfers.items():
+            wf = transfer.wf
+            if wf.paused and wf.resume_at <= now:
+                # cleared first, resuming passes the kept chunk to the callback which may pause again
+                wf.paused = False
+                curl.pause(pycurl.PAUSE_CONT)
+            if wf.paused:
+                delay = max(wf.resume_at - now, 0)
+                if timeout is None or delay < timeout:
+                    timeout = delay
+        return timeout
+
+    def startItem(self, itemInfo, retryTimes=None):
+        try:
+            if self.refreshed.has_key(id(itemInfo)):
+                args = self.fetcher.fetchArgs(itemInfo, refresh=True)
+            else:
+                args = self.fetcher.fetchArgs(itemInfo)
+            if retryTimes is not None:
+                args["retryTimes"] = retryTimes
+            transfer = self.fetcher.prepareTransfer(**args)
+        except Exception, e:
+            LOG.error("%s" % (traceback.format_exc()))
+            self.itemDone(itemInfo, (BaseFetch.STATUS_ERROR, getErrorInfo(e)))
+            return
+        if not isinstance(transfer, Transfer):
+            self.itemDone(itemInfo, transfer)
+            return
+        curl = getCurlHandle()
+        try:
+            self.fetcher.setupCurl(curl, transfer, block=False)
+        except Exception, e:
+            releaseCurlHandle(curl)
+            self.transferFailed(itemInfo, transfer, e)
+            return
+        self.transfers[curl] = (itemInfo, transfer)
+        self.multi.add_handle(curl)
+
+    def transferDone(self, curl, error):
+        itemInfo, transfer = self.transfers.pop(curl)
+        self.multi.remove_handle(curl)
+        status = curl.getinfo(pycurl.HTTP_CODE)
+        releaseCurlHandle(curl)
+        if error is not None:
+            self.transferFailed(itemInfo, transfer, error)
+            return
+        try:
+            result = self.fetcher.completeTransfer(transfer, status)
+        except Exception, e:
+            self.transferFailed(itemInfo, transfer, e)
+            return
+        if result is None:
+            self.defer(itemInfo, BaseFetch.STATUS_RETRY, transfer)
+            return
+        self.itemDone(itemInfo, result)
+
+    def transferFailed(self, itemInfo, transfer, e):
+        try:
+            result = self.fetcher.failTransfer(transfer, e)
+        except Exception, e:
+            LOG.error(e)
+            self.itemDone(itemInfo, (BaseFetch.STATUS_ERROR, getErrorInfo(e)))
+            return
+        if result is None:
+            self.defer(itemInfo, BaseFetch.STATUS_RETRY, transfer)
+            return
+        self.itemDone(itemInfo, result)
+
+    def itemDone(self, itemInfo, result):
+        status, msg = result
+        if status == BaseFetch.STATUS_REQUEUE:
+            # Another process holds the write lock, hold the item back here
+            # rather than spinning on it through the shared queue
+            self.defer(itemInfo, status)
+            return
+        if status == BaseFetch.STATUS_UNAUTHORIZED and self.refreshable and \
+                not self.refreshed.has_key(id(itemInfo)):
+            LOG.warn("Unauthorized request for %s.  Will attempt to update authentication credentials and retry" %
+                     (itemInfo.get("fileName")))
+            self.refreshed[id(itemInfo)] = True
+            self.startItem(itemInfo)
+            return
+        self.refreshed.pop(id(itemInfo), None)
+        self.attempts.pop(id(itemInfo), None)
+        self.pFetch.markStatus(itemInfo, status, msg)
+
+    def defer(self, itemInfo, status, transfer=None):
+        """
+        Holds back an item to be started again, for longer each time it is.
+        A (transfer) to be retried gives up its lock while it waits, and is
+        held back as long as the fetcher's retry policy asks.
+        """
+        attempt = self.attempts.get(id(itemInfo), 0) + 1
+        self.attempts[id(itemInfo)] = attempt
+        retryTimes = None
+        if transfer is not None:
+            retryTimes = transfer.retryTimes
+            transfer.lock.release()
+            delay = self.fetcher.retryDelay(transfer, attempt)
+        else:
+            delay = backoff(attempt, REQUEUE_DELAY)
+        LOG.info("Deferring for %.1f seconds: %s" % (delay, itemInfo))
+        self.deferred.put((itemInfo, retryTimes), delay)
+
+    def abortTransfers(self):
+        """
+        Tear down in-flight transfers, partial downloads are kept so they may be resumed
+        """
+        for curl, (itemInfo, transfer) in self.transfers.items():
+            LOG.info("Aborting transfer of %s" % (transfer.fetchURL))
+            try:
+                self.multi.remove_handle(curl)
+                releaseCurlHandle(curl)
+                transfer.wf.cleanup()
+                transfer.lock.release()
+            except Exception, e:
+                LOG.error("%s" % (traceback.format_exc()))
+        self.transfers = {}
+
+
+FETCH_ENGINES = {
+    "parallel": ParallelFetch,
+    "multi": MultiFetch,
+}
+
+def getFetchEngine(name=None):
+    """
+    @param name name of the engine used to fetch items, one of FETCH_ENGINES; defaults to "parallel"
+    @type name str
+
+    @return class used to fetch items, constructed as ParallelFetch is
+    """
+    if not name:
+        return ParallelFetch
+    if not FETCH_ENGINES.has_key(name):
+        raise GrinderException("Unknown fetch engine <%s>, expected one of %s" % (name, FETCH_ENGINES.keys()))
+    return FETCH_ENGINES[name]
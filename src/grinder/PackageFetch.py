@@ -37,23 +37,24 @@ class PackageFetch(BaseFetch):
     def getFetchURL(self, channelLabel, fetchName):
         return self.baseURL + "/SAT/$RHN/" + channelLabel + "/getPackage/" + fetchName;
 
+    def fetchArgs(self, itemInfo, refresh=False):
+        """
+        @return keyword arguments to fetch() for the package described by (itemInfo)
+        @rtype dict
+        """
+        fetchURL = self.getFetchURL(self.channelLabel, itemInfo['fetch_name'])
+        return dict(fileName=itemInfo['fileName'], fetchURL=fetchURL, savePath=self.savePath,
+                    itemSize=itemInfo['size'], hashtype=itemInfo['hashtype'],
+                    checksum=itemInfo['md5sum'], headers=self.login(refresh))
+
     def fetchItem(self, itemInfo):
-        authMap = self.login()
-        fileName = itemInfo['fileName']
-        fetchName = itemInfo['fetch_name']
-        itemSize = itemInfo['size']
-        md5sum = itemInfo['md5sum']
-        hashType = itemInfo['hashtype']
-        if itemInfo.has_key('pkgpath'):
-            pkgPath = itemInfo['pkgpath']
-        else:
-            pkgPath = None
-        fetchURL = self.getFetchURL(self.channelLabel, fetchName)
-        status = self.fetch(fileName, fetchURL, self.savePath, itemSize, hashType, md5sum,  headers=authMap)
+        status = self.fetch(**self.fetchArgs(itemInfo))
         if status == BaseFetch.STATUS_UNAUTHORIZED:
             LOG.warn("Unauthorized request from fetch().  Will attempt to update authentication credentials and retry")
-            authMap = self.login(refresh=True)
-            return self.fetch(fileName, fetchURL, self.savePath, itemSize, hashType, md5sum, headers=authMap, pkgpath=pkgPath)
+            args = self.fetchArgs(itemInfo, refresh=True)
+            if itemInfo.has_key('pkgpath'):
+                args['packages_location'] = itemInfo['pkgpath']
+            return self.fetch(**args)
         return status
 
 if __name__ == "__main__":
@@ -14,34 +14,74 @@ import logging
 import threading
 import time
 import traceback
-import sys
 import Queue
 from threading import Thread, Lock
-from grinder.BaseFetch import BaseFetch
+from grinder.BaseFetch import BaseFetch, getErrorInfo
+from grinder.ConcurrencyControl import AIMDController, CONTROL_INTERVAL
+from grinder.FetchQueue import getFetchQueue, itemHost, itemSize, HostLimitedQueue, HostsBusy, DelayedQueue, \
+    REQUEUE_DELAY
+from grinder.GrinderMetrics import LatencyHistogram
 from grinder.GrinderCallback import ProgressReport
-from grinder.activeobject import ActiveObject
+from grinder.ProgressSlots import ProgressSlots
+from grinder.Retry import RetryPolicy, backoff
+from grinder.activeobject import ActiveObject, getProcessPool
 
 LOG = logging.getLogger("grinder.ParallelFetch")
 
+# Progress slots created per worker, a worker's child process may be replaced
+# while the slot of the exiting one is still held
+SLOTS_PER_WORKER = 2
+
 class SyncReport:
     def __init__(self):
         self.successes = 0
         self.downloads = 0
         self.errors = 0
         self.last_progress = None
+        # seconds from the last item being handed to a worker until all had finished
+        self.tail_time = None
+        # (seconds since the start, number of concurrent transfers) each time an
+        # adaptive fetch changed its concurrency
+        self.concurrency_history = []
+        # (url, bytes/sec, error rate, successes, errors, healthy) of each mirror
+        # items were routed to, see grinder.MirrorSet.MirrorSet.snapshot()
+        self.mirrors = []
     def __str__(self):
         return "%s successes, %s downloads, %s errors" % (self.successes, self.downloads, self.errors)
 
 class ParallelFetch(object):
-    def __init__(self, fetcher, numThreads=3, callback=None, incr_progress=False):
+    def __init__(self, fetcher, numThreads=3, callback=None, incr_progress=False, schedule=None,
+                 host_limit=None, adaptive=False, batch=None, mirrors=None):
+        """
+        @param schedule order items are handed to workers, see grinder.FetchQueue.SCHEDULES
+        @type schedule str
+
+        @param host_limit maximum number of items fetched concurrently from a single host
+        @type host_limit int
+
+        @param adaptive if True the number of concurrent transfers is adjusted between 1 and
+                        numThreads according to measured throughput, errors and transfer times
+        @type adaptive bool
+
+        @param batch number of items a worker hands its ActiveObject child per round trip
+        @type batch int
+
+        @param mirrors mirrors items are routed to and failed over between
+        @type mirrors grinder.MirrorSet.MirrorSet
+        """
         self.fetcher = fetcher
         self.tracker = fetcher.tracker
         if incr_progress:
             self.tracker.callback = self.incremental_progress_update
         self.numThreads = numThreads
+        self.batch = 1
+        if batch:
+            self.batch = max(int(batch), 1)
         self.callback = callback
         self.error_details = []
         self.statusLock = Lock()
+        # notified when an item completes, freeing its host's slot
+        self.slotFree = threading.Condition(self.statusLock)
         self.itemTotal = 0
         self.syncStatusDict = dict()
         self.syncStatusDict[BaseFetch.STATUS_NOOP] = 0
@@ -49,18 +89,79 @@ class ParallelFetch(object):
         self.syncStatusDict[BaseFetch.STATUS_SIZE_MISSMATCH] = 0
         self.syncStatusDict[BaseFetch.STATUS_MD5_MISSMATCH] = 0
         self.syncStatusDict[BaseFetch.STATUS_ERROR] = 0
-        self.toSyncQ = Queue.Queue()
+        self.toSyncQ = getFetchQueue(schedule, host_limit)
+        # items to be tried again, held back until their backoff expired
+        self.delayedQ = DelayedQueue()
+        # itemInfo id -> number of times the item was held back
+        self.attempts = {}
         self.syncCompleteQ = Queue.Queue()
         self.syncErrorQ = Queue.Queue()
-        self.threads = []
         self.step = None
         self.stopping = False
-        for i in range(self.numThreads):
-            wt = WorkerThread(self, fetcher)
-            self.threads.append(wt)
+        # time the last queued item was handed out
+        self.drainTime = None
+        # items handed out and not yet marked, itemInfo id -> time handed out
+        self.inFlight = {}
+        # (seconds, bytes) of items downloaded since last read by the controller
+        self.transferTimes = []
+        # items failed over to another mirror, (retries the trackers do not see)
+        self.failovers = 0
+        self.concurrency = None
+        self.concurrencyHistory = []
+        # host -> LatencyHistogram of the seconds taken to fetch its items
+        self.hostLatency = {}
+        self.mirrors = None
+        self.setMirrors(mirrors)
+        self.controller = None
+        if adaptive:
+            self.controller = ConcurrencyController(self)
+            self.concurrency = self.controller.aimd.concurrency
+        # workers' children record the progress of their transfers here, sampled by the trackers
+        self.progressSlots = None
+        self.progressTrackers = []
+        self.threads = self.createWorkers()
         self.startTime = time.time()
 
+    def createWorkers(self):
+        """
+        @return threads which will pull items from toSyncQ once start() is called
+        @rtype list of threading.Thread
+        """
+        if self.numThreads > 0:
+            self.progressSlots = ProgressSlots(self.numThreads * SLOTS_PER_WORKER)
+            self.fetcher.progress_slots = self.progressSlots
+            self.addProgressTracker(self.tracker)
+        threads = []
+        for i in range(self.numThreads):
+            wt = WorkerThread(self, self.fetcher)
+            threads.append(wt)
+        return threads
+
+    def addProgressTracker(self, tracker):
+        """
+        Have (tracker) sample the progress recorded by the workers
+        """
+        if self.progressSlots is None:
+            return
+        self.progressTrackers.append(tracker)
+        tracker.add_sampler(self.progressSlots.sample)
+
+    def closeProgressSlots(self):
+        """
+        Samples the progress recorded by the workers a last time and releases the slots
+        """
+        if self.progressSlots is None:
+            return
+        for tracker in self.progressTrackers:
+            tracker.remove_sampler(self.progressSlots.sample)
+            self.progressSlots.sample(tracker)
+        self.progressTrackers = []
+        self.progressSlots.close()
+        self.progressSlots = None
+        self.fetcher.progress_slots = None
+
     def addItem(self, item, requeue=False):
+        self.drainTime = None
         self.toSyncQ.put(item)
         if not requeue:
             if item.has_key("item_type") and item.has_key("downloadurl") and item.has_key("size"):
@@ -70,20 +171,195 @@ class ParallelFetch(object):
         for p in items:
             self.addItem(p)
 
-    def getWorkItem(self):
+    def getWorkItem(self, wait=True):
         """
         Returns an item, or throws Queue.Empty exception if queue is empty
+
+        @param wait if True and every host with queued items is at its limit, block
+                    until a slot is freed, otherwise throw Queue.Empty
+        @type wait bool
         """
         item = None
         # Usage of statusLock is to ensure that reporting of items
         # left to work on are reported accurately through markStatus
         self.statusLock.acquire()
         try:
-            item = self.toSyncQ.get_nowait()
+            while True:
+                self.promoteDelayed()
+                if self.concurrency is not None and len(self.inFlight) >= self.concurrency:
+                    # adaptive concurrency, this worker is idle until a transfer completes
+                    if not wait or self.stopping or (self.toSyncQ.empty() and not len(self.delayedQ)):
+                        raise Queue.Empty()
+                    self.slotFree.wait(1.0)
+                    continue
+                try:
+                    item = self.toSyncQ.get_nowait()
+                    self.routeTaken(item)
+                    break
+                except HostsBusy:
+                    if not wait or self.stopping:
+                        raise Queue.Empty()
+                    self.slotFree.wait(1.0)
+                except Queue.Empty:
+                    # the worker stays for items held back, unless it has to end
+                    timeout = self.delayedQ.timeout()
+                    if timeout is None or not wait or self.stopping:
+                        raise
+                    self.slotFree.wait(min(timeout, 1.0))
+            self.inFlight[id(item)] = time.time()
+            if self.toSyncQ.empty() and self.drainTime is None:
+                self.drainTime = time.time()
         finally:
             self.statusLock.release()
         return item
 
+    def getWorkItems(self, count, wait=True):
+        """
+        Returns a list of up to (count) items, blocking only for the first,
+        or throws Queue.Empty exception if queue is empty
+
+        @param count maximum number of items to return
+        @type count int
+        """
+        items = [self.getWorkItem(wait)]
+        self.statusLock.acquire()
+        try:
+            while len(items) < count and not self.stopping:
+                if self.concurrency is not None and len(self.inFlight) >= self.concurrency:
+                    break
+                try:
+                    item = self.toSyncQ.get_nowait()
+                except (Queue.Empty, HostsBusy):
+                    break
+                self.routeTaken(item)
+                self.inFlight[id(item)] = time.time()
+                items.append(item)
+            if self.toSyncQ.empty() and self.drainTime is None:
+                self.drainTime = time.time()
+        finally:
+            self.statusLock.release()
+        return items
+
+    def setMirrors(self, mirrors):
+        """
+        Routes the items queued from now on to (mirrors).  With a host limit the
+        queue routes each item as it is handed out, to a mirror whose host has a free slot
+
+        @param mirrors mirrors items are routed to and failed over between, None for none
+        @type mirrors grinder.MirrorSet.MirrorSet
+        """
+        self.mirrors = mirrors
+        if isinstance(self.toSyncQ, HostLimitedQueue):
+            if mirrors is None:
+                self.toSyncQ.router = None
+            else:
+                self.toSyncQ.router = self
+
+    def routable(self, item):
+        """
+        @return True if the item is fetched from one of the mirrors
+        @rtype bool
+        """
+        return self.mirrors is not None and not item.get("source") and self.mirrors.routable(item)
+
+    def routeItem(self, item, busy=()):
+        """
+        Points an item to the mirror it should be fetched from, its progress
+        is tracked under the URL it is fetched from
+
+        @param busy hosts not to route the item to
+        @type busy list of str
+
+        @return host the item is fetched from, None if every mirror is on a (busy) host
+        @rtype str
+        """
+        if not self.routable(item):
+            return itemHost(item)
+        url = item.get("downloadurl")
+        mirrorURL = self.mirrors.route(item, busy=busy)
+        if mirrorURL is None:
+            return None
+        if mirrorURL != url:
+            self.tracker.move_item(url, mirrorURL)
+            item["downloadurl"] = mirrorURL
+        return itemHost(item)
+
+    def routeTaken(self, item):
+        """
+        Routes an item just taken from toSyncQ, unless the queue already did
+        """
+        if getattr(self.toSyncQ, "router", None) is None:
+            self.routeItem(item)
+
+    def mirrorOutcome(self, itemInfo, status, startTime):
+        """
+        Records the outcome of an item on the mirror it was routed to.
+        Intended to be called with statusLock held.
+
+        @return True if the item failed and is to be fetched from another mirror
+        @rtype bool
+        """
+        if status in (BaseFetch.STATUS_REQUEUE, BaseFetch.STATUS_NOOP):
+            # the mirror was not involved
+            self.mirrors.release(itemInfo)
+            if status == BaseFetch.STATUS_NOOP:
+                self.mirrors.forget(itemInfo)
+            return False
+        if status == BaseFetch.STATUS_DOWNLOADED:
+            seconds = None
+            if startTime is not None:
+                seconds = time.time() - startTime
+            self.mirrors.success(itemInfo, itemSize(itemInfo), seconds)
+            self.mirrors.forget(itemInfo)
+            return False
+        failover = self.mirrors.failure(itemInfo)
+        if status == BaseFetch.STATUS_RETRY:
+            # retried once its backoff expired, from a mirror it has not tried if any is healthy
+            return False
+        if failover:
+            LOG.warning("%s on %s, failing over to another mirror" % (status, itemInfo["downloadurl"]))
+            return True
+        self.mirrors.forget(itemInfo)
+        return False
+
+    def promoteDelayed(self):
+        """
+        Queues the items held back whose backoff expired
+        """
+        for item in self.delayedQ.ready():
+            self.addItem(item, requeue=True)
+
+    def delayItem(self, itemInfo, status, retryInfo=None):
+        """
+        Holds back an item to be tried again, for longer each time it is.
+        Intended to be called with statusLock held.
+
+        @param retryInfo for STATUS_RETRY, the msg returned with it by BaseFetch.fetch()
+        @type retryInfo dict
+        """
+        attempt = self.attempts.get(id(itemInfo), 0) + 1
+        self.attempts[id(itemInfo)] = attempt
+        if status == BaseFetch.STATUS_RETRY:
+            itemInfo["retries_left"] = retryInfo["retries_left"]
+            policy = getattr(self.fetcher, "retry_policy", None) or RetryPolicy()
+            delay = policy.delay(attempt, retryInfo.get("reason"), retryInfo.get("retry_after"))
+        else:
+            delay = backoff(attempt, REQUEUE_DELAY)
+        LOG.info("Requeueing in %.1f seconds: %s" % (delay, itemInfo))
+        self.delayedQ.put(itemInfo, delay)
+
+    def markStarted(self, itemInfo):
+        """
+        Restarts the clock of an item which waited behind others of its batch,
+        so transfer times measure the fetch alone
+        """
+        self.statusLock.acquire()
+        try:
+            if self.inFlight.has_key(id(itemInfo)):
+                self.inFlight[id(itemInfo)] = time.time()
+        finally:
+            self.statusLock.release()
+
     def incremental_progress_update(self, progress):
         """
         @param progress: from ProgressTracker.get_progress, example:
@@ -131,19 +407,46 @@ class ParallelFetch(object):
         r.sync_status = self.syncStatusDict
         r.details = progress["type_info"]
         r.error_details = self.error_details
+        r.throughput = progress.get("throughput")
+        r.average_throughput = progress.get("average_throughput")
+        r.eta = progress.get("eta")
         if step:
             self.step = step
         r.step = self.step
         return r
 
     def markStatus(self, itemInfo, status, errorInfo=None):
+        """
+        @return True if the item is finished, False if it is to be fetched again
+        @rtype bool
+        """
         LOG.info("%s threads are active. %s items left to be fetched" % (self._running(), (self.toSyncQ.qsize() + self._running())))
         self.statusLock.acquire()
         try:
-            if status == BaseFetch.STATUS_REQUEUE:
-                LOG.info("Requeueing: %s" % (itemInfo))
+            if isinstance(self.toSyncQ, HostLimitedQueue):
+                self.toSyncQ.release(itemInfo)
+            startTime = self.inFlight.pop(id(itemInfo), None)
+            self.slotFree.notifyAll()
+            if startTime is not None and status not in (BaseFetch.STATUS_REQUEUE, BaseFetch.STATUS_RETRY):
+                self.recordLatency(itemInfo, time.time() - startTime)
+            if status == BaseFetch.STATUS_DOWNLOADED and startTime is not None:
+                try:
+                    size = int(itemInfo["size"] or 0)
+                except (KeyError, TypeError, ValueError):
+                    size = 0
+                if size > 0 and self.controller is not None:
+                    self.transferTimes.append((time.time() - startTime, size))
+            if itemInfo.has_key("mirror") and self.mirrorOutcome(itemInfo, status, startTime):
+                self.failovers += 1
+                self.attempts.pop(id(itemInfo), None)
+                itemInfo.pop("retries_left", None)
                 self.addItem(itemInfo, requeue=True)
-                return
+                return False
+            if status in (BaseFetch.STATUS_REQUEUE, BaseFetch.STATUS_RETRY):
+                self.delayItem(itemInfo, status, errorInfo)
+                return False
+            self.attempts.pop(id(itemInfo), None)
+            itemInfo.pop("retries_left", None)
             if status in self.syncStatusDict:
                 self.syncStatusDict[status] = self.syncStatusDict[status] + 1
             else:
@@ -182,6 +485,33 @@ class ParallelFetch(object):
             if self.callback is not None:
                 r = self.formProgressReport(ProgressReport.DownloadItems, itemInfo, status)
                 self.callback(r)
+            return True
+        finally:
+            self.statusLock.release()
+
+    def recordLatency(self, itemInfo, seconds):
+        """
+        Records the seconds taken to fetch an item in the histogram of its host
+        """
+        host = itemHost(itemInfo) or "unknown"
+        if not self.hostLatency.has_key(host):
+            self.hostLatency[host] = LatencyHistogram()
+        self.hostLatency[host].observe(seconds)
+
+    def getStatusSnapshot(self):
+        """
+        @return dict of "items": number of items finished by status, "in_flight": number
+                of items being fetched, "active_workers": number of running workers and
+                "latency": LatencyHistogram.snapshot() by host
+        @rtype dict
+        """
+        self.statusLock.acquire()
+        try:
+            latency = {}
+            for host, histogram in self.hostLatency.items():
+                latency[host] = histogram.snapshot()
+            return {"items": self.syncStatusDict.copy(), "in_flight": len(self.inFlight),
+                    "active_workers": self._running(), "latency": latency}
         finally:
             self.statusLock.release()
 
@@ -200,6 +530,50 @@ class ParallelFetch(object):
             self.callback(r)
         for t in self.threads:
             t.start()
+        if self.controller is not None:
+            self.setConcurrency(self.concurrency)
+            self.controller.start()
+
+    def setConcurrency(self, concurrency):
+        self.statusLock.acquire()
+        try:
+            self.concurrency = concurrency
+            self.concurrencyHistory.append((time.time() - self.startTime, concurrency))
+            self.slotFree.notifyAll()
+        finally:
+            self.statusLock.release()
+
+    def getTransferSamples(self):
+        """
+        @return number of items which failed, number of retries, (both since the start),
+                and mean seconds per MB of items downloaded since the last call,
+                (None if none were downloaded)
+        @rtype (int, int, float)
+        """
+        self.statusLock.acquire()
+        try:
+            errors = 0
+            for status in (BaseFetch.STATUS_ERROR, BaseFetch.STATUS_UNAUTHORIZED,
+                           BaseFetch.STATUS_SIZE_MISSMATCH, BaseFetch.STATUS_MD5_MISSMATCH):
+                errors += self.syncStatusDict.get(status, 0)
+            # each retry of a transfer, (made by a worker or requeued), resets its progress
+            retries = self.failovers
+            trackers = [self.tracker]
+            for tracker in self.progressTrackers:
+                if tracker not in trackers:
+                    trackers.append(tracker)
+            for tracker in trackers:
+                retries += tracker.retries
+            latency = None
+            if self.transferTimes:
+                total = 0.0
+                for seconds, size in self.transferTimes:
+                    total += seconds / (size / (1024.0 * 1024.0))
+                latency = total / len(self.transferTimes)
+                self.transferTimes = []
+            return errors, retries, latency
+        finally:
+            self.statusLock.release()
 
     def stop(self):
         LOG.info("Grinder stopping")
@@ -223,6 +597,8 @@ class ParallelFetch(object):
             if self.stopping and counter % 10 == 0:
                 LOG.info("Waiting for threads to finish, %s still active" % (num_alive_threads))
             time.sleep(0.5)
+            for tracker in self.progressTrackers:
+                tracker.refresh()
             num_alive_threads = self._running()
 
     def waitForFinish(self):
@@ -234,6 +610,10 @@ class ParallelFetch(object):
         """
         self._waitForThreads()
         LOG.info("All threads have finished.")
+        self.closeProgressSlots()
+        if self.controller is not None:
+            self.controller.stop()
+            self.controller.join()
         self.endTime = time.time()
         successList = []
         while not self.syncCompleteQ.empty():
@@ -250,9 +630,22 @@ class ParallelFetch(object):
         report.errors = self.syncStatusDict[BaseFetch.STATUS_ERROR]
         report.errors = report.errors + self.syncStatusDict[BaseFetch.STATUS_MD5_MISSMATCH]
         report.errors = report.errors + self.syncStatusDict[BaseFetch.STATUS_SIZE_MISSMATCH]
+        if self.drainTime is not None:
+            report.tail_time = self.endTime - self.drainTime
+        report.concurrency_history = list(self.concurrencyHistory)
+        if self.mirrors is not None:
+            report.mirrors = self.mirrors.snapshot()
         
         LOG.info("ParallelFetch: %s items successfully processed, %s downloaded, %s items had errors" %
             (report.successes, report.downloads, report.errors))
+        if report.tail_time is not None:
+            LOG.info("ParallelFetch: %s seconds elapsed between the last item starting and all items finishing" % (report.tail_time))
+        if report.concurrency_history:
+            LOG.info("ParallelFetch: concurrency over time %s" %
+                     (", ".join(["%ds: %s" % (t, c) for t, c in report.concurrency_history])))
+        for url, throughput, error_rate, successes, errors, healthy in report.mirrors:
+            LOG.info("ParallelFetch: mirror %s fetched %s items, %s failed, %s bytes/sec, healthy=%s" %
+                     (url, successes, errors, int(throughput or 0), healthy))
         progress = self.tracker.get_progress()
         for item_type in progress["type_info"]:
             type_info = progress["type_info"][item_type]
@@ -271,6 +664,41 @@ class ParallelFetch(object):
         report.last_progress = r
         return report
 
+class ConcurrencyController(Thread):
+    """
+    Adjusts the concurrency of an adaptive ParallelFetch every CONTROL_INTERVAL
+    seconds from the bytes received, errors, retries and transfer times since the last adjustment.
+    """
+    def __init__(self, pFetch, interval=CONTROL_INTERVAL):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.pFetch = pFetch
+        self.interval = interval
+        self.aimd = AIMDController(pFetch.numThreads)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        lastTime = time.time()
+        lastBytes = self.pFetch.tracker.get_progress()["transferred_bytes"]
+        lastErrors = 0
+        lastRetries = self.pFetch.getTransferSamples()[1]
+        while not self._stop.isSet():
+            self._stop.wait(self.interval)
+            if self._stop.isSet() or self.pFetch.stopping:
+                break
+            now = time.time()
+            transferred = self.pFetch.tracker.get_progress()["transferred_bytes"]
+            errors, retries, latency = self.pFetch.getTransferSamples()
+            throughput = (transferred - lastBytes) / max(now - lastTime, 0.001)
+            concurrency = self.aimd.update(throughput, errors - lastErrors, latency, retries - lastRetries)
+            if concurrency != self.pFetch.concurrency:
+                self.pFetch.setConcurrency(concurrency)
+            lastTime, lastBytes, lastErrors, lastRetries = now, transferred, errors, retries
+
+
 class WorkerThread(Thread):
 
     def __init__(self, pFetch, fetcher):
@@ -280,7 +708,11 @@ class WorkerThread(Thread):
         """
         Thread.__init__(self)
         self.pFetch = pFetch
-        self.fetcher = ActiveObject(fetcher, "update_bytes_transferred", "reset_bytes_transferred")
+        # fetchers not derived from BaseFetch only provide fetchItem(), retrying items themselves
+        self.queued = hasattr(fetcher, "fetchQueuedItem")
+        self.batched = hasattr(fetcher, "fetchItems")
+        self.fetcher = ActiveObject(fetcher, "update_bytes_transferred", "reset_bytes_transferred",
+                                    pool=getProcessPool())
         self._stop = threading.Event()
         self.fetcher_lock = Lock()
 
@@ -301,6 +733,14 @@ class WorkerThread(Thread):
     def run(self):
         LOG.debug("Run has started")
         while not self._stop.isSet():
+            if self.pFetch.batch > 1 and self.batched:
+                try:
+                    items = self.pFetch.getWorkItems(self.pFetch.batch)
+                except Queue.Empty:
+                    LOG.debug("Queue is empty, thread will end")
+                    break
+                self.fetchBatch(items)
+                continue
             try:
                 itemInfo = self.pFetch.getWorkItem()
             except Queue.Empty:
@@ -309,35 +749,29 @@ class WorkerThread(Thread):
             if itemInfo is None:
                 break
             try:
-                result = self.fetcher.fetchItem(itemInfo)
+                if self.queued:
+                    result = self.fetcher.fetchQueuedItem(itemInfo)
+                else:
+                    result = self.fetcher.fetchItem(itemInfo)
                 if result:
                     status, msg = result
                     self.pFetch.markStatus(itemInfo, status, msg)
-                    if status == BaseFetch.STATUS_REQUEUE:
-                        time.sleep(2)
             except Exception, e:
                 LOG.error("%s" % (traceback.format_exc()))
                 LOG.error(e)
-                errorInfo = {}
-                exctype, value = sys.exc_info()[:2]
-                errorInfo["error_type"] = str(exctype)
-                errorInfo["value"] = str(value)
-                # Keeping "error" for backward compatibility with Pulp v1
-                errorInfo["error"] = str(value)
-                errorInfo["traceback"] = traceback.format_exc().splitlines()
-                errorInfo["exception"] = e
-                self.pFetch.markStatus(itemInfo, BaseFetch.STATUS_ERROR, errorInfo)
+                self.pFetch.markStatus(itemInfo, BaseFetch.STATUS_ERROR, getErrorInfo(e))
 
         LOG.info("WorkerThread deleting ActiveObject")
         self.fetcher_lock.acquire()
         try:
             try:
-                #Note: We want to explicitly kill the child activeobject
-                # so will use abort() on activeobject's Method class
-                self.fetcher.dummy_method.abort()
+                #Note: We want to explicitly hand the child activeobject back
+                # to the pool, (or kill it if due to be recycled), so will use
+                # release() on activeobject's Method class
+                self.fetcher.dummy_method.release()
                 # We were seeing the invocation of __del__() on activeobject
                 # being delayed, hence child processes weren't dying when they should.
-                # therefore we added the explicit abort()
+                # therefore we added the explicit release()
                 del self.fetcher
             except Exception, e:
                 LOG.error("%s" % (traceback.format_exc()))
@@ -345,6 +779,31 @@ class WorkerThread(Thread):
             self.fetcher_lock.release()
         LOG.info("Thread ending")
 
+    def fetchBatch(self, items):
+        """
+        Fetches (items) in a single round trip to the ActiveObject child,
+        marking the status of each item as soon as the child yields it
+        """
+        marked = {}
+        def itemDone(value):
+            index, result = value
+            if marked.has_key(index):
+                # the child was respawned and the batch started over
+                return
+            status, msg = result
+            marked[index] = True
+            self.pFetch.markStatus(items[index], status, msg)
+            if index + 1 < len(items):
+                self.pFetch.markStarted(items[index + 1])
+        try:
+            self.fetcher.fetchItems.stream(itemDone, items)
+        except Exception, e:
+            LOG.error("%s" % (traceback.format_exc()))
+            LOG.error(e)
+            for index in range(len(items)):
+                if not marked.has_key(index):
+                    self.pFetch.markStatus(items[index], BaseFetch.STATUS_ERROR, getErrorInfo(e))
+
 if __name__ == "__main__":
     from grinder import GrinderLog
     GrinderLog.setup(True)
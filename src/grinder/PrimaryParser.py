@@ -0,0 +1,92 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Streaming reader of yum primary.xml metadata, an alternative to
+# populating a yum PackageSack when only download information is needed
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+import bz2
+import gzip
+import lzma
+try:
+    from cElementTree import iterparse
+except:
+    from xml.etree.cElementTree import iterparse
+
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
+class PrimaryPackage(object):
+    """
+    Download related information of a package in primary.xml.
+    Provides the attributes grinder reads from a yum package object.
+    """
+    __slots__ = ("name", "arch", "epoch", "version", "release", "checksums",
+                 "size", "relativepath", "remote_url")
+
+    def __init__(self, elem):
+        self.name = elem.findtext(COMMON_NS + "name")
+        self.arch = elem.findtext(COMMON_NS + "arch")
+        version = elem.find(COMMON_NS + "version")
+        self.epoch = version.get("epoch") or "0"
+        self.version = version.get("ver")
+        self.release = version.get("rel")
+        checksum = elem.find(COMMON_NS + "checksum")
+        self.checksums = [(checksum.get("type"), checksum.text, 1)]
+        self.size = int(elem.find(COMMON_NS + "size").get("package"))
+        location = elem.find(COMMON_NS + "location")
+        self.relativepath = location.get("href")
+        base = location.get(XML_BASE)
+        if base:
+            self.remote_url = base.rstrip("/") + "/" + self.relativepath
+        else:
+            self.remote_url = self.relativepath
+
+    def __str__(self):
+        # Same format as a yum package, which a grinder.Filter matches against
+        if self.epoch == "0":
+            return "%s-%s-%s.%s" % (self.name, self.version, self.release, self.arch)
+        return "%s:%s-%s-%s.%s" % (self.epoch, self.name, self.version, self.release, self.arch)
+
+class PrimaryParser(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def open(self):
+        if self.filename.endswith(".gz"):
+            return gzip.open(self.filename)
+        elif self.filename.endswith(".bz2"):
+            return bz2.BZ2File(self.filename)
+        elif self.filename.endswith("xz"):
+            return lzma.LZMAFile(self.filename, 'r')
+        return open(self.filename, 'rt')
+
+    def getPackages(self):
+        """
+        Generator of a PrimaryPackage for each rpm in the metadata.
+        Parsed elements are discarded as soon as they are read, so memory
+        use does not grow with the number of packages.
+        """
+        fo = self.open()
+        try:
+            root = None
+            for event, elem in iterparse(fo, events=("start", "end")):
+                if root is None:
+                    root = elem
+                    continue
+                if event != "end" or elem.tag != COMMON_NS + "package":
+                    continue
+                if elem.get("type") == "rpm":
+                    yield PrimaryPackage(elem)
+                root.clear()
+        finally:
+            fo.close()
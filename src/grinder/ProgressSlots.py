@@ -0,0 +1,250 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+LOG = logging.getLogger("grinder.ProgressSlots")
+
+# Layout of a slot: pid of the owning process, sequence number, download total,
+# bytes downloaded, length of the URL, followed by the URL of the transfer
+SLOT_SIZE = 1024
+PID_FORMAT = "<q"
+SEQ_FORMAT = "<Q"
+COUNTERS_FORMAT = "<qqH"
+PID_OFFSET = 0
+SEQ_OFFSET = struct.calcsize(PID_FORMAT)
+COUNTERS_OFFSET = SEQ_OFFSET + struct.calcsize(SEQ_FORMAT)
+URL_OFFSET = COUNTERS_OFFSET + struct.calcsize(COUNTERS_FORMAT)
+URL_MAX = SLOT_SIZE - URL_OFFSET
+# Attempts to read a consistent slot while its owner is writing it
+READ_RETRIES = 10
+
+class ProgressSlots(object):
+    """
+    Progress counters of transfers shared through a memory mapped file.
+
+    Each process fetching items, (i.e. an ActiveObject child which receives a
+    pickled copy of this object), claims a slot of its own and writes the
+    byte counters of its current transfer there, rather than sending every
+    progress tick to the parent.  The parent samples all slots into its
+    ProgressTracker when progress is read.
+
+    A slot has a single writer, readers detect a concurrent write by its
+    sequence number, which is odd while a write is in progress, (a seqlock).
+    Neither side takes a lock once the slot is claimed.
+    """
+    def __init__(self, count, path=None):
+        """
+        @param count: number of slots, at least the number of processes which will write to them
+        @type count: int
+
+        @param path: file holding the slots, a temporary file is created if None
+        @type path: str
+        """
+        self.count = int(count)
+        self.owner = False
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="grinder-progress-")
+            os.write(fd, "\0" * (SLOT_SIZE * self.count))
+            os.close(fd)
+            self.owner = True
+        self.path = path
+        self._init_local()
+
+    def _init_local(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+        # slot claimed by this process, None until the first write
+        self._index = None
+        self._seq = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_lock", "_pid", "_fd", "_map", "_index", "_seq"):
+            del state[key]
+        # only the process which created the slots removes them
+        state["owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def _open(self):
+        if self._map is not None and self._pid == os.getpid():
+            return
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, SLOT_SIZE * self.count)
+        self._pid = os.getpid()
+        self._index = None
+
+    def claim(self):
+        """
+        Claims a slot for this process, the first slot which is free or whose
+        owner has exited.
+
+        @return: index of the slot, None if all are in use
+        @rtype: int
+        """
+        self._lock.acquire()
+        try:
+            try:
+                self._open()
+            except (OSError, IOError, mmap.error), e:
+                LOG.warning("Unable to use progress slots %s: %s" % (self.path, e))
+                return None
+            if self._index is not None:
+                return self._index
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for index in range(self.count):
+                    offset = index * SLOT_SIZE
+                    pid = struct.unpack(PID_FORMAT, self._map[offset:offset + SEQ_OFFSET])[0]
+                    if pid and pid != self._pid and isAlive(pid):
+                        continue
+                    self._map[offset:offset + SEQ_OFFSET] = struct.pack(PID_FORMAT, self._pid)
+                    self._seq = struct.unpack(SEQ_FORMAT, self._map[offset + SEQ_OFFSET:offset + COUNTERS_OFFSET])[0]
+                    self._index = index
+                    self._write(None, 0, 0)
+                    return index
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            LOG.debug("All %s progress slots are in use" % (self.count))
+            return None
+        finally:
+            self._lock.release()
+
+    def _write(self, fetchURL, download_total, downloaded):
+        offset = self._index * SLOT_SIZE
+        if fetchURL is None:
+            fetchURL = ""
+        # odd while the counters are inconsistent
+        self._seq += 1
+        self._map[offset + SEQ_OFFSET:offset + COUNTERS_OFFSET] = struct.pack(SEQ_FORMAT, self._seq)
+        record = struct.pack(COUNTERS_FORMAT, int(download_total), int(downloaded), len(fetchURL)) + fetchURL
+        self._map[offset + COUNTERS_OFFSET:offset + URL_OFFSET + len(fetchURL)] = record
+        self._seq += 1
+        self._map[offset + SEQ_OFFSET:offset + COUNTERS_OFFSET] = struct.pack(SEQ_FORMAT, self._seq)
+
+    def write(self, fetchURL, download_total, downloaded):
+        """
+        Records the progress of this process's current transfer in its slot
+
+        @return: True if recorded, False if no slot is available or the URL does not fit in one
+        @rtype: bool
+        """
+        if isinstance(fetchURL, unicode):
+            fetchURL = fetchURL.encode("utf-8")
+        if len(fetchURL) > URL_MAX:
+            return False
+        if (self._index is None or self._pid != os.getpid()) and self.claim() is None:
+            return False
+        self._write(fetchURL, download_total, downloaded)
+        return True
+
+    def clear(self):
+        """
+        Empties the slot of this process, (i.e. before its transfer is restarted)
+        """
+        if self._index is None or self._pid != os.getpid():
+            return
+        self._write(None, 0, 0)
+
+    def read(self, index):
+        """
+        @return: (fetchURL, download_total, downloaded) last written to slot (index),
+                 None if it is empty or was being written throughout
+        @rtype: (str, int, int)
+        """
+        self._lock.acquire()
+        try:
+            self._open()
+            return self._read(index)
+        finally:
+            self._lock.release()
+
+    def _read(self, index):
+        offset = index * SLOT_SIZE
+        for i in range(READ_RETRIES):
+            seq = self._map[offset + SEQ_OFFSET:offset + COUNTERS_OFFSET]
+            if struct.unpack(SEQ_FORMAT, seq)[0] % 2:
+                continue
+            download_total, downloaded, length = struct.unpack(COUNTERS_FORMAT,
+                self._map[offset + COUNTERS_OFFSET:offset + URL_OFFSET])
+            fetchURL = self._map[offset + URL_OFFSET:offset + URL_OFFSET + min(length, URL_MAX)]
+            if self._map[offset + SEQ_OFFSET:offset + COUNTERS_OFFSET] != seq:
+                continue
+            if not fetchURL:
+                return None
+            return fetchURL, download_total, downloaded
+        return None
+
+    def sample(self, tracker):
+        """
+        Updates (tracker) with the progress recorded in every slot,
+        slots of transfers (tracker) does not know of are ignored
+
+        @type tracker: grinder.ProgressTracker.ProgressTracker
+        """
+        self._lock.acquire()
+        try:
+            try:
+                self._open()
+            except (OSError, IOError, mmap.error), e:
+                LOG.warning("Unable to sample progress slots %s: %s" % (self.path, e))
+                return
+            for index in range(self.count):
+                progress = self._read(index)
+                if progress is None:
+                    continue
+                fetchURL, download_total, downloaded = progress
+                tracker.update_progress_download(fetchURL, download_total, downloaded, notify=False)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Releases the slots, removing their file if created by this object
+        """
+        self._lock.acquire()
+        try:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = None
+                self._fd = None
+                self._pid = None
+                self._index = None
+        finally:
+            self._lock.release()
+        if self.owner and os.path.exists(self.path):
+            os.unlink(self.path)
+
+def isAlive(pid):
+    """
+    @return: True if process (pid) exists
+    @rtype: bool
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+    return True
@@ -14,11 +14,147 @@
 #
 import logging
 import threading
+import time
 
 from grinder.GrinderCallback import ProgressReport
 
 LOG = logging.getLogger(__name__)
 
+# Seconds between progress reports of a single transfer passed on from curl
+PROGRESS_INTERVAL = 0.25
+# Seconds between invocations of the tracker's callback as bytes are transferred
+CALLBACK_INTERVAL = 0.5
+# Seconds between samples of the bytes transferred kept for computing throughput
+SAMPLE_INTERVAL = 1.0
+# Number of samples kept, the moving average throughput spans this many intervals
+HISTORY_SIZE = 60
+# Seconds spanned by the current throughput
+CURRENT_WINDOW = 5.0
+
+class ProgressThrottle(object):
+    """
+    Coalesces the progress of a transfer, curl reports it many times a
+    second and each report made in an ActiveObject child is a round trip
+    to the parent.  Progress is passed on at most every (interval)
+    seconds, and always once the transfer is complete.
+    """
+    def __init__(self, report, interval=PROGRESS_INTERVAL):
+        """
+        @param report: called with (fetchURL, download_total, downloaded)
+        @type report: callable
+
+        @param interval: minimum seconds between reports, 0 passes on every report
+        @type interval: float
+        """
+        self.report = report
+        self.interval = interval
+        self.last = 0
+
+    def __call__(self, fetchURL, download_total, downloaded):
+        if not downloaded:
+            # the tracker ignores reports before any bytes were received
+            return
+        now = time.time()
+        if downloaded < download_total and now - self.last < self.interval:
+            return
+        self.last = now
+        self.report(fetchURL, download_total, downloaded)
+
+class RateHistory(object):
+    """
+    Ring buffer of timestamped samples of the bytes transferred, in total
+    and per item type, from which throughput over a window is computed.
+    """
+    def __init__(self, size=HISTORY_SIZE, interval=SAMPLE_INTERVAL):
+        """
+        @param size: number of samples kept
+        @type size: int
+
+        @param interval: minimum seconds between samples
+        @type interval: float
+        """
+        self.size = max(int(size), 2)
+        self.interval = interval
+        self.samples = []
+        # index of the oldest sample once the buffer is full
+        self.next = 0
+
+    def add(self, now, transferred, type_transferred):
+        """
+        Records a sample, unless the newest is less than interval seconds old
+
+        @param now: seconds since the epoch
+        @type now: float
+
+        @param transferred: bytes transferred by all items
+        @type transferred: int
+
+        @param type_transferred: bytes transferred per item type
+        @type type_transferred: dict
+        """
+        newest = self.newest()
+        if newest is not None and now - newest[0] < self.interval:
+            return
+        sample = (now, transferred, type_transferred.copy())
+        if len(self.samples) < self.size:
+            self.samples.append(sample)
+        else:
+            self.samples[self.next] = sample
+            self.next = (self.next + 1) % self.size
+
+    def ordered(self):
+        """
+        @return: samples, oldest first
+        @rtype: list of (time, transferred, type_transferred)
+        """
+        return self.samples[self.next:] + self.samples[:self.next]
+
+    def newest(self):
+        if not self.samples:
+            return None
+        return self.samples[(self.next - 1) % len(self.samples)]
+
+    def rate(self, window=None, item_type=None):
+        """
+        @param window: seconds to average over, ending at the newest sample, None for all samples
+        @type window: float
+
+        @param item_type: only bytes of items of this type, None for all items
+        @type item_type: str
+
+        @return: bytes/sec, None if fewer than 2 samples span the window
+        @rtype: float
+        """
+        samples = self.ordered()
+        if len(samples) < 2:
+            return None
+        newest = samples[-1]
+        oldest = samples[0]
+        if window is not None:
+            for sample in samples[:-1]:
+                oldest = sample
+                if newest[0] - sample[0] <= window:
+                    break
+        elapsed = newest[0] - oldest[0]
+        if elapsed <= 0:
+            return None
+        if item_type is None:
+            return (newest[1] - oldest[1]) / elapsed
+        return (newest[2].get(item_type, 0) - oldest[2].get(item_type, 0)) / elapsed
+
+    def history(self):
+        """
+        @return: throughput between consecutive samples, oldest first
+        @rtype: list of (time, bytes/sec)
+        """
+        samples = self.ordered()
+        rates = []
+        for i in range(1, len(samples)):
+            elapsed = samples[i][0] - samples[i - 1][0]
+            if elapsed > 0:
+                rates.append((samples[i][0], (samples[i][1] - samples[i - 1][1]) / elapsed))
+        return rates
+
 class ProgressTracker(object):
     """
     Responsible for tracking progress information for all download objects
@@ -26,29 +162,126 @@ class ProgressTracker(object):
     includes information on item types, rpm, delta_rpm, tree_file
     """
 
-    def __init__(self, callback=None):
+    def __init__(self, callback=None, callback_interval=CALLBACK_INTERVAL):
+        """
+        @param callback_interval: minimum seconds between invocations of callback
+                                  as bytes are transferred, 0 to invoke it on every update
+        @type callback_interval: float
+        """
         self.lock = threading.RLock()
         self.items = {}
         self.total_size_bytes = 0
         self.remaining_bytes = self.total_size_bytes
         self.total_num_items = 0
         self.remaining_num_items = 0
+        # bytes received by all transfers, including those of transfers which were reset
+        self.transferred_bytes = 0
+        # number of transfers restarted, (i.e. retried after a failure)
+        self.retries = 0
+        # bytes received per item type, including those of transfers which were reset
+        self.type_transferred = {}
+        self.rates = RateHistory()
         self.type_info = {}
         self.callback = None
+        self.callback_interval = callback_interval
+        self.last_callback = 0
+        # called with this tracker to bring it up to date before progress is read
+        self.samplers = []
+
+    def callback_due(self):
+        """
+        @return: True if callback should be invoked now, False if it was invoked
+                 less than callback_interval seconds ago
+        @rtype: bool
+        """
+        self.lock.acquire()
+        try:
+            now = time.time()
+            if now - self.last_callback < self.callback_interval:
+                return False
+            self.last_callback = now
+            return True
+        finally:
+            self.lock.release()
+
+    def add_sampler(self, sampler):
+        """
+        @param sampler: called with this tracker before progress is read, to update it
+                        with progress recorded elsewhere, (i.e. grinder.ProgressSlots)
+        @type sampler: callable
+        """
+        self.lock.acquire()
+        try:
+            self.samplers.append(sampler)
+        finally:
+            self.lock.release()
+
+    def remove_sampler(self, sampler):
+        self.lock.acquire()
+        try:
+            if sampler in self.samplers:
+                self.samplers.remove(sampler)
+        finally:
+            self.lock.release()
+
+    def refresh(self):
+        """
+        Samples progress and invokes callback, at most every callback_interval seconds.
+        Called periodically when transfers record their progress through samplers
+        rather than reporting it to update_progress_download().
+        """
+        if not self.samplers or not self.callback:
+            return
+        if self.callback_due():
+            self.callback(self.get_progress())
 
     def get_progress(self):
+        """
+        @return: progress, besides counters of bytes and items it holds:
+           "throughput": bytes/sec over the last CURRENT_WINDOW seconds
+           "average_throughput": bytes/sec over the last HISTORY_SIZE samples
+           "eta": seconds until the remaining bytes are transferred at the average throughput
+           each is None until enough samples were taken, type_info entries hold their own "throughput"
+        @rtype: dict
+        """
+        for sampler in list(self.samplers):
+            sampler(self)
         self.lock.acquire()
         try:
+            self.rates.add(time.time(), self.transferred_bytes, self.type_transferred)
             progress = {}
             progress["total_size_bytes"] = self.total_size_bytes
             progress["remaining_bytes"] = self.remaining_bytes
             progress["total_num_items"] = self.total_num_items
             progress["remaining_num_items"] = self.remaining_num_items
-            progress["type_info"] = self.type_info.copy()
+            progress["transferred_bytes"] = self.transferred_bytes
+            progress["throughput"] = self.rates.rate(CURRENT_WINDOW)
+            progress["average_throughput"] = self.rates.rate()
+            progress["eta"] = None
+            if progress["average_throughput"]:
+                progress["eta"] = self.remaining_bytes / progress["average_throughput"]
+            elif progress["average_throughput"] is not None and not self.remaining_bytes:
+                progress["eta"] = 0
+            type_info = {}
+            for item_type in self.type_info:
+                type_info[item_type] = self.type_info[item_type].copy()
+                type_info[item_type]["throughput"] = self.rates.rate(CURRENT_WINDOW, item_type)
+            progress["type_info"] = type_info
             return progress
         finally:
             self.lock.release()
 
+    def get_rate_history(self):
+        """
+        @return: throughput of all transfers between consecutive samples, oldest first
+        @rtype: list of (time, bytes/sec)
+        """
+        self.lock.acquire()
+        try:
+            return self.rates.history()
+        finally:
+            self.lock.release()
+
     def add_item(self, fetchURL, size, item_type):
         """
         @param fetchURL: unique URL identifying where to fetch this item
@@ -103,6 +336,23 @@ class ProgressTracker(object):
         finally:
             self.lock.release()
 
+    def move_item(self, fetchURL, newURL):
+        """
+        Tracks an item under another URL, such as the mirror it is now fetched from
+
+        @param fetchURL: url the item is currently tracked under
+        @type fetchURL: str
+
+        @param newURL: url to track the item under from now on
+        @type newURL: str
+        """
+        self.lock.acquire()
+        try:
+            if self.items.has_key(fetchURL):
+                self.items[newURL] = self.items.pop(fetchURL)
+        finally:
+            self.lock.release()
+
     def modify_item_size(self, fetchURL, size):
         """
         @param fetchURL: unique URL identifying where to fetch this item
@@ -189,7 +439,7 @@ class ProgressTracker(object):
         finally:
             self.lock.release()
 
-    def update_progress_download(self, fetchURL, download_total, downloaded):
+    def update_progress_download(self, fetchURL, download_total, downloaded, notify=True):
         """
         @param fetchURL url of the item, must be unique against all known items being downloaded
         @type fetchURL: str
@@ -199,6 +449,9 @@ class ProgressTracker(object):
 
         @param downloaded number of bytes downloaded up till now for this item
         @type downloaded: int
+
+        @param notify if False, callback is not invoked
+        @type notify: bool
         """
         try:
             download_total = int(download_total)
@@ -231,15 +484,18 @@ class ProgressTracker(object):
                 return
             else:
                 self.items[fetchURL]["remaining_bytes"] = remaining_bytes
+                self.transferred_bytes += delta_bytes
                 # Adjust cumulative remaining bytes for all items
                 self.remaining_bytes -= delta_bytes
                 # Adjust remaining bytes for all of this type of item
                 item_type = self.items[fetchURL]["item_type"]
                 self.type_info[item_type]["size_left"] -= delta_bytes
+                self.type_transferred[item_type] = self.type_transferred.get(item_type, 0) + delta_bytes
+                self.rates.add(time.time(), self.transferred_bytes, self.type_transferred)
         finally:
             self.lock.release()
 
-        if self.callback:
+        if notify and self.callback and self.callback_due():
             progress = self.get_progress()
             self.callback(progress)
 
@@ -251,6 +507,7 @@ class ProgressTracker(object):
         """
         self.lock.acquire()
         try:
+            self.retries += 1
             if not self.items.has_key(fetchURL):
                 return
             item = self.items[fetchURL]
@@ -269,6 +526,6 @@ class ProgressTracker(object):
         finally:
             self.lock.release()
 
-        if self.callback:
+        if self.callback and self.callback_due():
             progress = self.get_progress()
             self.callback(progress)
\ No newline at end of file
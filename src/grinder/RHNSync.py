@@ -29,13 +29,12 @@ except:
     import md5
 import logging
 import signal
-from grinder.ParallelFetch import ParallelFetch
+from grinder.MultiFetch import getFetchEngine
 from grinder.KickstartFetch import KickstartFetch
 from xmlrpclib import Fault
 from grinder.rhn_api import RhnApi
 from grinder.rhn_api import getRhnApi
 from grinder.rhn_transport import RHNTransport
-from grinder.ParallelFetch import ParallelFetch
 from grinder.PackageFetch import PackageFetch
 from grinder.GrinderExceptions import *
 from grinder.SatDumpClient import SatDumpClient
@@ -51,6 +50,7 @@ class RHNSync(object):
         self.username = None
         self.password = None
         self.parallel = 5
+        self.fetchEngine = None
         self.fetchAll = False
         self.parallelFetchPkgs = None
         self.parallelFetchKickstarts = None
@@ -127,6 +127,13 @@ class RHNSync(object):
     def getParallel(self):
         return self.parallel
 
+    def setFetchEngine(self, fetchEngine):
+        LOG.debug("setFetchEngine(%s)" % (fetchEngine))
+        self.fetchEngine = fetchEngine
+
+    def getFetchEngine(self):
+        return self.fetchEngine
+
     def setRemoveOldPackages(self, value):
         LOG.debug("setRemoveOldPackages(%s)" % (value))
         self.removeOldPackages = value
@@ -199,6 +206,8 @@ class RHNSync(object):
             self.systemidFile = configInfo["systemid"]
         if configInfo.has_key("parallel"):
             self.setParallel(int(configInfo["parallel"]))
+        if configInfo.has_key("fetch_engine"):
+            self.setFetchEngine(configInfo["fetch_engine"])
         if configInfo.has_key("url"):
             self.setURL(configInfo["url"])
         if configInfo.has_key("removeold"):
@@ -346,7 +355,8 @@ class RHNSync(object):
                 ksFiles.append(info)
         ksFetch = KickstartFetch(self.systemid, self.baseURL)
         numThreads = int(self.parallel)
-        self.parallelFetchKickstarts = ParallelFetch(ksFetch, numThreads, callback=callback)
+        fetchEngine = getFetchEngine(self.fetchEngine)
+        self.parallelFetchKickstarts = fetchEngine(ksFetch, numThreads, callback=callback)
         self.parallelFetchKickstarts.addItemList(ksFiles)
         self.parallelFetchKickstarts.start()
         report = self.parallelFetchKickstarts.waitForFinish()
@@ -382,7 +392,8 @@ class RHNSync(object):
         numThreads = int(self.parallel)
         LOG.info("Running in parallel fetch mode with %s threads" % (numThreads))
         pkgFetch = PackageFetch(self.systemid, self.baseURL, channelLabel, savePath)
-        self.parallelFetchPkgs = ParallelFetch(pkgFetch, numThreads, callback=callback)
+        fetchEngine = getFetchEngine(self.fetchEngine)
+        self.parallelFetchPkgs = fetchEngine(pkgFetch, numThreads, callback=callback)
         self.parallelFetchPkgs.addItemList(pkgInfo.values())
         self.parallelFetchPkgs.start()
         report = self.parallelFetchPkgs.waitForFinish()
@@ -16,14 +16,24 @@ import os
 import time
 import logging
 import shutil
+from grinder.MultiFetch import getFetchEngine
 from grinder.ParallelFetch import ParallelFetch
-from grinder.BaseFetch import BaseFetch
+from grinder.BaseFetch import BaseFetch, getFileChecksum
+from grinder.BandwidthLimiter import BandwidthLimiter
 from grinder.DistroInfo import DistroInfo
 from grinder.GrinderCallback import ProgressReport
+from grinder.GrinderUtils import get_cache_dir
 from grinder.YumInfo import YumInfo
+from grinder.VerifyCache import VerifyCache, VERIFY_CACHE_NAME
+from grinder.MetadataCache import MetadataCache, METADATA_CACHE_NAME
+from grinder.MirrorSet import MirrorSet
 
 LOG = logging.getLogger("grinder.RepoFetch")
 
+# Records the checksum of repodata/repomd.xml after a sync completed without errors,
+# kept in the directory of the caches, (see grinder.GrinderUtils.get_cache_dir())
+SYNC_STATE_NAME = ".grinder_sync_state"
+
 class RepoFetch(BaseFetch):
     """
     Needed by ParallelFetch
@@ -31,24 +41,34 @@ class RepoFetch(BaseFetch):
     """
     def __init__(self, cacert=None, clicert=None, clikey=None,
                  proxy_url=None, proxy_port=None, proxy_user=None, proxy_pass=None,
-                 sslverify=1, max_speed=None, verify_options=None, num_retries=None):
+                 sslverify=1, max_speed=None, verify_options=None, num_retries=None,
+                 verify_cache=None, metadata_cache=None, segments=None, limiter=None):
         BaseFetch.__init__(self, cacert=cacert, clicert=clicert, clikey=clikey,
                 proxy_url=proxy_url, proxy_port=proxy_port, 
                 proxy_user=proxy_user, proxy_pass=proxy_pass, sslverify=sslverify,
-                max_speed=max_speed, verify_options=verify_options, num_retries=num_retries)
+                max_speed=max_speed, verify_options=verify_options, num_retries=num_retries,
+                verify_cache=verify_cache, metadata_cache=metadata_cache, segments=segments,
+                limiter=limiter)
 
     def stop(self, state=True):
         self.stopped = state
 
+    def fetchArgs(self, info):
+        """
+        @return keyword arguments to fetch() for the item described by (info)
+        @rtype dict
+        """
+        return dict(fileName=info['fileName'],
+                    fetchURL=str(info['downloadurl']),
+                    savePath=info['savepath'],
+                    itemSize=info['size'],
+                    hashtype=info['checksumtype'],
+                    checksum=info['checksum'],
+                    packages_location=info['pkgpath'] or None,
+                    verify_options=self.verify_options)
+
     def fetchItem(self, info, probing=None, force=False):
-        return self.fetch(info['fileName'], 
-                          str(info['downloadurl']), 
-                          info['savepath'],
-                          itemSize=info['size'], 
-                          hashtype=info['checksumtype'], 
-                          checksum=info['checksum'],
-                          packages_location=info['pkgpath'] or None,
-                          verify_options=self.verify_options, probing=probing, force=force)
+        return self.fetch(probing=probing, force=force, **self.fetchArgs(info))
 
 
 class YumRepoGrinder(object):
@@ -61,10 +81,15 @@ class YumRepoGrinder(object):
                  proxy_pass=None, sslverify=1, packages_location=None,
                  remove_old=False, numOldPackages=2, skip=None, max_speed=None,
                  purge_orphaned=True, distro_location=None, tmp_path=None,
-                 filter=None):
+                 filter=None, fetch_engine=None, verify_cache=False, streaming_metadata=False,
+                 incremental=False, segments=None, schedule=None, host_limit=None, limit_schedule=None,
+                 adaptive=False, batch=None, metrics=None, content_store=None,
+                 metadata_cache=True, cache_dir=None):
         self.repo_label = repo_label
         self.repo_url = repo_url
         self.repo_dir = None
+        # directory the caches and sync state of this repository are kept in, set by setup()
+        self.state_dir = None
         self.mirrors = mirrors
         self.numThreads = int(parallel)
         self.fetchPkgs = None
@@ -90,14 +115,46 @@ class YumRepoGrinder(object):
         if not self.skip:
             self.skip = []
         self.sslverify  = sslverify
+        # total bandwidth in KB/sec of all threads
         self.max_speed = max_speed
+        # bandwidth limits replacing max_speed during windows of the day, see grinder.BandwidthLimiter.LimitSchedule
+        self.limit_schedule = limit_schedule
+        self.limiter = None
         self.purge_orphaned = purge_orphaned
         self.stopped = False
         self.distropath = distro_location
         self.rpmlist = []
         self.drpmlist = []
+        # rpms which were fully synced previously, (incremental syncs only)
+        self.existing_rpmlist = []
+        self.unchanged = False
+        self.downloadStartTime = None
         self.tmp_path = tmp_path
         self.filter = filter
+        self.fetch_engine = fetch_engine
+        # remember checksums of existing packages so re-syncs need not re-read them
+        self.verify_cache = verify_cache
+        self.streaming_metadata = streaming_metadata
+        # skip metadata that has not changed since the last sync
+        self.incremental = incremental
+        # number of concurrent range requests used to fetch large files
+        self.segments = segments
+        # order items are fetched in, see grinder.FetchQueue.SCHEDULES
+        self.schedule = schedule
+        # maximum number of concurrent fetches from a single host
+        self.host_limit = host_limit
+        # adjust the number of concurrent fetches, up to 'parallel', to the measured throughput
+        self.adaptive = adaptive
+        # number of items fetched per round trip to a worker's child process
+        self.batch = batch
+        # grinder.GrinderMetrics.MetricsExporter the download is exposed through
+        self.metrics = metrics
+        # grinder.ContentStore.ContentStore packages and tree files are stored in
+        self.content_store = content_store
+        # remember validators of refetched files so they are fetched with conditional requests
+        self.metadata_cache = metadata_cache
+        # directory the caches are kept in, see grinder.GrinderUtils.get_cache_dir()
+        self.cache_dir = cache_dir
 
     def getRPMItems(self):
         return self.rpmlist
@@ -108,7 +165,8 @@ class YumRepoGrinder(object):
     def getDistroItems(self):
         return self.distro_items
 
-    def setup(self, basepath="./", callback=None, verify_options=None, num_retries=None, retry_delay=None, incr_progress=False):
+    def setup(self, basepath="./", callback=None, verify_options=None, num_retries=None, retry_delay=None, incr_progress=False,
+              workers=None):
         """
         Fetches yum metadata and determines what object should be downloaded.
 
@@ -118,31 +176,61 @@ class YumRepoGrinder(object):
         @param callback: progress callback function
         @type callback: function which accepts a grinder.GrinderCallback.ProgressReport
 
-        @param verify_options: controls verification checks on "size" and "checksum".
-        @type verify_options: dict{"size":bool,"checksum":bool}
+        @param verify_options: controls verification checks on "size" and "checksum",
+                               "reverify" ignores checksums remembered from prior syncs.
+        @type verify_options: dict{"size":bool,"checksum":bool,"reverify":bool}
 
         @param num_retries: number of retries to perform if an error occurs
         @type num_retries: int
 
-        @param retry_delay: delay in seconds between retries, delay = 'retry_attempt' * 'retry_delay'
+        @param retry_delay: delay in seconds before the first retry, doubling on each one after (with jitter)
         @type retry_delay: int
 
         @param incr_progress: if true, incremental progress on each item as it's downloaded will be reported
         @type inc_progress: bool
+
+        @param workers: number of threads fetching items, defaults to 'parallel'.
+                        0 when the items are fetched by the workers of a grinder.SyncOrchestrator
+        @type workers: int
         """
         self.repo_dir = os.path.join(basepath, self.repo_label)
+        cache_dir = get_cache_dir(basepath, self.repo_label, self.cache_dir)
+        self.state_dir = cache_dir
+        verify_cache = None
+        if self.verify_cache:
+            verify_cache = VerifyCache(os.path.join(cache_dir, VERIFY_CACHE_NAME))
+        metadata_cache = None
+        if self.metadata_cache:
+            metadata_cache = MetadataCache(os.path.join(cache_dir, METADATA_CACHE_NAME))
         LOG.info("%s, %s, Calling RepoFetch with: cacert=<%s>, clicert=<%s>, clikey=<%s>, proxy_url=<%s>, proxy_port=<%s>, proxy_user=<%s>, proxy_pass=<NOT_LOGGED>, sslverify=<%s>, max_speed=<%s>, verify_options=<%s>, filter=<%s>" %\
              (self.repo_label, self.repo_url, self.sslcacert, self.sslclientcert, self.sslclientkey, self.proxy_url, self.proxy_port, self.proxy_user, self.sslverify, self.max_speed, verify_options, self.filter))
 
+        if self.max_speed or self.limit_schedule:
+            self.limiter = BandwidthLimiter(self.max_speed, self.limit_schedule)
         self.repoFetch = RepoFetch(cacert=self.sslcacert, clicert=self.sslclientcert, clikey=self.sslclientkey,\
         proxy_url=self.proxy_url, proxy_port=self.proxy_port,
         proxy_user=self.proxy_user, proxy_pass=self.proxy_pass,
         sslverify=self.sslverify,
-        max_speed=self.max_speed,
-        verify_options=verify_options, num_retries=num_retries)
-        self.fetchPkgs = ParallelFetch(self.repoFetch, self.numThreads, callback=callback, incr_progress=incr_progress)
+        verify_options=verify_options, num_retries=num_retries,
+        verify_cache=verify_cache,
+        metadata_cache=metadata_cache,
+        segments=self.segments, limiter=self.limiter)
+        self.repoFetch.content_store = self.content_store
+        if workers is None:
+            workers = self.numThreads
+        if workers:
+            fetchEngine = getFetchEngine(self.fetch_engine)
+        else:
+            # only tracks progress and status of the items, the workers fetching them are shared
+            fetchEngine = ParallelFetch
+        self.fetchPkgs = fetchEngine(self.repoFetch, workers, callback=callback, incr_progress=incr_progress,
+                                     schedule=self.schedule, host_limit=self.host_limit,
+                                     adaptive=self.adaptive and workers > 0, batch=self.batch)
         self.fetchPkgs.processCallback(ProgressReport.DownloadMetadata)
 
+        previous_repomd = None
+        if self.incremental:
+            previous_repomd = self.getSyncState()
         info = YumInfo(
             repo_label=self.repo_label, repo_url=self.repo_url, 
             mirrors = self.mirrors, repo_dir=self.repo_dir, 
@@ -153,10 +241,62 @@ class YumRepoGrinder(object):
             proxy_port=self.proxy_port, proxy_user=self.proxy_user, 
             proxy_pass=self.proxy_pass, sslverify=self.sslverify, skip=self.skip,
             tmp_path=self.tmp_path, filter=self.filter,
-            num_retries=num_retries, retry_delay=retry_delay)
+            num_retries=num_retries, retry_delay=retry_delay,
+            streaming_metadata=self.streaming_metadata,
+            previous_repomd=previous_repomd)
         info.setUp()
         self.rpmlist = info.rpms
         self.drpmlist = info.drpms
+        self.existing_rpmlist = info.existing_rpms
+        self.unchanged = info.unchanged
+        if len(info.base_urls) > 1:
+            # items are routed to the fastest healthy mirrors and failed over between them
+            LOG.info("%s: fetching items from %s mirrors" % (self.repo_label, len(info.base_urls)))
+            self.fetchPkgs.setMirrors(MirrorSet(info.base_urls))
+
+    def getSyncState(self):
+        """
+        @return checksum of repodata/repomd.xml as recorded after the last sync completed without errors,
+                None if unknown or the repodata has since been modified
+        @rtype: str
+        """
+        self.removeLegacySyncState()
+        state_path = os.path.join(self.state_dir, SYNC_STATE_NAME)
+        repomd_path = os.path.join(self.repo_dir, "repodata", "repomd.xml")
+        if not os.path.exists(state_path) or not os.path.exists(repomd_path):
+            return None
+        f = open(state_path, "r")
+        try:
+            recorded = f.read().strip()
+        finally:
+            f.close()
+        if recorded != getFileChecksum("sha256", filename=repomd_path):
+            LOG.info("%s: repodata has changed since the last recorded sync" % (self.repo_label))
+            return None
+        return recorded
+
+    def saveSyncState(self):
+        repomd_path = os.path.join(self.repo_dir, "repodata", "repomd.xml")
+        if not os.path.exists(repomd_path):
+            return
+        self.removeLegacySyncState()
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        state_path = os.path.join(self.state_dir, SYNC_STATE_NAME)
+        f = open(state_path, "w")
+        try:
+            f.write(getFileChecksum("sha256", filename=repomd_path))
+        finally:
+            f.close()
+
+    def removeLegacySyncState(self):
+        """
+        Removes the sync state earlier versions kept in the repository, where it was published
+        """
+        legacy_path = os.path.join(self.repo_dir, SYNC_STATE_NAME)
+        if os.path.exists(legacy_path):
+            LOG.info("%s: removing sync state from the repository, %s" % (self.repo_label, legacy_path))
+            os.unlink(legacy_path)
 
     def setupDistroInfo(self):
         info = DistroInfo(repo_url=self.repo_url, repo_dir=self.repo_dir,
@@ -176,11 +316,38 @@ class YumRepoGrinder(object):
         @return: A SyncReport
         @rtype: grinder.ParallelFetch.SyncReport
         """
+        self.startDownload()
+        return self.finishDownload()
+
+    def startDownload(self):
+        """
+        Starts fetching the items queued by setup() and plan(), returns immediately
+        """
+        self.downloadStartTime = time.time()
         try:
-            startTime = time.time()
             self.fetchPkgs.start()
-            self.fetchPkgs.processCallback(ProgressReport.DownloadItems)
+        except:
+            self.fetchPkgs.stop()
+            self.fetchPkgs = None
+            raise
+        self.fetchPkgs.processCallback(ProgressReport.DownloadItems)
+        if self.metrics is not None:
+            self.metrics.add(self.repo_label, self.fetchPkgs)
+
+    def finishDownload(self):
+        """
+        Waits for all items to finish, then finalizes the metadata and purges orphaned packages
+
+        @return: A SyncReport
+        @rtype: grinder.ParallelFetch.SyncReport
+        """
+        try:
             report = self.fetchPkgs.waitForFinish()
+            if self.repoFetch.verify_cache is not None:
+                self.repoFetch.verify_cache.prune()
+            if self.unchanged:
+                LOG.info("%s: metadata is unchanged, nothing to finalize or purge" % (self.repo_label))
+                return report
             self.finalizeMetadata()
             if 'rpm' not in self.skip:
                 if self.purge_orphaned:
@@ -199,26 +366,44 @@ class YumRepoGrinder(object):
                     self.fetchPkgs.processCallback(ProgressReport.RemoveOldPackages)
             endTime = time.time()
             LOG.info("Processed <%s>,<%s> with <%s> items in [%d] seconds. Report: %s" % (self.repo_label, self.repo_url, len(self.downloadinfo),\
-                                                                                          (endTime - startTime), report))
+                                                                                          (endTime - self.downloadStartTime), report))
+            if self.incremental and report.errors == 0 and not self.stopped:
+                self.saveSyncState()
             return report
         finally:
+            if self.metrics is not None:
+                self.metrics.remove(self.repo_label)
             if self.fetchPkgs:
                 self.fetchPkgs.stop()
                 self.fetchPkgs = None
+            if self.limiter is not None:
+                self.limiter.close()
 
     def fetchYumRepo(self, basepath="./", callback=None, verify_options=None):
         LOG.info("fetchYumRepo() repo_label = %s, repo_url = %s, basepath = %s, verify_options = %s" % \
                  (self.repo_label, self.repo_url, basepath, verify_options))
-        self.setup(basepath, callback, verify_options)
+        self.plan(basepath, callback, verify_options)
+        return self.download()
+
+    def plan(self, basepath="./", callback=None, verify_options=None, workers=None):
+        """
+        Fetches yum metadata and queues the items to download, without downloading them
+
+        @param workers: see setup()
+        @type workers: int
+        """
+        self.setup(basepath, callback, verify_options, workers=workers)
+        # the tree is not described by repomd.xml, its files are checked even when that is unchanged
         if 'distribution' not in self.skip:
             self.setupDistroInfo()
             if self.distro_items:
                 self.addItems(self.distro_items['files'])
         else:
             LOG.debug("skipping distributions from sync")
+        if self.unchanged:
+            return
         self.addItems(self.rpmlist)
         self.addItems(self.drpmlist)
-        return self.download()
 
     def stop(self, block=True):
         LOG.info("Stopping")
@@ -236,8 +421,8 @@ class YumRepoGrinder(object):
          as well as older packages filtered out from remove_old/numOldPackages logic
         """
         dpkgs = []
-        if self.rpmlist:
-            for pkg in self.rpmlist:
+        if self.rpmlist or self.existing_rpmlist:
+            for pkg in self.rpmlist + self.existing_rpmlist:
                 dpkgs.append(os.path.join(self.repo_dir, os.path.dirname(pkg['relativepath']), pkg['fileName']))
         if os.path.exists(self.repo_dir):
             for root, dirs, files in os.walk(self.repo_dir):
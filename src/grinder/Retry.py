@@ -12,16 +12,156 @@
 # have received a copy of GPLv2 along with this software; if not, see
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 #
+import random
+import rfc822
 import time
 import logging
 
 LOG = logging.getLogger("grinder.Retry")
 GRINDER_DEFAULT_NUM_RETRIES = 5
 GRINDER_DEFAULT_SECONDS_DELAY = 5
+# Seconds a failed fetch is first held back before it is retried
+RETRY_DELAY = 1
+# Upper bound in seconds of the delay between attempts
+MAX_DELAY = 60
+# Upper bound in seconds of a delay requested by a server through Retry-After
+MAX_RETRY_AFTER = 300
+
+# Why a failure is retried, failures classified as None are not
+RETRY_CONNECT = "connect"      # the host could not be resolved or connected to
+RETRY_SERVER = "server"        # 5xx or 408 response
+RETRY_THROTTLED = "throttled"  # 429 response, or 503 with a Retry-After
+RETRY_CHECKSUM = "checksum"    # the bits fetched did not match the expected size or checksum
+RETRY_STALLED = "stalled"      # the transfer was aborted part way, (low speed limit, dropped connection)
+RETRY_ERROR = "error"          # any other exception or unexpected response
+
+# libcurl error codes, see libcurl-errors(3)
+CURL_CONNECT_ERRORS = (5, 6, 7, 35)        # COULDNT_RESOLVE_PROXY, COULDNT_RESOLVE_HOST, COULDNT_CONNECT, SSL_CONNECT_ERROR
+CURL_STALLED_ERRORS = (18, 28, 52, 55, 56) # PARTIAL_FILE, OPERATION_TIMEDOUT, GOT_NOTHING, SEND_ERROR, RECV_ERROR
+# HTTP status codes of a successful transfer, 0 for local files
+SUCCESS_CODES = (0, 200, 206, 226)
+
+def backoff(attempt, base=RETRY_DELAY, limit=MAX_DELAY):
+    """
+    @param attempt number of times the item was held back, including this one
+    @type attempt int
+
+    @return seconds to hold an item back, doubling with each attempt up to (limit),
+            of which up to half is random so items held back together spread out
+    @rtype float
+    """
+    delay = min(base * (2 ** (max(attempt, 1) - 1)), limit)
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+def parseRetryAfter(value):
+    """
+    @param value a Retry-After header, either seconds or an HTTP date
+    @type value str
+
+    @return seconds to wait, None if (value) is not understood
+    @rtype float
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = rfc822.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(rfc822.mktime_tz(parsed) - time.time(), 0)
+
+class RetryPolicy(object):
+    """
+    Decides whether a failure is worth retrying and how long to wait first.
+    Waits grow exponentially with jitter, so a flapping mirror is not hit
+    back to back by every worker at once.
+    """
+    def __init__(self, retries=None, delay=None, max_delay=MAX_DELAY, resume=True):
+        """
+        @param retries number of attempts after the first one
+        @type retries int
+
+        @param delay seconds waited before the first retry, doubling on each one after
+        @type delay float
+
+        @param max_delay upper bound of the seconds waited before a retry
+        @type max_delay float
+
+        @param resume if True a transfer which stalled is resumed from its partial file
+        @type resume bool
+        """
+        if retries is None:
+            retries = GRINDER_DEFAULT_NUM_RETRIES
+        if delay is None:
+            delay = RETRY_DELAY
+        self.retries = retries
+        self.delay_base = delay
+        self.max_delay = max_delay
+        self.resume = resume
+
+    def classify(self, status=None, error=None, retry_after=None, mismatch=False):
+        """
+        @param status HTTP status code the transfer ended with
+        @type status int
+
+        @param error exception the transfer failed with
+        @type error Exception
+
+        @param retry_after seconds the server asked to wait, (see parseRetryAfter())
+        @type retry_after float
+
+        @param mismatch True if the bits fetched did not match the expected size or checksum
+        @type mismatch bool
+
+        @return one of the RETRY_ reasons, None if the failure should not be retried
+        @rtype str
+        """
+        if error is not None:
+            code = None
+            if error.__class__.__module__ == "pycurl" and error.args:
+                code = error.args[0]
+            if code in CURL_CONNECT_ERRORS:
+                return RETRY_CONNECT
+            if code in CURL_STALLED_ERRORS:
+                return RETRY_STALLED
+            return RETRY_ERROR
+        if mismatch:
+            return RETRY_CHECKSUM
+        if status is None or status in SUCCESS_CODES:
+            return None
+        if status == 429 or (status == 503 and retry_after is not None):
+            return RETRY_THROTTLED
+        if status == 408 or status >= 500:
+            return RETRY_SERVER
+        if 400 <= status < 500:
+            # the request itself is refused, (not found, forbidden...), asking again does not help
+            return None
+        return RETRY_ERROR
+
+    def resumable(self, reason):
+        """
+        @return True if a retry for (reason) should continue from the partial file
+        @rtype bool
+        """
+        return self.resume and reason == RETRY_STALLED
+
+    def delay(self, attempt, reason=None, retry_after=None):
+        """
+        @param attempt number of the retry about to be made, starting at 1
+        @type attempt int
+
+        @return seconds to wait before the retry
+        @rtype float
+        """
+        if reason == RETRY_THROTTLED and retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+        return backoff(attempt, self.delay_base, self.max_delay)
+
 
 class Retry(object):
     """
-    Decorator to add retry logic
+    Decorator to add retry logic, waiting between attempts as a RetryPolicy does
     """
     def __init__(self, retries=None, delay=None):
         """
@@ -43,10 +183,9 @@ class Retry(object):
         # 3rd default to global defaults
         # ...remember num_retries=0 is valid, so test for None....not just true/false
         num_retries = self.retries
-        if num_retries is not None and caller_self:
-            if hasattr(caller_self, "num_retries"):
-                num_retries = getattr(caller_self, "num_retries")
-        if num_retries is not None:
+        if num_retries is None and caller_self:
+            num_retries = getattr(caller_self, "num_retries", None)
+        if num_retries is None:
             num_retries = GRINDER_DEFAULT_NUM_RETRIES
         return num_retries
 
@@ -58,26 +197,24 @@ class Retry(object):
         # 2nd priority see if the invoking object, or the first param to the object has num_retries or retry_delay set
         # 3rd default to global defaults
         retry_delay = self.delay
-        if retry_delay is not None and caller_self:
-            if hasattr(caller_self, "retry_delay"):
-                retry_delay = getattr(caller_self, "retry_delay")
-        if retry_delay is not None:
+        if retry_delay is None and caller_self:
+            retry_delay = getattr(caller_self, "retry_delay", None)
+        if retry_delay is None:
             retry_delay = GRINDER_DEFAULT_SECONDS_DELAY
         return retry_delay
 
     def __call__(self, f):
         def wrapped(*args):
-            retries = self.get_num_retries(args)
-            delay = self.get_retry_delay(args)
+            policy = RetryPolicy(self.get_num_retries(*args), self.get_retry_delay(*args))
             attempt = 0
             while True:
                 try:
                     return f(*args)
                 except Exception, e:
                     attempt += 1
-                    if attempt > retries:
-                        raise e
-                    time_to_sleep = delay * attempt
-                    LOG.error("Attempt %s: Caught exception: %s. Will retry in %s seconds." % (attempt, e, time_to_sleep))
+                    if attempt > policy.retries:
+                        raise
+                    time_to_sleep = policy.delay(attempt, policy.classify(error=e))
+                    LOG.error("Attempt %s: Caught exception: %s. Will retry in %.1f seconds." % (attempt, e, time_to_sleep))
                     time.sleep(time_to_sleep)
         return wrapped
@@ -0,0 +1,465 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Syncs many yum repositories through a single pool of workers
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import logging
+import os
+import threading
+import time
+import traceback
+import Queue
+from grinder.BandwidthLimiter import BandwidthLimiter
+from grinder.BaseFetch import BaseFetch
+from grinder.FetchQueue import HostsBusy, HostLimitedQueue
+from grinder.GrinderExceptions import GrinderException
+from grinder.ParallelFetch import ParallelFetch
+from grinder.ProgressTracker import ProgressTracker
+from grinder.activeobject import getProcessPool
+
+LOG = logging.getLogger("grinder.SyncOrchestrator")
+
+# Number of repositories whose metadata is fetched concurrently
+DEFAULT_PLAN_PARALLEL = 4
+
+class RepoDispatchFetch(object):
+    """
+    Fetcher run by the shared workers, hands each item to the fetcher
+    of the repository it belongs to, named by the item's "repo_label".
+
+    Progress reported while an item is fetched in an ActiveObject child is
+    passed back to the tracker of that repository.
+    """
+    def __init__(self):
+        self.fetchers = {}
+        # repo_label -> ProgressTracker, only present in the parent process
+        self.trackers = {}
+        self.tracker = ProgressTracker()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("trackers", None)
+        state.pop("tracker", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def addFetcher(self, repo_label, fetcher):
+        """
+        @param repo_label: label of the repository
+        @type repo_label: str
+
+        @param fetcher: fetcher of the repository's items
+        @type fetcher: grinder.RepoFetch.RepoFetch
+        """
+        self.fetchers[repo_label] = fetcher
+        self.trackers[repo_label] = fetcher.tracker
+
+    def fetchItem(self, info):
+        return self.dispatch(info, "fetchItem")
+
+    def fetchQueuedItem(self, info):
+        return self.dispatch(info, "fetchQueuedItem")
+
+    def dispatch(self, info, method):
+        """
+        Calls (method) of the fetcher of the repository (info) belongs to
+        """
+        repo_label = info["repo_label"]
+        fetcher = self.fetchers[repo_label]
+        source = info.get("source")
+        if source is not None and os.path.exists(source):
+            # another repository already fetched this content, copy it from there
+            info = info.copy()
+            info["downloadurl"] = "file://" + source
+        def update_bytes_transferred(fetchURL, download_total, downloaded):
+            self.update_bytes_transferred(fetchURL, download_total, downloaded, repo_label=repo_label)
+        def reset_bytes_transferred(fetchURL):
+            self.reset_bytes_transferred(fetchURL, repo_label=repo_label)
+        fetcher.update_bytes_transferred = update_bytes_transferred
+        fetcher.reset_bytes_transferred = reset_bytes_transferred
+        fetcher.progress_slots = getattr(self, "progress_slots", None)
+        if not hasattr(fetcher, method):
+            # fetchers not derived from BaseFetch only provide fetchItem()
+            method = "fetchItem"
+        try:
+            return getattr(fetcher, method)(info)
+        finally:
+            # the fetcher stays installed in the child for the next items
+            del fetcher.update_bytes_transferred
+            del fetcher.reset_bytes_transferred
+            fetcher.progress_slots = None
+
+    def update_bytes_transferred(self, fetchURL, download_total, downloaded, repo_label=None):
+        # Intended to be invoked on parent, not in ActiveObject Child
+        tracker = getattr(self, "trackers", {}).get(repo_label)
+        if tracker is not None:
+            tracker.update_progress_download(fetchURL, download_total, downloaded)
+
+    def reset_bytes_transferred(self, fetchURL, repo_label=None):
+        # Intended to be invoked on parent, not in ActiveObject Child
+        tracker = getattr(self, "trackers", {}).get(repo_label)
+        if tracker is not None:
+            tracker.reset_progress(fetchURL)
+
+
+class MultiRepoFetch(ParallelFetch):
+    """
+    ParallelFetch whose workers are shared by several repositories.
+
+    Each repository queues its items on its own ParallelFetch, created
+    without workers, which keeps tracking progress and status of those items
+    and produces the repository's SyncReport.  Workers take items from the
+    repositories round robin, so a large repository does not hold back the
+    others.
+
+    Content is fetched once however many repositories contain it: the first
+    item with a given checksum to be dispatched fetches it, the items of other
+    repositories with that checksum wait until it finished and are then copied
+    from where it was stored, (or find it already in place when repositories
+    share a packages location or content store).  Until then they neither
+    occupy a worker nor contend for the item's write lock.
+    """
+    def __init__(self, numThreads=10):
+        ParallelFetch.__init__(self, RepoDispatchFetch(), numThreads)
+        # repo_label -> ParallelFetch
+        self.repos = {}
+        self.labels = []
+        self.next = 0
+        # content key -> (item fetching the content, [(repo_label, item waiting for it)])
+        self.claims = {}
+        # content key -> path the content was fetched to
+        self.fetched = {}
+        # number of items copied from content fetched for another repository
+        self.deduplicated = 0
+
+    def addRepo(self, repo_label, fetcher, pFetch):
+        """
+        @param repo_label: label of the repository
+        @type repo_label: str
+
+        @param fetcher: fetcher of the repository's items
+        @type fetcher: grinder.RepoFetch.RepoFetch
+
+        @param pFetch: holds the queued items of the repository, created without workers
+        @type pFetch: grinder.ParallelFetch.ParallelFetch
+        """
+        if self.repos.has_key(repo_label):
+            raise GrinderException("Repository <%s> was added twice" % (repo_label))
+        self.fetcher.addFetcher(repo_label, fetcher)
+        self.repos[repo_label] = pFetch
+        self.labels.append(repo_label)
+        # transfers of all repositories share the workers' slots, each tracker
+        # only takes the progress of its own items from them
+        self.addProgressTracker(pFetch.tracker)
+
+    def getWorkItem(self, wait=True):
+        """
+        Returns the next item of the next repository with queued items,
+        or throws Queue.Empty exception once all are empty
+        """
+        self.statusLock.acquire()
+        try:
+            while True:
+                busy = False
+                timeout = None
+                for i in range(len(self.labels)):
+                    repo_label = self.labels[(self.next + i) % len(self.labels)]
+                    pFetch = self.repos[repo_label]
+                    pFetch.promoteDelayed()
+                    delay = pFetch.delayedQ.timeout()
+                    if delay is not None and (timeout is None or delay < timeout):
+                        timeout = delay
+                    try:
+                        item = self._takeItem(repo_label, pFetch)
+                    except Queue.Empty:
+                        continue
+                    except HostsBusy:
+                        busy = True
+                        continue
+                    self.next = (self.next + i + 1) % len(self.labels)
+                    pFetch.statusLock.acquire()
+                    try:
+                        pFetch.routeTaken(item)
+                        # the repository times the item, for its latencies and mirrors
+                        pFetch.inFlight[id(item)] = time.time()
+                        if pFetch.toSyncQ.empty() and pFetch.drainTime is None:
+                            pFetch.drainTime = time.time()
+                    finally:
+                        pFetch.statusLock.release()
+                    item["repo_label"] = repo_label
+                    return item
+                if [c for c in self.claims.values() if c[1]]:
+                    # items are waiting for content being fetched, they are requeued once it is
+                    busy = True
+                pause = 1.0
+                if timeout is not None:
+                    # items are held back to be tried again
+                    busy = True
+                    pause = min(timeout, pause)
+                if not busy or not wait or self.stopping:
+                    break
+                self.slotFree.wait(pause)
+            if self.drainTime is None:
+                self.drainTime = time.time()
+            raise Queue.Empty()
+        finally:
+            self.statusLock.release()
+
+    def _takeItem(self, repo_label, pFetch):
+        """
+        Takes the next item of a repository which is not waiting for its content
+        to be fetched for another repository.  Intended to be called with statusLock held.
+        """
+        while True:
+            item = pFetch.toSyncQ.get_nowait()
+            key = contentKey(item)
+            if key is None:
+                return item
+            if self.fetched.has_key(key):
+                item["source"] = self.fetched[key]
+                return item
+            if not self.claims.has_key(key):
+                self.claims[key] = (item, [])
+                return item
+            if self.claims[key][0] is item:
+                # the item holding the claim is tried again, (requeued, retried or failed over)
+                return item
+            if isinstance(pFetch.toSyncQ, HostLimitedQueue):
+                # it is not fetched from the host for now
+                pFetch.toSyncQ.release(item)
+            LOG.debug("%s: %s waits for its content to be fetched for another repository" %
+                      (repo_label, item.get("fileName")))
+            self.claims[key][1].append((repo_label, item))
+
+    def _releaseClaim(self, repo_label, itemInfo, status):
+        """
+        Requeues the items waiting for the content (itemInfo) fetched, they are
+        copied from it if it was fetched, otherwise they fetch it themselves
+        """
+        key = contentKey(itemInfo)
+        if key is None or status in (BaseFetch.STATUS_REQUEUE, BaseFetch.STATUS_RETRY):
+            return
+        self.statusLock.acquire()
+        try:
+            claim = self.claims.get(key)
+            if claim is None or claim[0] is not itemInfo:
+                return
+            del self.claims[key]
+            if status in (BaseFetch.STATUS_DOWNLOADED, BaseFetch.STATUS_NOOP):
+                path = os.path.abspath(self.fetcher.fetchers[repo_label].itemPath(itemInfo))
+                if os.path.exists(path):
+                    self.fetched[key] = path
+                    self.deduplicated += len(claim[1])
+            for waiting_label, item in claim[1]:
+                self.repos[waiting_label].addItem(item, requeue=True)
+            self.slotFree.notifyAll()
+        finally:
+            self.statusLock.release()
+
+    def markStatus(self, itemInfo, status, errorInfo=None):
+        repo_label = itemInfo.pop("repo_label")
+        itemInfo.pop("source", None)
+        if self.repos[repo_label].markStatus(itemInfo, status, errorInfo):
+            self._releaseClaim(repo_label, itemInfo, status)
+        self.statusLock.acquire()
+        try:
+            self.slotFree.notifyAll()
+        finally:
+            self.statusLock.release()
+
+    def start(self):
+        self.itemTotal = 0
+        for pFetch in self.repos.values():
+            self.itemTotal += pFetch.toSyncQ.qsize()
+        LOG.info("%s items from %s repositories are marked to be fetched by %s workers" %
+                 (self.itemTotal, len(self.labels), self.numThreads))
+        for t in self.threads:
+            t.start()
+
+    def waitForFinish(self):
+        """
+        Will wait for all worker threads to finish
+        """
+        self._waitForThreads()
+        self.closeProgressSlots()
+        self.endTime = time.time()
+        LOG.info("All threads have finished, fetched %s items in %s seconds, %s were copied from other repositories" %
+                 (self.itemTotal, self.endTime - self.startTime, self.deduplicated))
+
+
+class SyncOrchestrator(object):
+    """
+    Syncs many yum repositories with a global budget of workers and bandwidth.
+
+    Metadata of the repositories is fetched concurrently, then the items of
+    all repositories are fetched by a single pool of 'parallel' workers.
+    Each repository still reports progress and returns its own SyncReport.
+    """
+    def __init__(self, grinders, parallel=10, max_speed=None, plan_parallel=DEFAULT_PLAN_PARALLEL,
+                 limit_schedule=None, metrics=None):
+        """
+        @param grinders: repositories to sync, each with a distinct repo_label
+        @type grinders: list of grinder.RepoFetch.YumRepoGrinder
+
+        @param parallel: number of workers fetching items of all repositories
+        @type parallel: int
+
+        @param max_speed: bandwidth limit in KB/sec shared by all workers, replaces those of the repositories
+        @type max_speed: int
+
+        @param plan_parallel: number of repositories whose metadata is fetched concurrently
+        @type plan_parallel: int
+
+        @param limit_schedule: bandwidth limits replacing max_speed during windows of the day
+        @type limit_schedule: str, see grinder.BandwidthLimiter.LimitSchedule
+
+        @param metrics: exposes the download of each repository, replaces those of the repositories
+        @type metrics: grinder.GrinderMetrics.MetricsExporter
+        """
+        self.grinders = grinders
+        self.numThreads = int(parallel)
+        self.max_speed = max_speed
+        self.limit_schedule = limit_schedule
+        self.metrics = metrics
+        self.plan_parallel = max(int(plan_parallel), 1)
+        self.fetchPkgs = None
+        self.stopped = False
+        # repo_label -> error raised while fetching the repository's metadata
+        self.plan_errors = {}
+        # number of items copied from content fetched for another repository by the last sync
+        self.deduplicated = 0
+
+    def plan(self, basepath="./", callback=None, verify_options=None):
+        """
+        Fetches the metadata of each repository and queues its items
+
+        @return: grinders which were planned successfully
+        @rtype: list of grinder.RepoFetch.YumRepoGrinder
+        """
+        pending = Queue.Queue()
+        for grinder in self.grinders:
+            pending.put(grinder)
+        planned = []
+        lock = threading.Lock()
+        def planRepos():
+            while not self.stopped:
+                try:
+                    grinder = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    grinder.plan(basepath, repoCallback(callback, grinder.repo_label),
+                                 verify_options, workers=0)
+                except Exception, e:
+                    LOG.error("%s: unable to fetch metadata\n%s" % (grinder.repo_label, traceback.format_exc()))
+                    lock.acquire()
+                    try:
+                        self.plan_errors[grinder.repo_label] = e
+                    finally:
+                        lock.release()
+                    continue
+                lock.acquire()
+                try:
+                    planned.append(grinder)
+                finally:
+                    lock.release()
+        threads = []
+        for i in range(min(self.plan_parallel, len(self.grinders))):
+            t = threading.Thread(target=planRepos)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        # keep the order the repositories were given in
+        return [g for g in self.grinders if g in planned]
+
+    def sync(self, basepath="./", callback=None, verify_options=None):
+        """
+        Synchronous call, syncs all repositories and waits for them to finish before returning
+
+        @param callback: progress callback function, reports carry the 'repo_label' they refer to
+        @type callback: function which accepts a grinder.GrinderCallback.ProgressReport
+
+        @return: SyncReport of each repository which was planned successfully, see plan_errors for the others
+        @rtype: dict{repo_label: grinder.ParallelFetch.SyncReport}
+        """
+        startTime = time.time()
+        # the workers lease their children once planning is done, start and import them meanwhile
+        getProcessPool().warm(self.numThreads + self.plan_parallel, "grinder.RepoFetch")
+        planned = self.plan(basepath, callback, verify_options)
+        if self.stopped:
+            return {}
+        limiter = None
+        if self.max_speed or self.limit_schedule:
+            limiter = BandwidthLimiter(self.max_speed, self.limit_schedule)
+        self.fetchPkgs = MultiRepoFetch(self.numThreads)
+        for grinder in planned:
+            if limiter is not None:
+                grinder.repoFetch.limiter = limiter
+            if self.metrics is not None:
+                grinder.metrics = self.metrics
+            self.fetchPkgs.addRepo(grinder.repo_label, grinder.repoFetch, grinder.fetchPkgs)
+            grinder.startDownload()
+        reports = {}
+        try:
+            self.fetchPkgs.start()
+            self.fetchPkgs.waitForFinish()
+        finally:
+            try:
+                self.deduplicated = self.fetchPkgs.deduplicated
+                self.fetchPkgs.stop()
+                self.fetchPkgs = None
+                for grinder in planned:
+                    # one repository failing to finish must not cost the others their report
+                    try:
+                        reports[grinder.repo_label] = grinder.finishDownload()
+                    except Exception:
+                        LOG.error("%s: unable to finish download\n%s" % (grinder.repo_label, traceback.format_exc()))
+            finally:
+                if limiter is not None:
+                    limiter.close()
+        LOG.info("Synced %s repositories in %s seconds, %s failed to fetch metadata" %
+                 (len(planned), time.time() - startTime, len(self.plan_errors)))
+        return reports
+
+    def stop(self, block=True):
+        LOG.info("Stopping")
+        self.stopped = True
+        for grinder in self.grinders:
+            grinder.stopped = True
+        if self.fetchPkgs:
+            self.fetchPkgs.stop()
+            if block:
+                self.fetchPkgs._waitForThreads()
+
+def contentKey(item):
+    """
+    @return: key identifying the content of (item), None if it has no checksum
+    @rtype: tuple
+    """
+    checksum = item.get("checksum")
+    if not checksum or not item.get("checksumtype"):
+        return None
+    return (item["checksumtype"], checksum.lower(), str(item.get("size")))
+
+def repoCallback(callback, repo_label):
+    """
+    @return a progress callback labelling each report with (repo_label), None if (callback) is None
+    """
+    if callback is None:
+        return None
+    def labelled(report):
+        report.repo_label = repo_label
+        callback(report)
+    return labelled
@@ -0,0 +1,205 @@
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public
+# License as published by the Free Software Foundation; either version
+# 2 of the License (GPLv2) or (at your option) any later version.
+# There is NO WARRANTY for this software, express or implied,
+# including the implied warranties of MERCHANTABILITY,
+# NON-INFRINGEMENT, or FITNESS FOR A PARTICULAR PURPOSE. You should
+# have received a copy of GPLv2 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+LOG = logging.getLogger("grinder.VerifyCache")
+
+# Name of the database, created in the cache directory of a repository, see GrinderUtils.get_cache_dir()
+VERIFY_CACHE_NAME = ".grinder_verify.db"
+# Default bound on the number of files remembered
+DEFAULT_MAX_ENTRIES = 500000
+# Number of records written to the database in a single transaction
+DEFAULT_BATCH_SIZE = 500
+# Seconds records are held back at most before they are written
+COMMIT_INTERVAL = 5
+
+class VerifyCache(object):
+    """
+    Persistent record of checksums computed for files on disk.
+
+    An entry is only trusted while the inode, size and mtime of the file
+    still match what they were when it was hashed, so a re-sync does not
+    need to re-read every existing package to verify it.
+
+    Records are written in batches, of batch_size or once COMMIT_INTERVAL
+    seconds passed, and when flush() or close() is called.  Records still
+    held back when a process ends are lost, which only costs re-hashing.
+
+    Errors from the underlying sqlite database are logged and treated as a
+    cache miss, the cache never causes a fetch to fail.
+    Instances may be pickled, (as is done when passed to an ActiveObject),
+    each process and thread opens its own connection.
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        @param path: path of the sqlite database, created if missing
+        @type path: str
+
+        @param max_entries: number of files remembered, least recently verified
+                            entries are removed by prune(), None for no limit
+        @type max_entries: int
+
+        @param batch_size: number of records written to the database at once
+        @type batch_size: int
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # copies handed to other processes see what was recorded so far
+        self.flush()
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        conn = sqlite3.connect(self.path, timeout=30)
+        # Losing the tail of the cache on a crash only costs re-hashing
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE IF NOT EXISTS verified ("
+                     "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                     "mtime REAL, hashtype TEXT, checksum TEXT, verified REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS verified_time ON verified (verified)")
+        conn.commit()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        # (path, hashtype) -> row not yet written, and the time the oldest was recorded
+        self._local.pending = {}
+        self._local.since = None
+        return conn
+
+    def lookup(self, filePath, hashtype):
+        """
+        @param filePath: path of an existing file
+        @type filePath: str
+
+        @param hashtype: checksum type
+        @type hashtype: str
+
+        @return: checksum recorded for the file if it is unchanged since it was hashed, otherwise None
+        @rtype: str
+        """
+        try:
+            statinfo = os.stat(filePath)
+            conn = self._connect()
+            row = self._local.pending.get((filePath, hashtype))
+            if row is not None:
+                row = (row[1], row[2], row[3], row[5])
+            else:
+                row = conn.execute("SELECT inode, size, mtime, checksum FROM verified "
+                                   "WHERE path=? AND hashtype=?", (filePath, hashtype)).fetchone()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Verify cache lookup of %s failed: %s" % (filePath, e))
+            return None
+        if row is None:
+            return None
+        inode, size, mtime, checksum = row
+        if inode != statinfo.st_ino or size != statinfo.st_size or mtime != statinfo.st_mtime:
+            return None
+        return checksum
+
+    def record(self, filePath, hashtype, checksum):
+        """
+        Remember the checksum computed for a file as it is now on disk.
+
+        @param filePath: path of an existing file
+        @type filePath: str
+
+        @param hashtype: checksum type
+        @type hashtype: str
+
+        @param checksum: value computed from the contents of the file
+        @type checksum: str
+        """
+        try:
+            statinfo = os.stat(filePath)
+            self._connect()
+        except (OSError, sqlite3.Error), e:
+            LOG.debug("Unable to record %s in verify cache: %s" % (filePath, e))
+            return
+        now = time.time()
+        pending = self._local.pending
+        # a file recorded under another checksum type replaces the row, as in the database
+        for key in [k for k in pending.keys() if k[0] == filePath]:
+            del pending[key]
+        pending[(filePath, hashtype)] = (filePath, statinfo.st_ino, statinfo.st_size, statinfo.st_mtime,
+                                         hashtype, checksum, now)
+        if self._local.since is None:
+            self._local.since = now
+        if len(pending) >= self.batch_size or now - self._local.since >= COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the records held back by the calling thread to the database
+        """
+        pending = getattr(self._local, "pending", None)
+        if not pending or self._local.pid != os.getpid():
+            return
+        rows = pending.values()
+        pending.clear()
+        self._local.since = None
+        try:
+            conn = self._local.conn
+            conn.executemany("INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        except sqlite3.Error, e:
+            LOG.debug("Unable to write %s records to verify cache: %s" % (len(rows), e))
+
+    def prune(self):
+        """
+        Removes the least recently verified entries beyond max_entries.
+        @return: number of entries removed
+        @rtype: int
+        """
+        if not self.max_entries:
+            self.flush()
+            return 0
+        try:
+            conn = self._connect()
+            self.flush()
+            count = conn.execute("SELECT COUNT(*) FROM verified").fetchone()[0]
+            excess = count - int(self.max_entries)
+            if excess <= 0:
+                return 0
+            conn.execute("DELETE FROM verified WHERE path IN "
+                         "(SELECT path FROM verified ORDER BY verified LIMIT ?)", (excess,))
+            conn.commit()
+        except sqlite3.Error, e:
+            LOG.warning("Unable to prune verify cache %s: %s" % (self.path, e))
+            return 0
+        LOG.info("Pruned %s entries from verify cache %s" % (excess, self.path))
+        return excess
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self.flush()
+            conn.close()
+            self._local.conn = None
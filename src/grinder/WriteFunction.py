@@ -12,21 +12,40 @@
 #
 import pycurl
 import os
+import hashlib
 import logging
+import time
 
 LOG = logging.getLogger("grinder.WriteFunction")
 
 class WriteFunction(object):
     """ utility callback to acumulate response"""
-    def __init__(self, path, size=None):
+    def __init__(self, path, size=None, hashtype=None, limiter=None, block=True):
         """
         @param path: path to where the file is written to disk.
         @type path: str
         @param size: file size if available to compare.
         @type size: int
+        @param hashtype: if specified a checksum of this type is computed
+                         while the file is written, see hexdigest()
+        @type hashtype: str
+        @param limiter: if specified, received data is drawn from its bandwidth budget
+        @type limiter: grinder.BandwidthLimiter.BandwidthLimiter
+        @param block: if False, callback() does not sleep while the limiter is in deficit,
+                      it sets resume_at and pauses the transfer, setting paused, which
+                      the caller unpauses once resume_at has passed
+        @type block: bool
         """
         self.wfile = path
         self.size = size
+        self.hashtype = hashtype
+        self.hash = None
+        self.limiter = limiter
+        self.block = block
+        # time before which no more data should be received, see (block)
+        self.resume_at = 0
+        # True once callback() paused the transfer, until the caller unpauses it
+        self.paused = False
         self.fp = None
         self.offset = 0
         self.chunk_read = 0
@@ -38,13 +57,48 @@ class WriteFunction(object):
             LOG.debug("File exists; offset at %s" % self.offset)
         self.fp = open(self.wfile, 'a+')
         self.chunk_read = self.offset
-        
+        if self.hashtype:
+            self.setup_hash()
+
+    def setup_hash(self):
+        hashtype = self.hashtype
+        if hashtype in ['sha', 'SHA']:
+            hashtype = 'sha1'
+        try:
+            self.hash = hashlib.new(hashtype)
+        except ValueError, e:
+            LOG.debug("Unable to compute <%s> checksum while writing %s: %s" % (hashtype, self.wfile, e))
+            self.hash = None
+            return
+        if self.offset > 0:
+            # Resuming a partial download, the bytes already on disk are read once
+            self.fp.seek(0, 0)
+            while 1:
+                buffer = self.fp.read(65536)
+                if not buffer:
+                    break
+                self.hash.update(buffer)
+
+
     def callback(self, chunk):
         """
         @param chunk: data chunk buffer to write or append to a file object
         @type chunk: str
         """
         #LOG.debug("processing chunk %s" % len(chunk))
+        if self.limiter is not None:
+            if self.block:
+                self.limiter.consume(len(chunk))
+            else:
+                now = time.time()
+                if self.resume_at > now:
+                    # libcurl keeps the chunk and passes it again once the transfer is unpaused,
+                    # which is left to the caller, (see paused)
+                    self.paused = True
+                    return pycurl.WRITEFUNC_PAUSE
+                delay = self.limiter.draw(len(chunk))
+                if delay > 0:
+                    self.resume_at = now + delay
         self.chunk_read += len(chunk)
         if self.size and self.size == self.offset:
             # "File already exists with right size
@@ -53,12 +107,23 @@ class WriteFunction(object):
         if self.offset <= self.chunk_read:
             self.fp.seek(self.offset)
         self.fp.write(chunk)
+        if self.hash is not None:
+            self.hash.update(chunk)
         #LOG.debug("Total chunk size read %s" % self.chunk_read)
 
     def get_offset(self):
         self.offset = os.stat(self.wfile).st_size
         return self.offset
 
+    def hexdigest(self):
+        """
+        @return: checksum of the data written to the file, None if it was not computed
+        @rtype: str
+        """
+        if self.hash is None:
+            return None
+        return self.hash.hexdigest()
+
     def cleanup(self):
         self.fp.close()
         self.offset = 0
@@ -14,14 +14,17 @@
 #
 import os
 import re
+import glob
 import yum
+import rpmUtils.miscutils
 import time
 import logging
 import shutil
 import traceback
-from grinder.activeobject import ActiveObject
-from grinder.BaseFetch import BaseFetch
+from grinder.activeobject import ActiveObject, getProcessPool
+from grinder.BaseFetch import BaseFetch, getFileChecksum
 from grinder.PrestoParser import PrestoParser
+from grinder.PrimaryParser import PrimaryParser
 from grinder.GrinderExceptions import GrinderException
 from grinder.GrinderUtils import GrinderUtils
 from grinder.Retry import Retry
@@ -47,11 +50,14 @@ class YumMetadataObj(object):
                  mirrorlist=None,
                  proxy_url=None, proxy_port=None,
                  proxy_user=None, proxy_pass=None,
-                 sslverify=1, tmp_path=None, filter=None, num_retries=None, retry_delay=None):
+                 sslverify=1, tmp_path=None, filter=None, num_retries=None, retry_delay=None,
+                 streaming_metadata=False):
         self.repo = None
         self.repo_label = repo_label
         self.repo_url = repo_url.encode('ascii', 'ignore')
         self.mirrorlist = mirrorlist
+        # base URLs of the repository, (the mirrors listed by a mirrorlist), the first is preferred
+        self.base_urls = [self.repo_url]
         self.repo_dir = None
         self.pkgpath = None
         self.sslcacert = cacert
@@ -66,10 +72,14 @@ class YumMetadataObj(object):
         self.filter = filter
         self.num_retries = num_retries
         self.retry_delay = retry_delay
+        # read packages from primary.xml as it is parsed rather than through a yum PackageSack
+        self.streaming_metadata = streaming_metadata
+        self.primarymd = None
         LOG.info("YumMetadataObj:  self.num_retries = %s, self.retry_delay = %s" % (self.num_retries, self.retry_delay))
 
     def getDownloadItems(self, repo_dir="./", packages_location=None,
-                         skip=None, newest=False, remove_old=False, numOldPackages=None):
+                         skip=None, newest=False, remove_old=False, numOldPackages=None,
+                         previous_repomd=None):
         """
         @param repo_dir path to store repository files
         @type repo_dir: str
@@ -90,8 +100,13 @@ class YumMetadataObj(object):
         @param numOldPackages: If removing old packages, this specifies how many OLD packages will be kept.
         @type numOldPackages: int
 
-        @return info required to fetch "rpms" and "drpms"
-        @rtype: dict  {"rpms":[], "drpms":[]}
+        @param previous_repomd: checksum of the repomd.xml under repo_dir, recorded after it was fully synced.
+                If unchanged nothing is fetched and {"unchanged":True} is returned, otherwise rpms already
+                synced with the previous metadata are returned under "existing_rpms" rather than "rpms"
+        @type previous_repomd: str
+
+        @return info required to fetch "rpms" and "drpms", items are fetched from the first of "mirrors"
+        @rtype: dict  {"rpms":[], "drpms":[], "existing_rpms":[], "unchanged":bool, "mirrors":[]}
         """
         download_items = {}
         try:
@@ -101,11 +116,18 @@ class YumMetadataObj(object):
             tmpdir = TmpDir()
             tmpdir.create(self.repo_label)
             self.__setupRepo(repo_dir, tmpdir.path(), packages_location)
+            download_items["mirrors"] = self.base_urls
+            if previous_repomd and self.__getRepomdChecksum() == previous_repomd:
+                LOG.info("%s: repomd.xml is unchanged since the last sync" % (self.repo_label))
+                download_items["unchanged"] = True
+                return download_items
             self.__getRepoData()
             if not skip:
                 skip = {}
             if 'rpm' not in skip:
                 rpms = self.__getRPMs(newest, remove_old, numOldPackages)
+                if previous_repomd:
+                    rpms, download_items["existing_rpms"] = self.__splitExistingRPMs(rpms)
                 if 'drpm' not in skip:
                     drpms = self.__getDRPMs()
                     download_items["drpms"] = drpms
@@ -136,6 +158,8 @@ class YumMetadataObj(object):
             self.repo.proxy_username = self.proxy_user
             self.repo.proxy_password = self.proxy_pass
         self.repo.baseurlSetup()
+        if self.mirrorlist and self.repo.urls:
+            self.base_urls = [url.rstrip("/") for url in self.repo.urls]
         self.deltamd = None
         self.repo.sslcacert = self.sslcacert
         self.repo.sslclientcert = self.sslclientcert
@@ -147,6 +171,11 @@ class YumMetadataObj(object):
             self.repo.close()
 
     def __getPackageList(self, newest=False):
+        if self.streaming_metadata:
+            pkglist = PrimaryParser(self.primarymd).getPackages()
+            if newest:
+                pkglist = self.__getNewestByNameArch(pkglist)
+            return pkglist
         sack = self.repo.getPackageSack()
         sack.populate(self.repo, 'metadata', None, 0)
         if newest:
@@ -155,6 +184,18 @@ class YumMetadataObj(object):
             download_list = sack.returnPackages()
         return download_list
 
+    def __getNewestByNameArch(self, pkglist):
+        newest = {}
+        for pkg in pkglist:
+            key = (pkg.name, pkg.arch)
+            if newest.has_key(key):
+                cur = newest[key]
+                if rpmUtils.miscutils.compareEVR((cur.epoch, cur.version, cur.release),
+                                                 (pkg.epoch, pkg.version, pkg.release)) >= 0:
+                    continue
+            newest[key] = pkg
+        return newest.values()
+
     def __getDeltaPackageList(self):
         if not self.deltamd:
             return []
@@ -177,6 +218,55 @@ class YumMetadataObj(object):
             LOG.error("Caught exception when trying to fetch metadata file %s from [%s]: %s" % (ftype, self.repo_url, e))
             raise
 
+    def __getRepomdChecksum(self):
+        self.__getRepoXmlFileTypes()
+        repomd = os.path.join(self.repo.basecachedir, self.repo_label, "repomd.xml")
+        return getFileChecksum("sha256", filename=repomd)
+
+    def __splitExistingRPMs(self, rpms):
+        """
+        Separates rpms already synced from the metadata under repo_dir/repodata from those to be fetched
+        @return (rpms to fetch, existing rpms)
+        @rtype: tuple
+        """
+        primary = glob.glob(os.path.join(self.repo_dir, "repodata", "*primary.xml*"))
+        if len(primary) != 1:
+            LOG.info("Unable to determine previous primary metadata from %s" % (primary))
+            return rpms, []
+        previous = set()
+        for pkg in PrimaryParser(primary[0]).getPackages():
+            previous.add((pkg.relativepath, pkg.checksums[0][1]))
+        fetch = []
+        existing = []
+        for info in rpms:
+            if (info["relativepath"], info["checksum"]) in previous and \
+                    os.path.exists(os.path.join(info["savepath"], info["fileName"])):
+                existing.append(info)
+            else:
+                fetch.append(info)
+        LOG.info("%s packages are unchanged since the last sync, %s packages are new" % (len(existing), len(fetch)))
+        return fetch, existing
+
+    def __seedMetadataCache(self):
+        """
+        Places the metadata from the previous sync in yum's cache directory.
+        yum verifies a cached file against the checksum in the new repomd.xml
+        and only downloads the metadata types which have changed.
+        """
+        local_repo_path = os.path.join(self.repo_dir, "repodata")
+        if not os.path.isdir(local_repo_path):
+            return
+        cachedir = os.path.join(self.repo.basecachedir, self.repo_label)
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        for name in os.listdir(local_repo_path):
+            src = os.path.join(local_repo_path, name)
+            dst = os.path.join(cachedir, name)
+            if name == "repomd.xml" or not os.path.isfile(src) or os.path.exists(dst):
+                continue
+            # copied rather than linked, yum may rewrite a stale file in place
+            shutil.copyfile(src, dst)
+
     def __getRepoData(self):
         local_repo_path = "%s/%s" % (self.repo_dir, "repodata.new")
         if not os.path.exists(local_repo_path):
@@ -185,6 +275,7 @@ class YumMetadataObj(object):
             except IOError, e:
                 LOG.error("Unable to create repo directory %s" % local_repo_path)
                 raise
+        self.__seedMetadataCache()
         for ftype in self.__getRepoXmlFileTypes():
             try:
                 if ftype == "primary_db":
@@ -198,6 +289,8 @@ class YumMetadataObj(object):
                 shutil.copyfile(ftypefile, destfile)
                 if ftype == "prestodelta":
                     self.deltamd = destfile
+                if ftype == "primary":
+                    self.primarymd = destfile
             except Exception, e:
                 tb_info = traceback.format_exc()
                 LOG.debug("%s" % (tb_info))
@@ -215,7 +308,7 @@ class YumMetadataObj(object):
         items = []
         pkglist = self.__getPackageList(newest)
         if remove_old and not newest:
-            pkglist = self._prune_package_list(pkglist, numOldPackages)
+            pkglist = self._prune_package_list(list(pkglist), numOldPackages)
         if self.filter:
             pkglist = self._filter_package_list(pkglist)
         for pkg in pkglist:
@@ -229,7 +322,7 @@ class YumMetadataObj(object):
             if re.match(URL_PROTO_REGEX, pkg.remote_url):
                 info['downloadurl'] = pkg.remote_url
             else:
-                info['downloadurl'] = self.repo_url + '/' + pkg.relativepath
+                info['downloadurl'] = self.base_urls[0] + '/' + pkg.relativepath
             info['savepath'] = self.repo_dir + '/' + os.path.dirname(pkg.relativepath)
             info['checksumtype'], info['checksum'], status = pkg.checksums[0]
             info['size'] = pkg.size
@@ -281,7 +374,7 @@ class YumMetadataObj(object):
                 relativepath = drpm.filename
                 info['new_package'] = nevra
                 info['fileName'] = drpm.filename
-                info['downloadurl'] = self.repo_url + '/' + relativepath
+                info['downloadurl'] = self.base_urls[0] + '/' + relativepath
                 info['relativepath'] = relativepath
                 info['savepath'] = self.repo_dir
                 info['epoch'] = drpm.epoch
@@ -337,12 +430,15 @@ class YumMetadataObj(object):
         run pkglist through self.filter
         pkglist: list of packages as returned from yum's package sack
         """
-        if pkglist:
-            LOG.debug("YumInfo._filter_package_list(pkglist=<%s packages>)" 
-                      % (len(pkglist)))
         if not self.filter:
             LOG.debug("_filter_package_list() called with no filter")
             return pkglist
+        if not isinstance(pkglist, list):
+            # packages streamed from metadata are filtered as they are read
+            return (pkg for pkg in pkglist if self.filter.test(pkg))
+        if pkglist:
+            LOG.debug("YumInfo._filter_package_list(pkglist=<%s packages>)" 
+                      % (len(pkglist)))
         pkglist_filtered = [ pkg for pkg in pkglist if self.filter.test(pkg) ]
         LOG.debug("_filter_package_list():  %s packages after filtering" % 
                   (len(pkglist_filtered)))
@@ -367,9 +463,14 @@ class YumInfo(object):
                  proxy_pass=None, sslverify=1,
                  remove_old=False, numOldPackages=2, skip=None, max_speed=None,
                  purge_orphaned=True, distro_location=None, tmp_path=None,
-                 filter=None, num_retries=None, retry_delay=None):
+                 filter=None, num_retries=None, retry_delay=None, streaming_metadata=False,
+                 previous_repomd=None):
         self.rpms = []
         self.drpms = []
+        self.existing_rpms = []
+        self.unchanged = False
+        # base URLs items may be fetched from, more than one when (mirrors) is a mirrorlist
+        self.base_urls = []
         self.repo_label = repo_label
         self.repo_url = repo_url
         self.mirrors = mirrors
@@ -400,6 +501,8 @@ class YumInfo(object):
         self.filter = filter
         self.num_retries = num_retries
         self.retry_delay = retry_delay
+        self.streaming_metadata = streaming_metadata
+        self.previous_repomd = previous_repomd
 
     def setUp(self):
         yum_metadata_obj = YumMetadataObj(
@@ -410,16 +513,24 @@ class YumInfo(object):
             proxy_url=self.proxy_url, proxy_port=self.proxy_port,
             proxy_user=self.proxy_user, proxy_pass=self.proxy_pass,
             sslverify=self.sslverify, tmp_path=self.tmp_path,
-            filter=self.filter, num_retries=self.num_retries, retry_delay=self.retry_delay)
+            filter=self.filter, num_retries=self.num_retries, retry_delay=self.retry_delay,
+            streaming_metadata=self.streaming_metadata)
         yumAO = None
         try:
-            yumAO = ActiveObject(yum_metadata_obj)
+            yumAO = ActiveObject(yum_metadata_obj, pool=getProcessPool())
             download_items = yumAO.getDownloadItems(repo_dir=self.repo_dir,
                                                     packages_location=self.pkgpath,
                                                     newest=self.newest,
                                                     remove_old=self.remove_old,
                                                     numOldPackages=self.numOldPackages,
-                                                    skip=self.skip)
+                                                    skip=self.skip,
+                                                    previous_repomd=self.previous_repomd)
+            if download_items.has_key("mirrors"):
+                self.base_urls = download_items["mirrors"]
+            if download_items.has_key("unchanged"):
+                self.unchanged = download_items["unchanged"]
+            if download_items.has_key("existing_rpms"):
+                self.existing_rpms.extend(download_items["existing_rpms"])
             if download_items.has_key("rpms"):
                 if download_items["rpms"]:
                     self.rpms.extend(download_items["rpms"])
@@ -427,5 +538,8 @@ class YumInfo(object):
                 if download_items["drpms"]:
                     self.drpms.extend(download_items["drpms"])
         finally:
-            # Force __del__ to be called on ActiveObject
+            # Kill the child now rather than when __del__ is called, yum leaks memory
+            # (bz 737523) so the child it ran in is never handed back to the pool
+            if yumAO is not None:
+                yumAO.dummy_method.release(recycle=True)
             del yumAO
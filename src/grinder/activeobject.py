@@ -21,21 +21,30 @@ Protocol:
          retval = log-record
      3 = Parent Method (back) Invocation
          (child->parent)
+     4 = Yielded Value
+         retval = value yielded by a generator method,
+         followed by a Normal Return once exhausted
  Record:
-   call  = (object, method, *args, **kwargs)
+   call  = (install, method, args, kwargs, syncstate)
    log   = (logger, level, msg, args)
    reply = (code, retval, state)
+ The object is sent once, as install = (object, pmethods), and kept
+ by the child for the following calls, which send install = None.
+ A call with method = None drops the installed object.
+ The object state is only returned, (state != None), when syncstate.
 """
 
 import os
 import sys
 import errno
+import types
+import atexit
 import logging
 import inspect
 import cPickle as pickle
 import traceback as tb
 from subprocess import Popen, PIPE
-from threading import RLock
+from threading import RLock, Thread, Lock
 from signal import SIGTERM
 
 
@@ -44,6 +53,7 @@ RETURN = 0
 EXCEPTION = 1
 LOG = 2
 PMETHOD = 3
+YIELD = 4
 
 
 class Method:
@@ -71,6 +81,32 @@ class Method:
         """
         self.object._ActiveObject__kill()
 
+    def stream(self, consumer, *args, **kwargs):
+        """
+        Invoke a generator method, (consumer) is called in the parent
+        with each value as soon as it is yielded in the child.
+        @param consumer: Called with each yielded value.
+        @type consumer: callable
+        """
+        return self.object._ActiveObject__stream(self, consumer, args, kwargs)
+
+    def reinstall(self):
+        """
+        Send the object to the child again with the next call,
+        needed after the object was modified in the parent.
+        """
+        self.object._ActiveObject__reinstall()
+
+    def release(self, recycle=False):
+        """
+        Done with the active object, the child process is returned
+        to its pool, (or killed when it has none).
+        @param recycle: Kill the child rather than returning it to its pool,
+            for objects known to leave their child bloated, (such as yum's).
+        @type recycle: bool
+        """
+        self.object._ActiveObject__release(recycle)
+
     def __call__(self, *args, **kwargs):
         """
         Method invocation using the active object.
@@ -92,16 +128,29 @@ class ActiveObject:
     @type __child: Process
     @ivar __mutex: Mutex to ensure serial RMI.
     @type __mutex: RLock
+    @ivar __pool: Pool the child process is leased from, if any.
+    @type __pool: L{ProcessPool}
+    @ivar __token: Identifies this object once installed in a child.
+    @type __token: int
+    @ivar __syncstate: Update the object with its state in the child after each call.
+    @type __syncstate: bool
     """
 
-    def __init__(self, object, *pmethods):
+    def __init__(self, object, *pmethods, **options):
         """
         @param object: A I{real} object whos methods are invoked
             in the child process.
         @type object: object
+        @param options: pool=L{ProcessPool} to lease the child process from,
+            syncstate=True to update (object) with the state of its copy in
+            the child after each call.
         """
         self.object = object
         self.__pmethods = pmethods
+        self.__pool = options.get("pool")
+        self.__syncstate = options.get("syncstate", False)
+        self.__token = nexttoken()
+        self.__consumer = None
         self.__child = None
         self.__mutex = RLock()
         self.__spawn()
@@ -120,17 +169,35 @@ class ActiveObject:
         @type kwargs: dict
         """
         p = self.__child
-        call = ((self.object, self.__pmethods), method, args, kwargs)
+        install = None
+        if method is not None and p.installed != self.__token:
+            install = (self.object, self.__pmethods)
+        call = (install, method, args, kwargs, self.__syncstate)
+        p.calls += 1
+        # until the reply is read, the child holds an unknown object
+        p.installed = None
         pickle.dump(call, p.stdin)
         p.stdin.flush()
+        yielded = []
         while True:
             packet = pickle.load(p.stdout)
             code = packet[0]
+            if code == RETURN and method is not None:
+                p.installed = self.__token
             if code == RETURN:
                 retval = packet[1]
                 state = packet[2]
-                setstate(self.object, state)
+                if state is not None:
+                    setstate(self.object, state)
+                if yielded:
+                    return yielded
                 return retval
+            if code == YIELD:
+                if self.__consumer is not None:
+                    self.__consumer(packet[1])
+                else:
+                    yielded.append(packet[1])
+                continue
             if code == EXCEPTION:
                 ex = packet[1]
                 if isinstance(ex, Exception):
@@ -179,13 +246,12 @@ class ActiveObject:
 
     def __spawn(self):
         """
-        Spawn the child process.
+        Spawn the child process, (or lease one from the pool).
         """
-        args = [
-            sys.executable,
-            __file__,]
-        args.extend(sys.path)
-        self.__child = Popen(args, close_fds=True, stdin=PIPE, stdout=PIPE)
+        if self.__pool is not None:
+            self.__child = self.__pool.lease()
+        else:
+            self.__child = spawn()
         
     def __respawn(self):
         """
@@ -214,6 +280,40 @@ class ActiveObject:
         finally:
             self.__unlock()
 
+    def __release(self, recycle=False):
+        """
+        Return the child process to the pool, after it dropped the object.
+        Without a pool, (or when recycled), the child is killed.
+        """
+        if self.__pool is None or recycle:
+            self.__kill()
+            return
+        self.__lock()
+        try:
+            p = self.__child
+            if not p:
+                return
+            try:
+                if p.calls:
+                    self.__rmi(None, (), {})
+            except Exception:
+                self.__kill()
+                return
+            self.__child = None
+        finally:
+            self.__unlock()
+        self.__pool.release(p)
+
+    def __reinstall(self):
+        """
+        Send the object with the next call.
+        """
+        self.__lock()
+        try:
+            self.__token = nexttoken()
+        finally:
+            self.__unlock()
+
     def __lock(self):
         """
         Lock the object.
@@ -266,7 +366,29 @@ class ActiveObject:
         try:
             if not self.__child:
                 self.__spawn()
-            return self.__call(method, args, kwargs)
+            try:
+                return self.__call(method, args, kwargs)
+            finally:
+                if self.__pool is not None and self.__child and self.__pool.expired(self.__child):
+                    # recycled, the next call is made in a fresh child
+                    self.__kill()
+        finally:
+            self.__unlock()
+
+    def __stream(self, method, consumer, args, kwargs):
+        """
+        Generator method invocation.
+        Without a consumer, the list of yielded values is returned.
+        @param consumer: Called with each yielded value.
+        @type consumer: callable
+        """
+        self.__lock()
+        try:
+            self.__consumer = consumer
+            try:
+                return self(method, *args, **kwargs)
+            finally:
+                self.__consumer = None
         finally:
             self.__unlock()
 
@@ -283,7 +405,223 @@ class ActiveObject:
         """
         Clean up the child process.
         """
-        self.__kill()
+        self.__release()
+
+
+# Calls a pooled child process serves before it is recycled
+DEFAULT_MAX_CALLS = 1000
+# Resident memory in bytes above which a pooled child process is recycled
+DEFAULT_MAX_RSS = 512 * 1024 * 1024
+# Idle child processes kept by a pool
+DEFAULT_MAX_IDLE = 20
+
+class ProcessPool:
+    """
+    Child processes kept running between active objects, so each new
+    active object does not pay for starting an interpreter and importing
+    its modules.  Children are recycled once they have served max_calls
+    calls or grown beyond max_rss bytes, preserving the isolation of leaks
+    active objects are used for.
+    @ivar idle: Child processes waiting to be leased.
+    @type idle: list
+    """
+
+    def __init__(self, max_calls=DEFAULT_MAX_CALLS, max_rss=DEFAULT_MAX_RSS, max_idle=DEFAULT_MAX_IDLE):
+        """
+        @param max_calls: Calls served before a child is recycled, None for no limit.
+        @type max_calls: int
+        @param max_rss: Resident bytes above which a child is recycled, None for no limit.
+        @type max_rss: int
+        @param max_idle: Idle children kept, others are killed when released.
+        @type max_idle: int
+        """
+        self.max_calls = max_calls
+        self.max_rss = max_rss
+        self.max_idle = max_idle
+        self.idle = []
+        self.__mutex = RLock()
+
+    def lease(self):
+        """
+        @return: An idle child process, a new one when none is idle.
+        @rtype: Popen
+        """
+        self.__mutex.acquire()
+        try:
+            while self.idle:
+                p = self.idle.pop()
+                if p.poll() is None:
+                    return p
+                close(p)
+        finally:
+            self.__mutex.release()
+        return spawn()
+
+    def release(self, p):
+        """
+        Return a leased child process, killed if it is due to be recycled.
+        @param p: A child process returned by lease().
+        @type p: Popen
+        """
+        if p.poll() is not None or self.expired(p):
+            terminate(p)
+            return
+        self.__mutex.acquire()
+        try:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(p)
+                return
+        finally:
+            self.__mutex.release()
+        terminate(p)
+
+    def expired(self, p):
+        """
+        @return: True when (p) has served max_calls calls or exceeds max_rss.
+        @rtype: bool
+        """
+        if self.max_calls and p.calls >= self.max_calls:
+            return True
+        if self.max_rss:
+            rss = residentSize(p.pid)
+            if rss is not None and rss > self.max_rss:
+                return True
+        return False
+
+    def warm(self, count, *modules):
+        """
+        Start child processes in the background until (count) are idle.
+        @param count: The number of idle children wanted.
+        @type count: int
+        @param modules: Names of modules the children import.
+        @type modules: list
+        """
+        self.__mutex.acquire()
+        try:
+            needed = min(count, self.max_idle) - len(self.idle)
+        finally:
+            self.__mutex.release()
+        for i in range(needed):
+            t = Thread(target=self.__preload, args=(modules,))
+            t.setDaemon(True)
+            t.start()
+
+    def __preload(self, modules):
+        ao = ActiveObject(Preloader(modules), pool=self)
+        try:
+            ao.load()
+        finally:
+            ao.dummy_method.release()
+
+    def shutdown(self):
+        """
+        Kill all idle child processes.
+        """
+        self.__mutex.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.__mutex.release()
+        for p in idle:
+            terminate(p)
+
+
+class Preloader:
+    """
+    Imports modules in a pooled child process.
+    """
+
+    def __init__(self, modules):
+        self.modules = modules
+
+    def load(self):
+        """
+        Generator, yields the name of each module once imported.
+        """
+        for name in self.modules:
+            __import__(name)
+            yield name
+
+
+def spawn():
+    """
+    Spawn a child process.
+    @return: The child process.
+    @rtype: Popen
+    """
+    args = [
+        sys.executable,
+        __file__,]
+    args.extend(sys.path)
+    p = Popen(args, close_fds=True, stdin=PIPE, stdout=PIPE)
+    p.calls = 0
+    # token of the object installed in the child
+    p.installed = None
+    return p
+
+_token = [0]
+_token_lock = Lock()
+
+def nexttoken():
+    """
+    @return: A token identifying an object installed in a child.
+    @rtype: int
+    """
+    _token_lock.acquire()
+    try:
+        _token[0] += 1
+        return _token[0]
+    finally:
+        _token_lock.release()
+
+def close(p):
+    """
+    Close the pipes of a child process and reap it.
+    """
+    p.stdin.close()
+    p.stdout.close()
+    p.wait()
+
+def terminate(p):
+    """
+    Kill a child process.
+    """
+    kill(p.pid)
+    close(p)
+
+def residentSize(pid):
+    """
+    @return: Resident memory in bytes of process (pid), None if unknown.
+    @rtype: int
+    """
+    try:
+        f = open("/proc/%s/statm" % pid)
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+_pool = None
+_pool_lock = RLock()
+
+def getProcessPool():
+    """
+    @return: The process wide pool of child processes.
+    @rtype: L{ProcessPool}
+    """
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = ProcessPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+    finally:
+        _pool_lock.release()
         
         
 class ParentMethod:
@@ -412,24 +750,40 @@ class Logger:
         return self.Method(self, name)
 
     
+# The object installed in this (child) process
+installed = [None]
+
 def process():
     """
     Reads and processes RMI requests.
-     Input: (object, method, args, kwargs)
+     Input: (install, method, args, kwargs, syncstate)
     Output: (code, retval, state)
     See: Protocol.
     """
     code = RETURN
-    state = {}
+    state = None
     try:
-        call = pickle.load(sys.stdin)
-        object, pmethods = call[0]
-        setpmethods(object, pmethods)
-        method = getattr(object, call[1])
-        args = call[2]
-        kwargs = call[3]
-        retval = method(*args, **kwargs)
-        state = getstate(object)
+        install, name, args, kwargs, syncstate = pickle.load(sys.stdin)
+        if install is not None:
+            object, pmethods = install
+            setpmethods(object, pmethods)
+            installed[0] = object
+        object = installed[0]
+        if name is None:
+            installed[0] = None
+            retval = None
+        else:
+            if object is None:
+                raise Exception("No object is installed")
+            method = getattr(object, name)
+            retval = method(*args, **kwargs)
+            if isinstance(retval, types.GeneratorType):
+                for value in retval:
+                    pickle.dump((YIELD, value, None), sys.stdout)
+                    sys.stdout.flush()
+                retval = None
+            if syncstate:
+                state = getstate(object)
     except Exception, e:
         code = EXCEPTION
         retval = e
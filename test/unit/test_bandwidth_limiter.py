@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import time
+import pickle
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.BandwidthLimiter import BandwidthLimiter, LimitSchedule
+from grinder.GrinderExceptions import GrinderException
+
+class TestBandwidthLimiter(unittest.TestCase):
+
+    def at(self, hour, minute):
+        t = list(time.localtime())
+        t[3], t[4], t[5] = hour, minute, 0
+        return time.mktime(tuple(t))
+
+    def test_schedule(self):
+        schedule = LimitSchedule("08:00-18:00=500, 22:00-06:00=0")
+        self.assertEquals(schedule.limit(self.at(9, 30)), 500)
+        self.assertEquals(schedule.limit(self.at(18, 0)), None)
+        self.assertEquals(schedule.limit(self.at(23, 0)), 0)
+        self.assertEquals(schedule.limit(self.at(5, 59)), 0)
+        self.assertRaises(GrinderException, LimitSchedule, "08:00=500")
+        self.assertRaises(GrinderException, LimitSchedule, "08:00-25:00=500")
+
+    def test_limit(self):
+        limiter = BandwidthLimiter(100, "08:00-18:00=500,22:00-06:00=0")
+        try:
+            self.assertEquals(limiter.limit(self.at(9, 0)), 500)
+            self.assertEquals(limiter.limit(self.at(20, 0)), 100)
+            self.assertEquals(limiter.limit(self.at(23, 0)), None)
+        finally:
+            limiter.close()
+
+    def test_consume(self):
+        limiter = BandwidthLimiter(100)
+        try:
+            # the first second of traffic is a burst
+            self.assertEquals(limiter.consume(100 * 1024), 0)
+            # a pickled copy, (as given to an ActiveObject child), shares the bucket
+            copy = pickle.loads(pickle.dumps(limiter))
+            self.assertEquals(copy.path, limiter.path)
+            self.assertFalse(copy.owner)
+            delay = copy.consume(50 * 1024)
+            self.assertTrue(0.4 < delay <= 0.5, delay)
+            copy.close()
+            self.assertTrue(os.path.exists(limiter.path))
+        finally:
+            limiter.close()
+        self.assertFalse(os.path.exists(limiter.path))
+
+    def test_draw(self):
+        limiter = BandwidthLimiter(100)
+        try:
+            self.assertEquals(limiter.draw(100 * 1024), 0)
+            # the deficit is returned rather than slept off
+            start = time.time()
+            delay = limiter.draw(50 * 1024)
+            self.assertTrue(time.time() - start < 0.1)
+            self.assertTrue(0.4 < delay <= 0.5, delay)
+        finally:
+            limiter.close()
+
+    def test_unlimited(self):
+        limiter = BandwidthLimiter()
+        try:
+            self.assertEquals(limiter.consume(1024 * 1024 * 1024), 0)
+        finally:
+            limiter.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import hashlib
+import BaseHTTPServer
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.BaseFetch import BaseFetch
+from grinder.ProgressTracker import ProgressTracker
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves server.files, path -> (status, body), honoring Range requests if server.ranges
+    """
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        status, body = self.server.files.get(self.path, (404, "not found"))
+        byteRange = self.headers.get("Range")
+        if byteRange is not None:
+            self.server.ranges.append(byteRange)
+        if status == 200 and byteRange is not None and self.server.ranges_supported:
+            start, end = [int(x) for x in byteRange.split("=")[1].split("-")]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %s-%s/%s" % (start, end, len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestBaseFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.ranges = []
+        self.server.ranges_supported = True
+        # segments aborted by the client are expected to break the pipe
+        self.server.handle_error = lambda request, client_address: None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.baseURL = "http://127.0.0.1:%s" % (self.server.server_port)
+        self.savePath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.savePath)
+
+    def fetcher(self, **kwargs):
+        return BaseFetch(tracker=ProgressTracker(), num_retries=0, **kwargs)
+
+    def test_failed_refetch_keeps_file(self):
+        manifest = os.path.join(self.savePath, "PULP_MANIFEST")
+        self.server.files["/PULP_MANIFEST"] = (200, "a.iso,abc,10\n")
+        fetcher = self.fetcher()
+        status = fetcher.fetch("PULP_MANIFEST", self.baseURL + "/PULP_MANIFEST", self.savePath, force=True)
+        self.assertEquals(status, (BaseFetch.STATUS_SKIP_VALIDATE, None))
+        self.assertEquals(open(manifest).read(), "a.iso,abc,10\n")
+        # the copy fetched last time is kept when refetching it fails
+        for response in [(500, "busy"), (404, "gone")]:
+            self.server.files["/PULP_MANIFEST"] = response
+            status = fetcher.fetch("PULP_MANIFEST", self.baseURL + "/PULP_MANIFEST", self.savePath, force=True)
+            self.assertEquals(status[0], BaseFetch.STATUS_ERROR)
+            self.assertEquals(open(manifest).read(), "a.iso,abc,10\n")
+            self.assertFalse(os.path.exists(manifest + ".part"))
+        # as it is when the refetched copy is not valid
+        self.server.files["/PULP_MANIFEST"] = (200, "truncated")
+        status = fetcher.fetch("PULP_MANIFEST", self.baseURL + "/PULP_MANIFEST", self.savePath,
+                               itemSize=5, hashtype="sha256", checksum="0" * 64, force=True)
+        self.assertEquals(status[0], BaseFetch.STATUS_SIZE_MISSMATCH)
+        self.assertEquals(open(manifest).read(), "a.iso,abc,10\n")
+
+    def test_probe_removes_missing_file(self):
+        treeinfo = os.path.join(self.savePath, ".treeinfo")
+        self.server.files["/.treeinfo"] = (200, "[general]\n")
+        fetcher = self.fetcher()
+        fetcher.fetch(".treeinfo", self.baseURL + "/.treeinfo", self.savePath, probing=True, force=True)
+        self.assertTrue(os.path.exists(treeinfo))
+        # a transient failure keeps the copy, the file being gone from the repository does not
+        self.server.files["/.treeinfo"] = (503, "busy")
+        fetcher.fetch(".treeinfo", self.baseURL + "/.treeinfo", self.savePath, probing=True, force=True)
+        self.assertTrue(os.path.exists(treeinfo))
+        del self.server.files["/.treeinfo"]
+        status = fetcher.fetch(".treeinfo", self.baseURL + "/.treeinfo", self.savePath, probing=True, force=True)
+        self.assertEquals(status[0], BaseFetch.STATUS_ERROR)
+        self.assertFalse(os.path.exists(treeinfo))
+
+    def fetchSegmented(self, body, **kwargs):
+        self.server.files["/big.iso"] = (200, body)
+        fetcher = self.fetcher(segments=4, segment_threshold=1, **kwargs)
+        return fetcher.fetch("big.iso", self.baseURL + "/big.iso", self.savePath, itemSize=len(body),
+                             hashtype="sha256", checksum=hashlib.sha256(body).hexdigest())
+
+    def test_segmented(self):
+        body = "".join([chr(i % 256) for i in range(1000)])
+        status = self.fetchSegmented(body)
+        self.assertEquals(status[0], BaseFetch.STATUS_DOWNLOADED)
+        self.assertEquals(open(os.path.join(self.savePath, "big.iso"), "rb").read(), body)
+        self.assertEquals(sorted(self.server.ranges), ["bytes=0-249", "bytes=250-499", "bytes=500-749", "bytes=750-999"])
+        self.assertEquals(os.listdir(self.savePath), ["big.iso"])
+
+    def test_segmented_range_ignored(self):
+        # a 200 to a range request falls back to fetching a single stream
+        self.server.ranges_supported = False
+        body = "x" * 1000
+        status = self.fetchSegmented(body)
+        self.assertEquals(status[0], BaseFetch.STATUS_DOWNLOADED)
+        self.assertEquals(open(os.path.join(self.savePath, "big.iso"), "rb").read(), body)
+        self.assertEquals(os.listdir(self.savePath), ["big.iso"])
+
+    def test_segmented_resume(self):
+        body = "".join([chr(i % 256) for i in range(1000)])
+        # the first segment was partly fetched by an earlier attempt
+        open(os.path.join(self.savePath, "big.iso.part.0"), "wb").write(body[:100])
+        status = self.fetchSegmented(body)
+        self.assertEquals(status[0], BaseFetch.STATUS_DOWNLOADED)
+        self.assertEquals(open(os.path.join(self.savePath, "big.iso"), "rb").read(), body)
+        self.assertTrue("bytes=100-249" in self.server.ranges)
+        self.assertFalse("bytes=0-249" in self.server.ranges)
+
+    def test_segmented_not_found(self):
+        # a segment refused for good is not retried, nor are its .part.N files left behind
+        self.server.files["/big.iso"] = (404, "not found")
+        fetcher = BaseFetch(tracker=ProgressTracker(), num_retries=2, segments=4, segment_threshold=1)
+        status = fetcher.fetch("big.iso", self.baseURL + "/big.iso", self.savePath, itemSize=1000)
+        self.assertEquals(status[0], BaseFetch.STATUS_ERROR)
+        self.assertTrue(len(self.server.requests) <= 4)
+        self.assertEquals(os.listdir(self.savePath), [])
+
+if __name__ == '__main__':
+    unittest.main()
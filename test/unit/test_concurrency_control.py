@@ -0,0 +1,65 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.ConcurrencyControl import AIMDController
+
+class TestAIMDController(unittest.TestCase):
+
+    def test_additive_increase(self):
+        aimd = AIMDController(8)
+        self.assertEquals(aimd.concurrency, 2)
+        self.assertEquals(aimd.update(1000), 3)
+        self.assertEquals(aimd.update(2000), 4)
+        # nothing received, nothing changes
+        self.assertEquals(aimd.update(0), 4)
+        for i in range(10):
+            aimd.update(10000 + i)
+        self.assertEquals(aimd.concurrency, 8)
+
+    def test_decrease_on_errors(self):
+        aimd = AIMDController(20, initial=10)
+        self.assertEquals(aimd.update(1000, errors=2), 5)
+        self.assertEquals(aimd.update(1000, errors=1), 2)
+        self.assertEquals(aimd.update(1000, errors=1), 1)
+        self.assertEquals(aimd.update(1000, errors=1), 1)
+
+    def test_throughput_drop_reverts_increase(self):
+        aimd = AIMDController(20, initial=4)
+        self.assertEquals(aimd.update(1000), 5)
+        self.assertEquals(aimd.update(500), 4)
+        # a drop after a decrease is not blamed on concurrency
+        self.assertEquals(aimd.update(400), 5)
+
+    def test_decrease_on_latency(self):
+        aimd = AIMDController(20, initial=8)
+        self.assertEquals(aimd.update(1000, latency=1.0), 9)
+        self.assertEquals(aimd.update(1000, latency=2.0), 10)
+        self.assertEquals(aimd.update(1000, latency=5.0), 5)
+
+    def test_decrease_on_retries(self):
+        aimd = AIMDController(20, initial=8)
+        self.assertEquals(aimd.update(1000, retries=3), 4)
+        self.assertEquals(aimd.update(1000), 5)
+
+if __name__ == '__main__':
+    unittest.main()
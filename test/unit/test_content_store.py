@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.ContentStore import ContentStore, LINK_TYPES
+from grinder.GrinderExceptions import GrinderException
+
+CHECKSUM = "ABCDEF0123456789"
+
+class TestContentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, "store")
+        self.repo = os.path.join(self.tmpdir, "repo")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def storeFile(self, store, fileName="a.rpm", data="content"):
+        path = store.path("sha256", CHECKSUM, fileName)
+        os.makedirs(os.path.dirname(path))
+        f = open(path, "w")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        store.record("sha256", CHECKSUM, path)
+        return path
+
+    def test_index(self):
+        store = ContentStore(self.root)
+        self.assertEquals(store.path("sha256", CHECKSUM, "a.rpm"),
+                          os.path.join(self.root, "sha256", "ab", CHECKSUM.lower(), "a.rpm"))
+        self.assertEquals(store.lookup("sha256", CHECKSUM), None)
+        path = self.storeFile(store)
+        # found whatever the name or case it is looked up with, (from another process too)
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertEquals(copy.lookup("sha256", CHECKSUM.lower()), path)
+        self.assertEquals(copy.lookup("md5", CHECKSUM), None)
+        os.remove(path)
+        self.assertEquals(store.lookup("sha256", CHECKSUM), None)
+        self.assertRaises(GrinderException, ContentStore, self.root, link="bogus")
+
+    def test_materialize(self):
+        for link in LINK_TYPES:
+            store = ContentStore(self.root, link=link)
+            path = self.storeFile(store)
+            repoPath = os.path.join(self.repo, link, "Packages", "a.rpm")
+            self.assertFalse(store.isMaterialized(path, repoPath))
+            store.materialize(path, repoPath)
+            self.assertTrue(store.isMaterialized(path, repoPath), link)
+            self.assertEquals(open(repoPath).read(), "content")
+            self.assertEquals(os.path.islink(repoPath), link == "symlink")
+            # replaces whatever was in the repository before
+            os.remove(repoPath)
+            open(repoPath, "w").write("old")
+            store.materialize(path, repoPath)
+            self.assertEquals(open(repoPath).read(), "content")
+            self.assertEquals(os.listdir(os.path.dirname(repoPath)), ["a.rpm"])
+            shutil.rmtree(self.root)
+        store = ContentStore(self.root, link="hardlink")
+        path = self.storeFile(store)
+        store.materialize(path, repoPath)
+        self.assertEquals(os.stat(path).st_nlink, 2)
+
+    def test_adopt(self):
+        store = ContentStore(self.root)
+        repoPath = os.path.join(self.repo, "a.rpm")
+        os.makedirs(self.repo)
+        open(repoPath, "w").write("content")
+        path = store.path("sha256", CHECKSUM, "a.rpm")
+        store.adopt(repoPath, path)
+        self.assertEquals(open(path).read(), "content")
+        store.materialize(path, repoPath)
+        self.assertTrue(os.path.islink(repoPath))
+        self.assertEquals(open(repoPath).read(), "content")
+
+if __name__ == '__main__':
+    unittest.main()
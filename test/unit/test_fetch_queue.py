@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+import os
+import sys
+import time
+import Queue
+import unittest
+
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.FetchQueue import getFetchQueue, HostsBusy, DelayedQueue, backoff
+from grinder.GrinderExceptions import GrinderException
+
+class TestFetchQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [
+            {"fileName": "a.rpm", "size": 10, "item_type": "rpm"},
+            {"fileName": "b.rpm", "size": "3000", "item_type": "rpm"},
+            {"fileName": "c.drpm", "size": 200, "item_type": "delta_rpm"},
+            {"fileName": "d.img", "size": None, "item_type": "tree_file"},
+            {"fileName": "e.rpm", "size": 200, "item_type": "rpm"},
+        ]
+
+    def drain(self, q):
+        for item in self.items:
+            q.put(item)
+        self.assertEquals(q.qsize(), len(self.items))
+        names = []
+        while not q.empty():
+            names.append(q.get_nowait()["fileName"])
+        self.assertRaises(Queue.Empty, q.get_nowait)
+        return names
+
+    def test_fifo(self):
+        self.assertEquals(self.drain(getFetchQueue()), ["a.rpm", "b.rpm", "c.drpm", "d.img", "e.rpm"])
+
+    def test_largest_first(self):
+        self.assertEquals(self.drain(getFetchQueue("largest_first")), ["b.rpm", "c.drpm", "e.rpm", "a.rpm", "d.img"])
+
+    def test_shortest_first(self):
+        self.assertEquals(self.drain(getFetchQueue("shortest_first")), ["d.img", "a.rpm", "c.drpm", "e.rpm", "b.rpm"])
+
+    def test_interleave(self):
+        self.assertEquals(self.drain(getFetchQueue("interleave")), ["a.rpm", "c.drpm", "d.img", "b.rpm", "e.rpm"])
+
+    def test_host_limit(self):
+        q = getFetchQueue("largest_first", host_limit=1)
+        for name, host, size in [("a", "one", 1), ("b", "one", 5), ("c", "two", 2), ("d", "two", 3)]:
+            q.put({"fileName": name, "downloadurl": "http://%s.example.com/%s" % (host, name), "size": size})
+        first = q.get_nowait()
+        second = q.get_nowait()
+        self.assertEquals([first["fileName"], second["fileName"]], ["b", "d"])
+        # both hosts are at their limit
+        self.assertRaises(HostsBusy, q.get_nowait)
+        self.assertEquals(q.qsize(), 2)
+        q.release(first)
+        self.assertEquals(q.get_nowait()["fileName"], "a")
+        self.assertRaises(HostsBusy, q.get_nowait)
+        # routed to a mirror since, the slot is still freed on the host it was taken from
+        second["downloadurl"] = "http://mirror.example.com/d"
+        q.release(second)
+        self.assertEquals(q.get_nowait()["fileName"], "c")
+        self.assertRaises(Queue.Empty, q.get_nowait)
+
+    def test_delayed(self):
+        q = DelayedQueue()
+        self.assertEquals(q.timeout(), None)
+        now = time.time()
+        q.put("b", 20)
+        q.put("a", 10)
+        q.put("c", 20)
+        self.assertEquals(len(q), 3)
+        self.assertEquals(q.ready(now), [])
+        self.assertTrue(9 < q.timeout(now) < 11)
+        self.assertEquals(q.ready(now + 15), ["a"])
+        self.assertEquals(q.ready(now + 30), ["b", "c"])
+        self.assertEquals(q.timeout(), None)
+
+    def test_backoff(self):
+        for attempt, low, high in [(1, 1, 2), (2, 2, 4), (3, 4, 8), (10, 30, 60)]:
+            delay = backoff(attempt, base=2, limit=60)
+            self.assertTrue(low <= delay <= high, (attempt, delay))
+
+    def test_unknown(self):
+        self.assertRaises(GrinderException, getFetchQueue, "random")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -49,6 +49,8 @@ class TestFileSync(unittest.TestCase):
             self.assertTrue(sync_report.successes > 0)
             synced_files = glob.glob("%s/%s/*" % (temp_dir, temp_label))
             self.assertEquals(len(synced_files) - 1, sync_report.successes) # ignore MANIFEST
+            # caches are kept outside of the published repository
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, temp_label, ".grinder_metadata.db")))
         finally:
             shutil.rmtree(temp_dir)
 
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import urllib2
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.GrinderMetrics import LatencyHistogram, MetricsExporter
+from grinder.ProgressTracker import ProgressTracker
+
+class FakeFetch(object):
+    """
+    Stands in for the ParallelFetch of a sync
+    """
+    def __init__(self):
+        self.tracker = ProgressTracker()
+        self.tracker.add_item("http://test1/a.rpm", 1000, "rpm")
+        self.tracker.update_progress_download("http://test1/a.rpm", 1000, 400)
+        self.tracker.reset_progress("http://test1/a.rpm")
+        self.latency = LatencyHistogram(buckets=(1.0, 10.0))
+        self.latency.observe(0.5)
+        self.latency.observe(5)
+
+    def getStatusSnapshot(self):
+        return {"items": {"downloaded": 3, "error": 1}, "in_flight": 2, "active_workers": 4,
+                "latency": {"test1": self.latency.snapshot()}}
+
+class TestGrinderMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_render(self):
+        metrics = MetricsExporter()
+        metrics.add("repo_a", FakeFetch())
+        text = metrics.render()
+        self.assertTrue('grinder_transferred_bytes_total{repo="repo_a"} 400\n' in text, text)
+        self.assertTrue('grinder_items_finished_total{repo="repo_a",status="error"} 1\n' in text, text)
+        self.assertTrue('grinder_active_workers{repo="repo_a"} 4\n' in text, text)
+        self.assertTrue('grinder_retries_total{repo="repo_a"} 1\n' in text, text)
+        self.assertTrue("# TYPE grinder_item_seconds histogram\n" in text, text)
+        self.assertTrue('grinder_item_seconds_bucket{repo="repo_a",host="test1",le="1"} 1\n' in text, text)
+        self.assertTrue('grinder_item_seconds_bucket{repo="repo_a",host="test1",le="10"} 2\n' in text, text)
+        self.assertTrue('grinder_item_seconds_bucket{repo="repo_a",host="test1",le="+Inf"} 2\n' in text, text)
+        self.assertTrue('grinder_item_seconds_sum{repo="repo_a",host="test1"} 5.5\n' in text, text)
+        metrics.remove("repo_a")
+        self.assertEquals(metrics.render(), "\n")
+
+    def test_serve_and_write(self):
+        path = os.path.join(self.tmpdir, "grinder.prom")
+        metrics = MetricsExporter(port=0, path=path, interval=60)
+        metrics.add("repo_a", FakeFetch())
+        metrics.start()
+        try:
+            port = metrics.server.server_address[1]
+            body = urllib2.urlopen("http://127.0.0.1:%s/metrics" % (port)).read()
+            self.assertTrue('grinder_items_in_flight{repo="repo_a"} 2\n' in body, body)
+        finally:
+            metrics.stop()
+        self.assertTrue('grinder_items_in_flight{repo="repo_a"} 2\n' in open(path).read())
+
+if __name__ == '__main__':
+    unittest.main()
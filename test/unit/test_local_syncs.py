@@ -17,6 +17,7 @@
 
 # Python
 import glob
+import hashlib
 import logging
 import os
 import shutil
@@ -31,6 +32,8 @@ sys.path.insert(0, srcdir)
 datadir = os.path.abspath(os.path.dirname(__file__)) + "/../data/"
 
 from grinder import RepoFetch
+from grinder.SyncOrchestrator import SyncOrchestrator
+from grinder.GrinderUtils import CACHE_DIR_NAME
 from grinder.GrinderCallback import ProgressReport
 
 class TestLocalSync(unittest.TestCase):
@@ -53,6 +56,122 @@ class TestLocalSync(unittest.TestCase):
         synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, temp_label))
         self.assertEquals(len(synced_rpms), sync_report.successes)
 
+    def test_local_sync_multi_engine(self):
+        test_url = "file://%s/%s" % (datadir, "repo_resync_a")
+        temp_label = "temp_local_sync_multi_engine"
+        yum_fetch = RepoFetch.YumRepoGrinder(temp_label, test_url, 5, fetch_engine="multi")
+        sync_report = yum_fetch.fetchYumRepo(self.temp_dir)
+        self.assertEquals(sync_report.errors, 0)
+        self.assertTrue(sync_report.successes > 0)
+        synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, temp_label))
+        self.assertEquals(len(synced_rpms), sync_report.successes)
+
+    def test_local_sync_streaming_metadata(self):
+        test_url = "file://%s/%s" % (datadir, "repo_resync_a")
+        temp_label = "temp_local_sync_streaming_metadata"
+        yum_fetch = RepoFetch.YumRepoGrinder(temp_label, test_url, 5, streaming_metadata=True)
+        sync_report = yum_fetch.fetchYumRepo(self.temp_dir)
+        self.assertEquals(sync_report.errors, 0)
+        synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, temp_label))
+        self.assertEquals(len(synced_rpms), 3)
+        temp_label = "temp_local_sync_streaming_metadata_newest"
+        yum_fetch = RepoFetch.YumRepoGrinder(temp_label, test_url, 5, newest=True, streaming_metadata=True)
+        sync_report = yum_fetch.fetchYumRepo(self.temp_dir)
+        self.assertEquals(sync_report.errors, 0)
+        synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, temp_label))
+        self.assertEquals(len(synced_rpms), 2)
+
+    def test_local_sync_incremental(self):
+        # a copy of the repository with a distribution tree
+        source_dir = os.path.join(self.temp_dir, "source")
+        shutil.copytree(os.path.join(datadir, "repo_resync_a"), source_dir)
+        os.makedirs(os.path.join(source_dir, "images"))
+        image = "boot image"
+        f = open(os.path.join(source_dir, "images", "boot.iso"), "w")
+        f.write(image)
+        f.close()
+        f = open(os.path.join(source_dir, ".treeinfo"), "w")
+        f.write("[general]\nfamily = Test\narch = x86_64\n\n[checksums]\nimages/boot.iso = sha256:%s\n" %
+                (hashlib.sha256(image).hexdigest()))
+        f.close()
+        test_url = "file://%s" % (source_dir)
+        temp_label = "temp_local_sync_incremental"
+        yum_fetch = RepoFetch.YumRepoGrinder(temp_label, test_url, 5, incremental=True)
+        sync_report = yum_fetch.fetchYumRepo(self.temp_dir)
+        self.assertEquals(sync_report.errors, 0)
+        self.assertEquals(sync_report.successes, 4)
+        self.assertTrue(yum_fetch.getSyncState())
+        # the sync state is kept with the caches, not published with the repository
+        state_path = os.path.join(self.temp_dir, CACHE_DIR_NAME, temp_label, RepoFetch.SYNC_STATE_NAME)
+        self.assertTrue(os.path.exists(state_path))
+        legacy_path = os.path.join(self.temp_dir, temp_label, RepoFetch.SYNC_STATE_NAME)
+        self.assertFalse(os.path.exists(legacy_path))
+        # as left in the repository by an earlier version
+        shutil.copy(state_path, legacy_path)
+        # Second sync finds repomd.xml unchanged and fetches no packages,
+        # the distribution tree is still checked as repomd.xml does not cover it
+        boot_iso = os.path.join(self.temp_dir, temp_label, "images", "boot.iso")
+        os.remove(boot_iso)
+        yum_fetch = RepoFetch.YumRepoGrinder(temp_label, test_url, 5, incremental=True)
+        sync_report = yum_fetch.fetchYumRepo(self.temp_dir)
+        self.assertTrue(yum_fetch.unchanged)
+        self.assertEquals(sync_report.errors, 0)
+        self.assertEquals(sync_report.downloads, 1)
+        self.assertEquals(open(boot_iso).read(), image)
+        synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, temp_label))
+        self.assertEquals(len(synced_rpms), 3)
+        self.assertFalse(os.path.exists(legacy_path))
+
+    def test_local_sync_orchestrated(self):
+        grinders = []
+        for name in ("repo_resync_a", "local_errors"):
+            test_url = "file://%s/%s" % (datadir, name)
+            grinders.append(RepoFetch.YumRepoGrinder("temp_orchestrated_%s" % (name), test_url))
+        progress = []
+        orchestrator = SyncOrchestrator(grinders, parallel=3)
+        reports = orchestrator.sync(self.temp_dir, callback=progress.append)
+        self.assertEquals(orchestrator.plan_errors, {})
+        self.assertEquals(len(reports), 2)
+        for grinder in grinders:
+            report = reports[grinder.repo_label]
+            self.assertEquals(report.errors, 0)
+            self.assertTrue(report.successes > 0)
+            synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, grinder.repo_label))
+            self.assertEquals(len(synced_rpms), report.successes)
+            labelled = [r for r in progress if r.repo_label == grinder.repo_label]
+            self.assertTrue(labelled)
+
+    def test_local_sync_orchestrated_finish_error(self):
+        grinders = []
+        for name in ("repo_resync_a", "local_errors"):
+            test_url = "file://%s/%s" % (datadir, name)
+            grinders.append(RepoFetch.YumRepoGrinder("temp_finish_%s" % (name), test_url))
+        def finishDownload():
+            raise Exception("unable to write the report")
+        grinders[0].finishDownload = finishDownload
+        orchestrator = SyncOrchestrator(grinders, parallel=3, max_speed=100000)
+        reports = orchestrator.sync(self.temp_dir)
+        # the other repository is still reported, the shared limiter is still closed
+        self.assertEquals(reports.keys(), [grinders[1].repo_label])
+        limiter = grinders[1].repoFetch.limiter
+        self.assertFalse(os.path.exists(limiter.path))
+
+    def test_local_sync_orchestrated_shared_content(self):
+        test_url = "file://%s/%s" % (datadir, "repo_resync_a")
+        grinders = [RepoFetch.YumRepoGrinder("temp_shared_a", test_url),
+                    RepoFetch.YumRepoGrinder("temp_shared_b", test_url)]
+        orchestrator = SyncOrchestrator(grinders, parallel=3)
+        reports = orchestrator.sync(self.temp_dir)
+        successes = reports["temp_shared_a"].successes
+        self.assertTrue(successes > 0)
+        self.assertEquals(reports["temp_shared_b"].successes, successes)
+        self.assertEquals(reports["temp_shared_b"].errors, 0)
+        for grinder in grinders:
+            synced_rpms = glob.glob("%s/%s/*.rpm" % (self.temp_dir, grinder.repo_label))
+            self.assertEquals(len(synced_rpms), successes)
+        # each package was fetched once, then copied into the other repository
+        self.assertEquals(orchestrator.deduplicated, len(synced_rpms))
+
     def test_local_sync_with_errors(self):
         test_rpm_with_error = os.path.join(datadir, "local_errors", "pulp-test-package-0.3.1-1.fc11.x86_64.rpm")
         orig_stat = os.stat(test_rpm_with_error)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.MetadataCache import MetadataCache
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_metadata_cache-")
+        self.file_path = os.path.join(self.temp_dir, ".treeinfo")
+        self.write(self.file_path, "[general]\n")
+        self.cache = MetadataCache(os.path.join(self.temp_dir, "metadata.db"))
+        self.url = "http://example.com/repo/.treeinfo"
+
+    def tearDown(self):
+        self.cache.close()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def write(self, path, data):
+        f = open(path, "w")
+        f.write(data)
+        f.close()
+
+    def test_record_and_lookup(self):
+        self.assertEquals(self.cache.lookup(self.url, self.file_path), None)
+        # the database is only created once there are validators to record
+        self.cache.record(self.url, self.file_path)
+        self.assertFalse(os.path.exists(self.cache.path))
+        self.cache.record(self.url, self.file_path, etag='"abc"', last_modified="Tue, 01 Jan 2013 00:00:00 GMT")
+        validators = self.cache.lookup(self.url, self.file_path)
+        self.assertEquals(validators["etag"], '"abc"')
+        self.assertEquals(validators["last_modified"], "Tue, 01 Jan 2013 00:00:00 GMT")
+        # A response without validators forgets the previous ones
+        self.cache.record(self.url, self.file_path)
+        self.assertEquals(self.cache.lookup(self.url, self.file_path), None)
+
+    def test_local_copy_modified(self):
+        self.cache.record(self.url, self.file_path, etag='"abc"')
+        self.write(self.file_path, "[general]\nfamily = modified\n")
+        self.assertEquals(self.cache.lookup(self.url, self.file_path), None)
+        os.remove(self.file_path)
+        self.assertEquals(self.cache.lookup(self.url, self.file_path), None)
+
+if __name__ == '__main__':
+    unittest.main()
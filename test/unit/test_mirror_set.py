@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.MirrorSet import MirrorSet
+
+MIRRORS = ["http://fast/repo/", "http://slow/repo", "http://dead/repo"]
+
+def item(name):
+    return {"fileName": name, "downloadurl": "http://fast/repo/Packages/%s" % (name), "size": 1000}
+
+class TestMirrorSet(unittest.TestCase):
+
+    def test_route(self):
+        mirrors = MirrorSet(MIRRORS)
+        self.assertEquals(len(mirrors), 3)
+        self.assertEquals(mirrors.relativePath("http://slow/repo/Packages/a.rpm"), "Packages/a.rpm")
+        self.assertEquals(mirrors.relativePath("http://elsewhere/a.rpm"), None)
+        self.assertEquals(mirrors.route({"downloadurl": "http://elsewhere/a.rpm"}), None)
+        # unmeasured mirrors are raced, in the order they are listed
+        items = [item("%s.rpm" % i) for i in range(3)]
+        urls = [mirrors.route(i) for i in items]
+        self.assertEquals(urls, ["http://fast/repo/Packages/0.rpm", "http://slow/repo/Packages/1.rpm",
+                                 "http://dead/repo/Packages/2.rpm"])
+        mirrors.success(items[0], 1000000, 1.0)
+        mirrors.success(items[1], 1000000, 10.0)
+        self.assertTrue(mirrors.failure(items[2]))
+        # load follows throughput, the slow mirror only gets items once the fast one is busy
+        mirrors = MirrorSet(MIRRORS[:2])
+        fast, slow = item("fast.rpm"), item("slow.rpm")
+        mirrors.route(fast)
+        mirrors.route(slow)
+        mirrors.success(fast, 1000000, 1.0)
+        mirrors.success(slow, 1000000, 10.0)
+        chosen = [mirrors.route(item("%s.rpm" % i)).split("/")[2] for i in range(11)]
+        self.assertEquals(chosen.count("fast"), 10, chosen)
+
+    def test_failover(self):
+        mirrors = MirrorSet(MIRRORS, max_failures=2, cooldown=60)
+        i = item("a.rpm")
+        i["mirrors_tried"] = ["http://fast/repo"]
+        self.assertEquals(mirrors.route(i), "http://slow/repo/Packages/a.rpm")
+        self.assertTrue(mirrors.failure(i))
+        self.assertEquals(i["mirrors_tried"], ["http://fast/repo", "http://slow/repo"])
+        self.assertEquals(mirrors.route(i), "http://dead/repo/Packages/a.rpm")
+        # every mirror was tried, the item fails for good
+        self.assertFalse(mirrors.failure(i))
+        mirrors.forget(i)
+        self.assertFalse(i.has_key("mirror"))
+        # a mirror failing repeatedly is left alone until its cooldown expired
+        mirrors = MirrorSet(MIRRORS[1:], max_failures=2, cooldown=60)
+        for n in range(2):
+            i = item("%s.rpm" % n)
+            i["mirror"] = "http://dead/repo"
+            mirrors.failure(i, now=100)
+        self.assertEquals(mirrors.choose(now=100), "http://slow/repo")
+        self.assertEquals(mirrors.choose(exclude=["http://slow/repo"], now=100), "http://slow/repo")
+        self.assertEquals(mirrors.choose(exclude=["http://slow/repo"], now=161), "http://dead/repo")
+        self.assertEquals([s[5] for s in mirrors.snapshot()], [True, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import hashlib
+import BaseHTTPServer
+import SocketServer
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.BandwidthLimiter import BandwidthLimiter
+from grinder.BaseFetch import BaseFetch
+from grinder.MultiFetch import MultiFetch
+from grinder.ProgressTracker import ProgressTracker
+
+# session the server currently accepts
+SESSION = {"token": "expired"}
+# path -> body of items served other than "content of <path>"
+BODIES = {}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.headers.get("X-Auth") != SESSION["token"]:
+            self.send_response(401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = BODIES.get(self.path, "content of %s" % (self.path))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class AuthFetch(BaseFetch):
+    """
+    Fetcher logging in as PackageFetch does, its cached session has expired
+    """
+    def __init__(self, baseURL, savePath):
+        BaseFetch.__init__(self, tracker=ProgressTracker(), num_retries=0)
+        self.baseURL = baseURL
+        self.savePath = savePath
+        self.token = "stale"
+        self.logins = 0
+
+    def login(self, refresh=False):
+        if refresh:
+            self.logins += 1
+            self.token = "expired"
+        return {"X-Auth": self.token}
+
+    def fetchArgs(self, itemInfo, refresh=False):
+        return dict(fileName=itemInfo["fileName"], fetchURL=itemInfo["downloadurl"],
+                    savePath=self.savePath, itemSize=itemInfo["size"], hashtype="sha256",
+                    checksum=itemInfo["checksum"], headers=self.login(refresh))
+
+class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class CountingLimiter(BandwidthLimiter):
+    """
+    Limiter recording whether it was ever waited on
+    """
+    consumed = 0
+
+    def consume(self, nbytes):
+        self.consumed += 1
+        return BandwidthLimiter.consume(self, nbytes)
+
+class ItemFetch(BaseFetch):
+
+    def __init__(self, savePath, limiter):
+        BaseFetch.__init__(self, tracker=ProgressTracker(), num_retries=0, limiter=limiter)
+        self.savePath = savePath
+
+    def fetchArgs(self, itemInfo):
+        return dict(fileName=itemInfo["fileName"], fetchURL=itemInfo["downloadurl"],
+                    savePath=self.savePath, itemSize=itemInfo["size"], hashtype="sha256",
+                    checksum=itemInfo["checksum"], headers={"X-Auth": SESSION["token"]})
+
+class TestMultiFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.baseURL = "http://127.0.0.1:%s" % (self.server.server_port)
+        self.savePath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.savePath)
+        BODIES.clear()
+
+    def items(self, names):
+        items = []
+        for name in names:
+            body = "content of /%s" % (name)
+            items.append({"fileName": name, "downloadurl": "%s/%s" % (self.baseURL, name),
+                          "size": len(body), "checksum": hashlib.sha256(body).hexdigest(),
+                          "item_type": "rpm"})
+        return items
+
+    def test_unauthorized_refresh(self):
+        fetcher = AuthFetch(self.baseURL, self.savePath)
+        pFetch = MultiFetch(fetcher, 2)
+        pFetch.addItemList(self.items(["a.rpm", "b.rpm", "c.rpm"]))
+        pFetch.start()
+        report = pFetch.waitForFinish()
+        self.assertEquals(report.errors, 0)
+        self.assertEquals(report.downloads, 3)
+        self.assertTrue(fetcher.logins >= 1)
+        self.assertEquals(open(os.path.join(self.savePath, "b.rpm")).read(), "content of /b.rpm")
+        # credentials which are refused even once refreshed fail the item
+        SESSION["token"] = "revoked"
+        try:
+            pFetch = MultiFetch(AuthFetch(self.baseURL, self.savePath), 1)
+            pFetch.addItemList(self.items(["d.rpm"]))
+            pFetch.start()
+            report = pFetch.waitForFinish()
+        finally:
+            SESSION["token"] = "expired"
+        self.assertEquals(report.downloads, 0)
+        self.assertEquals(pFetch.syncStatusDict[BaseFetch.STATUS_UNAUTHORIZED], 1)
+        self.assertEquals(pFetch.error_details[0]["fileName"], "d.rpm")
+
+    def test_throttle(self):
+        # 64KB/sec, the first 64KB are a burst, data owed for the last chunks is not waited for
+        limiter = CountingLimiter(64)
+        names = ["a.iso", "b.iso", "c.iso"]
+        for name in names:
+            BODIES["/" + name] = name[0] * 65536
+        try:
+            pFetch = MultiFetch(ItemFetch(self.savePath, limiter), 3)
+            items = self.items(names)
+            for item in items:
+                item["size"] = 65536
+                item["checksum"] = hashlib.sha256(BODIES["/" + item["fileName"]]).hexdigest()
+            pFetch.addItemList(items)
+            start = time.time()
+            pFetch.start()
+            report = pFetch.waitForFinish()
+            elapsed = time.time() - start
+        finally:
+            limiter.close()
+        self.assertEquals(report.downloads, 3)
+        self.assertTrue(elapsed > 1.0, elapsed)
+        # transfers are paused rather than sleeping in the shared event loop
+        self.assertEquals(limiter.consumed, 0)
+        self.assertEquals(open(os.path.join(self.savePath, "c.iso")).read(), "c" * 65536)
+
+    def test_throttle_concurrent(self):
+        # many transfers owing the limiter for moments shorter than a pass of the event
+        # loop, each paused transfer is resumed even if its delay is over by then
+        server = ThreadingServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        limiter = BandwidthLimiter(20000)
+        names = ["%s.iso" % (i) for i in range(8)]
+        size = 8 * 1024 * 1024
+        for name in names:
+            BODIES["/" + name] = name[0] * size
+        try:
+            pFetch = MultiFetch(ItemFetch(self.savePath, limiter), 8)
+            items = []
+            for name in names:
+                items.append({"fileName": name, "downloadurl": "http://127.0.0.1:%s/%s" % (server.server_port, name),
+                              "size": size, "checksum": hashlib.sha256(BODIES["/" + name]).hexdigest(),
+                              "item_type": "rpm"})
+            pFetch.addItemList(items)
+            # a transfer left paused would never finish
+            watchdog = threading.Timer(60, pFetch.stop)
+            watchdog.start()
+            pFetch.start()
+            report = pFetch.waitForFinish()
+            watchdog.cancel()
+        finally:
+            limiter.close()
+            server.shutdown()
+            server.server_close()
+        self.assertEquals(report.downloads, 8)
+        self.assertEquals(os.path.getsize(os.path.join(self.savePath, "7.iso")), size)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import time
+import Queue
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.BaseFetch import BaseFetch
+from grinder.ConcurrencyControl import AIMDController
+from grinder.MirrorSet import MirrorSet
+from grinder.ParallelFetch import ParallelFetch, ConcurrencyController
+from grinder.ProgressTracker import ProgressTracker
+
+class ItemFetcher(object):
+    """
+    Fetcher which only implements the fetchItem() contract, (not a BaseFetch)
+    """
+    def __init__(self):
+        self.tracker = ProgressTracker()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("tracker", None)
+        return state
+
+    def fetchItem(self, info):
+        if info["fileName"].startswith("bad"):
+            return (BaseFetch.STATUS_ERROR, "%s is bad" % (info["fileName"]))
+        return (BaseFetch.STATUS_DOWNLOADED, None)
+
+def items(names):
+    return [{"fileName": name, "downloadurl": "http://test/%s" % (name), "size": 10,
+             "item_type": "rpm", "relativepath": name} for name in names]
+
+class TestParallelFetch(unittest.TestCase):
+
+    def test_fetch_item_contract(self):
+        for batch in (None, 3):
+            pFetch = ParallelFetch(ItemFetcher(), 2, batch=batch)
+            pFetch.addItemList(items(["a.rpm", "b.rpm", "c.rpm", "bad.rpm"]))
+            pFetch.start()
+            report = pFetch.waitForFinish()
+            self.assertEquals(report.downloads, 3)
+            self.assertEquals(report.errors, 1)
+            self.assertEquals(pFetch.error_details[0]["error"], "bad.rpm is bad")
+
+    def test_mirrors_host_limit(self):
+        mirrors = MirrorSet(["http://one/repo", "http://two/repo", "http://three/repo"])
+        pFetch = ParallelFetch(ItemFetcher(), 0, host_limit=1, mirrors=mirrors)
+        names = ["%s.rpm" % i for i in range(5)]
+        pFetch.addItemList([{"fileName": name, "downloadurl": "http://one/repo/Packages/%s" % (name),
+                             "size": 10, "item_type": "rpm"} for name in names])
+        # each item is routed to a mirror whose host is not at its limit yet
+        taken = [pFetch.getWorkItem(wait=False) for i in range(3)]
+        hosts = [i["downloadurl"].split("/")[2] for i in taken]
+        self.assertEquals(sorted(hosts), ["one", "three", "two"])
+        self.assertRaises(Queue.Empty, pFetch.getWorkItem, False)
+        self.assertEquals(pFetch.toSyncQ.active, {"one": 1, "two": 1, "three": 1})
+        # the slot freed is the one of the mirror the item was fetched from
+        done = taken[hosts.index("two")]
+        pFetch.markStatus(done, BaseFetch.STATUS_DOWNLOADED)
+        self.assertEquals(pFetch.getWorkItem(wait=False)["downloadurl"].split("/")[2], "two")
+        # a failed item is failed over to another mirror, once one has a free slot
+        failed = taken[hosts.index("three")]
+        pFetch.markStatus(failed, BaseFetch.STATUS_ERROR)
+        item = pFetch.getWorkItem(wait=False)
+        self.assertEquals(item["downloadurl"].split("/")[2], "three")
+        self.assertEquals(pFetch.toSyncQ.active["three"], 1)
+        self.assertRaises(Queue.Empty, pFetch.getWorkItem, False)
+
+    def test_controller_retries(self):
+        pFetch = ParallelFetch(ItemFetcher(), 0, adaptive=True)
+        controller = ConcurrencyController(pFetch, interval=0.05)
+        controller.aimd = AIMDController(8, initial=8)
+        pFetch.setConcurrency(8)
+        controller.start()
+        try:
+            time.sleep(0.2)
+            self.assertEquals(pFetch.concurrency, 8)
+            # the server throttles, items are retried without any having failed yet
+            pFetch.tracker.reset_progress("http://test/a.rpm")
+            pFetch.tracker.reset_progress("http://test/b.rpm")
+            time.sleep(0.2)
+            self.assertEquals(pFetch.syncStatusDict[BaseFetch.STATUS_ERROR], 0)
+            self.assertEquals(pFetch.concurrency, 4)
+        finally:
+            controller.stop()
+            controller.join()
+
+if __name__ == '__main__':
+    # ItemFetcher is unpickled by the workers' children, which can not import it from __main__
+    unittest.main(module="test_parallel_fetch")
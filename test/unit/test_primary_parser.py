@@ -0,0 +1,46 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+import os
+import sys
+import unittest
+
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.PrimaryParser import PrimaryParser
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__)) + "/../data"
+
+class TestPrimaryParser(unittest.TestCase):
+
+    def test_parse_primary(self):
+        primary = os.path.join(DATA_DIR, "repo_resync_a", "repodata", "primary.xml.gz")
+        pkgs = list(PrimaryParser(primary).getPackages())
+        self.assertEquals(len(pkgs), 3)
+        pkgs = dict([(pkg.relativepath, pkg) for pkg in pkgs])
+        pkg = pkgs["pulp-test-package-0.2.1-1.fc11.x86_64.rpm"]
+        self.assertEquals(pkg.arch, "x86_64")
+        self.assertEquals((pkg.epoch, pkg.version, pkg.release), ("0", "0.2.1", "1.fc11"))
+        self.assertEquals(pkg.checksums[0][:2], ("sha256",
+            "4dbde07b4a8eab57e42ed0c9203083f1d61e0b13935d1a569193ed8efc9ecfd7"))
+        self.assertEquals(pkg.size, 2216)
+        self.assertEquals(pkg.relativepath, "pulp-test-package-0.2.1-1.fc11.x86_64.rpm")
+        self.assertEquals(pkg.remote_url, pkg.relativepath)
+        self.assertEquals(str(pkg), "pulp-test-package-0.2.1-1.fc11.x86_64")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import time
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.activeobject import ActiveObject, ProcessPool, Preloader
+
+class TestProcessPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ProcessPool(max_calls=3)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def childPid(self, ao):
+        return ao._ActiveObject__child.pid
+
+    def test_reuse(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        ao.load()
+        pid = self.childPid(ao)
+        ao.dummy_method.release()
+        self.assertEquals(len(self.pool.idle), 1)
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        self.assertEquals(self.childPid(ao), pid)
+        ao.load()
+        ao.dummy_method.release()
+
+    def test_recycle_after_max_calls(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        pid = self.childPid(ao)
+        ao.load()
+        ao.load()
+        self.assertEquals(self.childPid(ao), pid)
+        ao.load()
+        # the third call reached max_calls, the next runs in a new child
+        self.assertEquals(ao._ActiveObject__child, None)
+        ao.load()
+        self.assertNotEquals(self.childPid(ao), pid)
+        ao.dummy_method.release()
+
+    def test_release_recycle(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        ao.load()
+        child = ao._ActiveObject__child
+        ao.dummy_method.release(recycle=True)
+        self.assertEquals(self.pool.idle, [])
+        self.assertNotEquals(child.poll(), None)
+
+    def test_abort_is_not_pooled(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        ao.load()
+        ao.dummy_method.abort()
+        ao.dummy_method.release()
+        self.assertEquals(self.pool.idle, [])
+
+    def test_object_installed_once(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool)
+        ao.load()
+        child = ao._ActiveObject__child
+        self.assertTrue(child.installed)
+        # the parent copy is not updated unless syncstate is requested
+        ao.object.modules = ["no_such_module"]
+        ao.load()
+        ao.dummy_method.reinstall()
+        self.assertRaises(Exception, ao.load)
+        ao.dummy_method.release()
+        self.assertEquals(child.installed, None)
+
+    def test_syncstate(self):
+        ao = ActiveObject(Preloader(["os"]), pool=self.pool, syncstate=True)
+        ao.object.modules = ["sys"]
+        ao.dummy_method.reinstall()
+        ao.load()
+        self.assertEquals(ao.object.modules, ["sys"])
+        ao.dummy_method.release()
+
+    def test_stream(self):
+        ao = ActiveObject(Preloader(["os", "sys", "time"]), pool=self.pool)
+        received = []
+        ao.load.stream(received.append)
+        self.assertEquals(received, ["os", "sys", "time"])
+        # without a consumer the yielded values are returned
+        self.assertEquals(ao.load(), ["os", "sys", "time"])
+        ao.dummy_method.release()
+
+    def test_warm(self):
+        self.pool.warm(2, "os")
+        for i in range(50):
+            if len(self.pool.idle) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEquals(len(self.pool.idle), 2)
+
+if __name__ == '__main__':
+    unittest.main()
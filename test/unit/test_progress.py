@@ -30,7 +30,7 @@ sys.path.insert(0, srcdir)
 
 from grinder import RepoFetch
 from grinder.GrinderCallback import ProgressReport
-from grinder.ProgressTracker import ProgressTracker
+from grinder.ProgressTracker import ProgressTracker, ProgressThrottle, RateHistory
 
 class TestProgress(unittest.TestCase):
 
@@ -315,4 +315,47 @@ class TestProgress(unittest.TestCase):
         self.assertEquals(progress["type_info"]["rpm"]["num_success"], 0)
         self.assertEquals(progress["type_info"]["rpm"]["num_error"], 0)
 
-
+    def test_progress_throttle(self):
+        reports = []
+        def report(fetchURL, download_total, downloaded):
+            reports.append(downloaded)
+        throttle = ProgressThrottle(report, interval=60)
+        throttle("http://test1", 100, 0)
+        throttle("http://test1", 100, 10)
+        throttle("http://test1", 100, 20)
+        throttle("http://test1", 100, 100)
+        # the first report with bytes and the completed transfer are passed on
+        self.assertEquals(reports, [10, 100])
+
+    def test_callback_interval(self):
+        calls = []
+        tracker = ProgressTracker(callback_interval=60)
+        tracker.callback = calls.append
+        tracker.add_item("http://test1", 100, "rpm")
+        tracker.update_progress_download("http://test1", 100, 10)
+        tracker.update_progress_download("http://test1", 100, 20)
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(tracker.get_progress()["remaining_bytes"], 80)
+
+    def test_rate_history(self):
+        rates = RateHistory(size=4, interval=1)
+        self.assertEquals(rates.rate(), None)
+        for i in range(6):
+            rates.add(100 + i, i * 1000, {"rpm": i * 100})
+        # samples less than interval seconds after the newest are dropped
+        rates.add(105.5, 9000, {"rpm": 900})
+        # only the last 4 samples, (t=102..105), are kept
+        self.assertEquals(rates.rate(), 1000)
+        self.assertEquals(rates.rate(item_type="rpm"), 100)
+        self.assertEquals(rates.rate(item_type="drpm"), 0)
+        self.assertEquals(rates.history(), [(103, 1000), (104, 1000), (105, 1000)])
+
+    def test_throughput_and_eta(self):
+        tracker = ProgressTracker()
+        tracker.add_item("http://test1", 1000, "rpm")
+        tracker.rates.add(time.time() - 2, 0, {})
+        tracker.update_progress_download("http://test1", 1000, 500)
+        progress = tracker.get_progress()
+        self.assertTrue(200 < progress["average_throughput"] <= 250, progress["average_throughput"])
+        self.assertTrue(2 <= progress["eta"] < 2.5, progress["eta"])
+        self.assertTrue(progress["type_info"]["rpm"]["throughput"] > 0)
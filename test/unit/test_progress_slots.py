@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import pickle
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.ProgressSlots import ProgressSlots, URL_MAX
+from grinder.ProgressTracker import ProgressTracker
+
+class TestProgressSlots(unittest.TestCase):
+
+    def setUp(self):
+        self.slots = ProgressSlots(2)
+
+    def tearDown(self):
+        self.slots.close()
+
+    def writeInChild(self, slots, *progress):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                slots.write(*progress)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    def test_sample(self):
+        tracker = ProgressTracker()
+        tracker.add_item("http://test1/a.rpm", 100, "rpm")
+        # a pickled copy, (as given to an ActiveObject child), records in the same slots
+        copy = pickle.loads(pickle.dumps(self.slots))
+        self.slots.write("http://test1/unknown.rpm", 100, 60)
+        self.writeInChild(copy, "http://test1/a.rpm", 100, 40)
+        tracker.add_sampler(self.slots.sample)
+        progress = tracker.get_progress()
+        self.assertEquals(progress["remaining_bytes"], 60)
+        self.assertEquals(progress["transferred_bytes"], 40)
+        # sampling the same counters again changes nothing
+        self.assertEquals(tracker.get_progress()["remaining_bytes"], 60)
+
+    def test_claim(self):
+        self.assertEquals(self.slots.claim(), 0)
+        self.assertEquals(self.slots.claim(), 0)
+        self.assertTrue(self.slots.write("http://test1/a.rpm", 100, 10))
+        self.assertEquals(self.slots.read(0), ("http://test1/a.rpm", 100, 10))
+        self.slots.clear()
+        self.assertEquals(self.slots.read(0), None)
+        self.assertFalse(self.slots.write("http://test1/" + "a" * URL_MAX, 100, 10))
+
+    def test_exited_owner(self):
+        # both children exited, so their slots are free to be claimed again
+        self.writeInChild(self.slots, "http://test1/a.rpm", 100, 10)
+        self.writeInChild(self.slots, "http://test1/b.rpm", 100, 10)
+        self.writeInChild(self.slots, "http://test1/c.rpm", 100, 10)
+        self.assertEquals(self.slots.read(0), ("http://test1/c.rpm", 100, 10))
+        self.assertEquals(self.slots.read(1), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import time
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder import Retry
+from grinder.Retry import RetryPolicy, parseRetryAfter
+
+class TestRetry(unittest.TestCase):
+
+    def test_classify(self):
+        policy = RetryPolicy()
+        self.assertEquals(policy.classify(status=200), None)
+        self.assertEquals(policy.classify(status=404), None)
+        self.assertEquals(policy.classify(status=408), Retry.RETRY_SERVER)
+        self.assertEquals(policy.classify(status=502), Retry.RETRY_SERVER)
+        self.assertEquals(policy.classify(status=503, retry_after=10), Retry.RETRY_THROTTLED)
+        self.assertEquals(policy.classify(status=429), Retry.RETRY_THROTTLED)
+        self.assertEquals(policy.classify(mismatch=True), Retry.RETRY_CHECKSUM)
+        self.assertEquals(policy.classify(error=IOError("disk full")), Retry.RETRY_ERROR)
+        self.assertFalse(policy.resumable(Retry.RETRY_ERROR))
+        self.assertTrue(policy.resumable(Retry.RETRY_STALLED))
+        self.assertFalse(RetryPolicy(resume=False).resumable(Retry.RETRY_STALLED))
+
+    def test_delay(self):
+        policy = RetryPolicy(delay=2, max_delay=10)
+        for attempt in range(1, 6):
+            delay = policy.delay(attempt, Retry.RETRY_SERVER)
+            limit = min(2 * 2 ** (attempt - 1), 10)
+            self.assertTrue(limit / 2.0 <= delay <= limit, (attempt, delay))
+        # the server knows best how long it is busy for, within reason
+        self.assertEquals(policy.delay(1, Retry.RETRY_THROTTLED, 30), 30)
+        self.assertEquals(policy.delay(1, Retry.RETRY_THROTTLED, 3600), Retry.MAX_RETRY_AFTER)
+
+    def test_parse_retry_after(self):
+        self.assertEquals(parseRetryAfter(" 120 "), 120)
+        self.assertEquals(parseRetryAfter("soon"), None)
+        self.assertEquals(parseRetryAfter(None), None)
+        past = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() - 60))
+        self.assertEquals(parseRetryAfter(past), 0)
+        future = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+        self.assertTrue(50 < parseRetryAfter(future) <= 60)
+
+    def test_decorator(self):
+        class Fetch(object):
+            num_retries = 2
+            retry_delay = 0
+            calls = 0
+            @Retry.Retry()
+            def fetch(self):
+                self.calls += 1
+                raise IOError("unreachable")
+        f = Fetch()
+        self.assertRaises(IOError, f.fetch)
+        self.assertEquals(f.calls, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2013 Red Hat, Inc.
+#
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+
+# Python
+import os
+import sys
+import time
+import shutil
+import pickle
+import tempfile
+import unittest
+srcdir = os.path.abspath(os.path.dirname(__file__)) + "/../../src/"
+sys.path.insert(0, srcdir)
+
+from grinder.VerifyCache import VerifyCache
+
+class TestVerifyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_verify_cache-")
+        self.file_path = os.path.join(self.temp_dir, "pkg.rpm")
+        self.write(self.file_path, "package contents")
+        self.cache = VerifyCache(os.path.join(self.temp_dir, "verify.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def write(self, path, data):
+        f = open(path, "w")
+        f.write(data)
+        f.close()
+
+    def test_lookup_unchanged_file(self):
+        self.assertEquals(self.cache.lookup(self.file_path, "sha256"), None)
+        self.cache.record(self.file_path, "sha256", "abc")
+        self.assertEquals(self.cache.lookup(self.file_path, "sha256"), "abc")
+        self.assertEquals(self.cache.lookup(self.file_path, "md5"), None)
+        # pickled copies, as handed to an ActiveObject, see the same records
+        copy = pickle.loads(pickle.dumps(self.cache))
+        self.assertEquals(copy.lookup(self.file_path, "sha256"), "abc")
+        copy.close()
+
+    def test_lookup_modified_file(self):
+        self.cache.record(self.file_path, "sha256", "abc")
+        self.write(self.file_path, "modified package contents")
+        self.assertEquals(self.cache.lookup(self.file_path, "sha256"), None)
+        self.cache.record(self.file_path, "sha256", "def")
+        mtime = os.stat(self.file_path).st_mtime
+        os.utime(self.file_path, (mtime + 10, mtime + 10))
+        self.assertEquals(self.cache.lookup(self.file_path, "sha256"), None)
+
+    def test_batched_records(self):
+        self.cache.batch_size = 2
+        other = VerifyCache(self.cache.path)
+        paths = []
+        for name in ["a", "b", "c"]:
+            path = os.path.join(self.temp_dir, name)
+            self.write(path, name)
+            paths.append(path)
+        self.cache.record(paths[0], "sha256", "a")
+        # held back until the batch is full, yet seen by the thread which recorded it
+        self.assertEquals(self.cache.lookup(paths[0], "sha256"), "a")
+        self.assertEquals(other.lookup(paths[0], "sha256"), None)
+        self.cache.record(paths[1], "sha256", "b")
+        self.assertEquals(other.lookup(paths[0], "sha256"), "a")
+        self.assertEquals(other.lookup(paths[1], "sha256"), "b")
+        self.cache.record(paths[2], "sha256", "c")
+        self.assertEquals(other.lookup(paths[2], "sha256"), None)
+        self.cache.close()
+        self.assertEquals(other.lookup(paths[2], "sha256"), "c")
+        other.close()
+
+    def test_prune(self):
+        self.cache.max_entries = 2
+        for name in ["a", "b", "c"]:
+            path = os.path.join(self.temp_dir, name)
+            self.write(path, name)
+            self.cache.record(path, "sha256", name)
+            time.sleep(0.01)
+        self.assertEquals(self.cache.prune(), 1)
+        self.assertEquals(self.cache.lookup(os.path.join(self.temp_dir, "a"), "sha256"), None)
+        self.assertEquals(self.cache.lookup(os.path.join(self.temp_dir, "c"), "sha256"), "c")
+
+if __name__ == '__main__':
+    unittest.main()
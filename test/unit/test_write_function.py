@@ -16,6 +16,7 @@
 
 # Python
 import pycurl
+import hashlib
 import os
 import sys
 import unittest
@@ -52,4 +53,25 @@ class TestWriteFunction(unittest.TestCase):
         wf.cleanup()
         print os.stat(file_path).st_size
         assert(os.path.exists("/tmp/test.iso"))
-        assert(3244032 == os.stat("/tmp/test.iso").st_size)
\ No newline at end of file
+        assert(3244032 == os.stat("/tmp/test.iso").st_size)
+
+    def test_inline_checksum_on_resume(self):
+        file_path = "/tmp/test_write_function_resume.part"
+        data = "grinder" * 20000
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        f = open(file_path, "w")
+        f.write(data[:50000])
+        f.close()
+        try:
+            wf = WriteFunction(file_path, len(data), "sha256")
+            self.assertEquals(wf.offset, 50000)
+            wf.callback(data[50000:90000])
+            wf.callback(data[90000:])
+            digest = wf.hexdigest()
+            wf.cleanup()
+            self.assertEquals(digest, hashlib.sha256(data).hexdigest())
+            self.assertEquals(open(file_path).read(), data)
+        finally:
+            if os.path.exists(file_path):
+                os.remove(file_path)